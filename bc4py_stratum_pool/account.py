@@ -1,17 +1,39 @@
+from bc4py_stratum_pool.eventloop import LoopLocal
 from aiocontext import async_contextmanager
 from aiosqlite import connect, Connection, Cursor
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Deque, Tuple
 from logging import getLogger, INFO
+from collections import deque, defaultdict, namedtuple
+from datetime import datetime
 from binascii import a2b_hex
 from os import urandom
 from time import time
+import asyncio
+import gzip
+import csv
+import io
+import os
 
 log = getLogger(__name__)
 getLogger('aiosqlite').setLevel(INFO)
 
+# memory cache warmed at first_init_database
+account_cache: Dict[str, int] = dict()  # address -> account_id
+subscription_cache: Dict[int, Tuple[bytes, int]] = dict()  # top_id -> (extranonce, time)
+write_behind_que: Deque[Tuple[str, tuple]] = deque()  # (sql, params) waiting for commit
+balance_delta: Dict[int, float] = defaultdict(float)  # account_id -> unpaid share waiting for commit
+share_writing: Dict[int, int] = defaultdict(int)  # account_id -> share inserts not counted to balance yet
+share_written: Optional[set] = None  # accounts inserted while balance check reads
+balance_lock = LoopLocal(asyncio.Lock)
+next_account_id: Optional[int] = None
+SUBSCRIPTION_PREFIX = a2b_hex('deadbeefcafe00000000000000000000000000000000000000ff')
+
+# optional share shards, algorithm -> shard database path
+share_shards: Dict[int, str] = dict()
+
 
 @async_contextmanager
-async def create_db(path, strict=False) -> Connection:
+async def create_db(path, strict=False, attach_shards=False) -> Connection:
     """
     account database connector
     TODO: will be duplicate with bc4py's
@@ -19,6 +41,11 @@ async def create_db(path, strict=False) -> Connection:
     f_strict:
         Phantom read sometimes occur on IMMEDIATE, avoid it by EXCLUSIVE.
 
+    attach_shards:
+        When share shards are enabled, attach them and read `share` through a temp view.
+        The connection is read only (query_only), a write transaction locks all attached
+        databases and blocks share insert. Write by core and share database connections.
+
     journal_mode: (Do not use OFF mode)
         DELETE: delete journal file at end of transaction
         TRUNCATE: set journal file size to 0 at the end of transaction
@@ -44,6 +71,15 @@ async def create_db(path, strict=False) -> Connection:
     # synchronous mode
     await conn.execute("PRAGMA synchronous = NORMAL")
 
+    # share shards
+    if attach_shards and 0 < len(share_shards):
+        for algorithm, shard_path in share_shards.items():
+            await conn.execute(f"ATTACH DATABASE ? AS `share{algorithm}`", (shard_path,))
+        await conn.execute("CREATE TEMP VIEW `share` AS %s" % " UNION ALL ".join(
+            f"SELECT * FROM `{schema}`.`share`" for schema in share_schemas()))
+    if attach_shards:
+        await conn.execute("PRAGMA query_only = ON")
+
     # manage close process with contextmanager
     try:
         yield conn
@@ -51,15 +87,91 @@ async def create_db(path, strict=False) -> Connection:
         await conn.close()
 
 
-async def first_init_database(path):
+@async_contextmanager
+async def create_share_db(path, algorithm) -> Connection:
+    """
+    share writer connector, only open the algorithm's shard if enabled
+    a long transaction on other shards or core database does not block insert
+    """
+    async with create_db(share_shards.get(algorithm, path)) as conn:
+        yield conn
+
+
+def share_schemas() -> List[str]:
+    """
+    schema names having real `share` table
+    core database keeps shares of not sharded algorithms
+    """
+    return ['main'] + [f"share{algorithm}" for algorithm in share_shards]
+
+
+def share_db_paths(path) -> List[str]:
+    """database files having real `share` table"""
+    return [path] + list(share_shards.values())
+
+
+def get_shard_path(path, algorithm) -> str:
+    """pool.db -> pool.share5.db"""
+    base, ext = os.path.splitext(path)
+    return f"{base}.share{algorithm}{ext or '.db'}"
+
+
+SHARE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS `share` (
+`time` REAL PRIMARY KEY,
+`account_id` INTEGER NOT NULL,
+`algorithm` INTEGER NOT NULL,
+`blockhash` BLOB,
+`share` REAL NOT NULL,
+`payout_id` INTEGER NOT NULL
+)"""
+
+
+async def migrate_shard_shares(db: Connection, algorithm, shard_path) -> int:
+    """move the algorithm's shares of core database to the shard"""
+    cur = await db.cursor()
+    await cur.execute("SELECT COUNT(*) FROM `share` WHERE `algorithm`=?", (algorithm,))
+    count, = await cur.fetchone()
+    if count == 0:
+        return 0
+    await cur.execute("ATTACH DATABASE ? AS `shard`", (shard_path,))
+    try:
+        await cur.execute("""
+        INSERT OR IGNORE INTO `shard`.`share` SELECT * FROM `main`.`share` WHERE `algorithm`=?
+        """, (algorithm,))
+        await cur.execute("""
+        DELETE FROM `main`.`share` WHERE `algorithm`=? AND `time` IN (SELECT `time` FROM `shard`.`share`)
+        """, (algorithm,))
+        await db.commit()
+    except BaseException:
+        await db.rollback()
+        raise
+    finally:
+        await cur.execute("DETACH DATABASE `shard`")
+    log.info(f"move {count} shares to shard algorithm={algorithm}")
+    return count
+
+
+async def first_init_database(path, shard_algorithms=None):
     """
     initialize database
 
     account: get address by account_id
     share: get share with time range
     transaction: get payout transaction history
+
+    shard_algorithms:
+        split `share` table into each algorithm's database file,
+        accounts, transactions and other algorithm's shares are kept in core database
     """
     try:
+        for algorithm in shard_algorithms or ():
+            shard_path = get_shard_path(path, algorithm)
+            async with create_db(shard_path) as db:
+                await db.execute(SHARE_TABLE_SQL)
+                await db.commit()
+            share_shards[algorithm] = shard_path
+            log.info(f"enable share shard algorithm={algorithm} path={shard_path}")
         async with create_db(path) as db:
             cur = await db.cursor()
             await cur.execute("""
@@ -74,15 +186,7 @@ async def first_init_database(path):
             `extranonce` BLOB NOT NULL,
             `time` INTEGER NOT NULL
             )""")
-            await cur.execute("""
-            CREATE TABLE IF NOT EXISTS `share` (
-            `time` REAL PRIMARY KEY,
-            `account_id` INTEGER NOT NULL,
-            `algorithm` INTEGER NOT NULL,
-            `blockhash` BLOB,
-            `share` REAL NOT NULL,
-            `payout_id` INTEGER NOT NULL
-            )""")
+            await cur.execute(SHARE_TABLE_SQL)
             await cur.execute("""
             CREATE TABLE IF NOT EXISTS `transaction` (
             `id` INTEGER PRIMARY KEY,
@@ -92,30 +196,160 @@ async def first_init_database(path):
             `end` INTEGER NOT NULL,
             `time` INTEGER NOT NULL
             )""")
+            await cur.execute("""
+            CREATE TABLE IF NOT EXISTS `mined_block` (
+            `hash` BLOB PRIMARY KEY,
+            `time` REAL NOT NULL,
+            `algorithm` INTEGER NOT NULL,
+            `height` INTEGER NOT NULL,
+            `reward` INTEGER,
+            `confirmations` INTEGER NOT NULL,
+            `status` INTEGER NOT NULL,
+            `payout_id` INTEGER NOT NULL
+            )""")
+            await cur.execute("""
+            CREATE TABLE IF NOT EXISTS `balance` (
+            `account_id` INTEGER PRIMARY KEY,
+            `pending_share` REAL NOT NULL,
+            `pending_amount` INTEGER NOT NULL,
+            `total_paid` INTEGER NOT NULL,
+            `last_payout` INTEGER
+            )""")
             await cur.execute("CREATE INDEX IF NOT EXISTS `address_index` ON `account` (`address`)")
+            await cur.execute("CREATE INDEX IF NOT EXISTS `status_index` ON `mined_block` (`status`, `payout_id`)")
             await cur.execute("CREATE INDEX IF NOT EXISTS `txhash_index` ON `transaction` (`txhash`)")
             await cur.execute("CREATE INDEX IF NOT EXISTS `time_index` ON `transaction` (`time`)")
+            await warm_cache(cur)
+            await db.commit()
+            # move shares recoded before the shard is enabled
+            for algorithm, shard_path in share_shards.items():
+                await migrate_shard_shares(db, algorithm, shard_path)
+        # recover mined_block from shares recoded before the table exists
+        async with create_db(path, attach_shards=True) as db:
+            cur = await db.cursor()
+            await cur.execute("""
+            SELECT `blockhash`, `time`, `algorithm` FROM `share`
+            WHERE `blockhash` IS NOT NULL AND `payout_id` = 0
+            """)
+            mined_shares = await cur.fetchall()
+        async with create_db(path) as db:
+            cur = await db.cursor()
+            for blockhash, ntime, algorithm in mined_shares:
+                await insert_new_mined_block(
+                    cur=cur, blockhash=blockhash, algorithm=algorithm, height=0, payout_id=0, ntime=ntime)
+            await db.commit()
     except Exception:
         log.error("database init exception", exc_info=True)
     log.info("finish init database")
 
 
-async def cleanup_database(path, past=60*24*60):
-    """cleanup old data from database"""
+async def cleanup_database(path, past=60*24*3600):
+    """cleanup old data from database, same as prune_database"""
     try:
-        async with create_db(path) as db:
-            cur = await db.cursor()
-            # auto clean data
-            time_limit = int(time()) - past
+        await prune_database(path, past=past)
+    except Exception:
+        log.error("database cleanup exception", exc_info=True)
+
+
+PruneResult = namedtuple('PruneResult', ['rows', 'archived', 'bytes', 'max_lock_time'])
+
+
+async def prune_database(path, past=60*24*3600, chunk_size=500, archive_dir=None, interval=0.05) -> PruneResult:
+    """
+    cleanup old data from database by small chunks
+    lock is released between chunks, share insert is not blocked for a long time
+
+    shares still owed are never pruned, unpaid (`payout_id`=0) and claimed by a payout not sent yet.
+    `balance` is not touched, it is the running total and does not depend on old shares.
+
+    archive_dir:
+        pruned shares are appended to date-partitioned `share-YYYY-MM-DD.csv.gz` before delete,
+        a crash between archive and delete may write duplicate lines
+    """
+    time_limit = int(time()) - past
+    rows = archived = reclaimed = 0
+    max_lock_time = 0.0
+    async with create_db(path) as db:
+        cur = await db.cursor()
+        unsent_ids = await read_unsent_payout_ids(cur)
+        free_before = await read_freelist_bytes(cur)
+        # subscription, `id` is rowid
+        while True:
             await cur.execute("""
-            DELETE FROM `subscription` WHERE `time` < ?
-            """, (time_limit,))
+            SELECT `id` FROM `subscription` WHERE `time` < ? ORDER BY `id` LIMIT ?
+            """, (time_limit, chunk_size))
+            data = await cur.fetchall()
+            if len(data) == 0:
+                break
+            begin = time()
             await cur.execute("""
-            DELETE FROM `share` WHERE `time` < ?
-            """, (time_limit,))
+            DELETE FROM `subscription` WHERE ? <= `id` AND `id` <= ? AND `time` < ?
+            """, (data[0][0], data[-1][0], time_limit))
+            rows += cur.rowcount
             await db.commit()
-    except Exception:
-        log.error("database cleanup exception", exc_info=True)
+            max_lock_time = max(max_lock_time, time() - begin)
+            await asyncio.sleep(interval)
+        reclaimed += await read_freelist_bytes(cur) - free_before
+    # share, implicit rowid is increased by insert order
+    # open each shard one by one, not to lock other shards
+    paid_condition = "`payout_id` != 0 AND `payout_id` NOT IN (%s)" % ",".join("?" * len(unsent_ids))
+    for share_path in share_db_paths(path):
+        async with create_db(share_path) as db:
+            cur = await db.cursor()
+            free_before = await read_freelist_bytes(cur)
+            while True:
+                await cur.execute("""
+                SELECT `rowid`, `time`, `account_id`, `algorithm`, `blockhash`, `share`, `payout_id`
+                FROM `share` WHERE `time` < ? AND %s ORDER BY `rowid` LIMIT ?
+                """ % paid_condition, (time_limit, *unsent_ids, chunk_size))
+                data = await cur.fetchall()
+                if len(data) == 0:
+                    break
+                if archive_dir:
+                    await asyncio.get_event_loop().run_in_executor(
+                        None, write_share_archive, archive_dir, [row[1:] for row in data])
+                    archived += len(data)
+                begin = time()
+                await cur.execute("""
+                DELETE FROM `share` WHERE ? <= `rowid` AND `rowid` <= ? AND `time` < ? AND %s
+                """ % paid_condition, (data[0][0], data[-1][0], time_limit, *unsent_ids))
+                rows += cur.rowcount
+                await db.commit()
+                max_lock_time = max(max_lock_time, time() - begin)
+                await asyncio.sleep(interval)
+            reclaimed += await read_freelist_bytes(cur) - free_before
+    for top_id, (_, ntime) in list(subscription_cache.items()):
+        if ntime < time_limit:
+            del subscription_cache[top_id]
+    result = PruneResult(rows, archived, max(0, reclaimed), max_lock_time)
+    log.info(f"prune database rows={result.rows} archived={result.archived} "
+             f"bytes={result.bytes} max_lock={round(result.max_lock_time * 1000, 1)}mS")
+    return result
+
+
+async def read_freelist_bytes(cur: Cursor) -> int:
+    """unused page size in database file"""
+    await cur.execute("PRAGMA freelist_count")
+    freelist_count = await cur.fetchone()
+    await cur.execute("PRAGMA page_size")
+    page_size = await cur.fetchone()
+    return freelist_count[0] * page_size[0]
+
+
+def write_share_archive(archive_dir, rows):
+    """append shares to gzip csv partitioned by date (blocking, run on executor)"""
+    partitions = defaultdict(list)
+    for ntime, account_id, algorithm, blockhash, share, payout_id in rows:
+        date = datetime.utcfromtimestamp(ntime).strftime('%Y-%m-%d')
+        partitions[date].append((
+            ntime, account_id, algorithm, blockhash.hex() if blockhash else '', share, payout_id))
+    os.makedirs(archive_dir, exist_ok=True)
+    for date, lines in partitions.items():
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(lines)
+        # gzip allows appending new members to the file
+        with gzip.open(os.path.join(archive_dir, f"share-{date}.csv.gz"), 'at') as fp:
+            fp.write(buffer.getvalue())
 
 
 """account
@@ -124,6 +358,11 @@ async def cleanup_database(path, past=60*24*60):
 
 async def read_address2account_id(cur: Cursor, address, create_if_missing=False) -> int:
     """get id from address, create if missing as option"""
+    if address in account_cache:
+        return account_cache[address]
+    if create_if_missing and is_cache_ready():
+        # cache is the authority of account_id when warmed
+        return cached_address2account_id(address)
     await cur.execute("""
     SELECT `id` FROM `account` WHERE `address`=?
     """, (address,))
@@ -138,6 +377,10 @@ async def read_address2account_id(cur: Cursor, address, create_if_missing=False)
 
 async def read_account_id2address(cur: Cursor, account_id) -> Optional[str]:
     """get address by account_id"""
+    for sql, params in write_behind_que:
+        # not committed yet
+        if sql == INSERT_ACCOUNT_SQL and params[0] == account_id:
+            return params[1]
     await cur.execute("""
     SELECT `address` FROM `account` WHERE `id`=?
     """, (account_id,))
@@ -181,7 +424,247 @@ async def insert_new_subscription(cur: Cursor, extranonce):
     INSERT INTO `subscription` (`id`, `extranonce`, `time`) VALUES (?,?,?)
     """, (int.from_bytes(top_id, 'big'), extranonce, int(time())))
     # 26 + 6 = 32 bytes
-    return a2b_hex('deadbeefcafe00000000000000000000000000000000000000ff') + top_id
+    return SUBSCRIPTION_PREFIX + top_id
+
+
+"""cache
+"""
+
+INSERT_ACCOUNT_SQL = """
+INSERT OR IGNORE INTO `account` (`id`, `address`, `time`) VALUES (?,?,?)
+"""
+INSERT_SUBSCRIPTION_SQL = """
+INSERT OR IGNORE INTO `subscription` (`id`, `extranonce`, `time`) VALUES (?,?,?)
+"""
+
+
+async def warm_cache(cur: Cursor):
+    """load account & subscription tables to memory"""
+    global next_account_id
+    account_cache.clear()
+    subscription_cache.clear()
+    # descending order, first account is kept on duplicate address
+    await cur.execute("""
+    SELECT `id`, `address` FROM `account` ORDER BY `id` DESC
+    """)
+    async for account_id, address in cur:
+        account_cache[address] = account_id
+    await cur.execute("""
+    SELECT `id`, `extranonce`, `time` FROM `subscription`
+    """)
+    async for top_id, extranonce, ntime in cur:
+        subscription_cache[top_id] = (extranonce, ntime)
+    await cur.execute("""
+    SELECT MAX(`id`) FROM `account`
+    """)
+    max_id = await cur.fetchone()
+    next_account_id = (max_id[0] or 0) + 1
+    log.info(f"warm cache accounts={len(account_cache)} subscriptions={len(subscription_cache)}")
+
+
+def is_cache_ready() -> bool:
+    """cache is warmed and works as the authority of new accounts"""
+    return next_account_id is not None
+
+
+def cached_address2account_id(address) -> int:
+    """get id from memory, allocate new id and recode by write-behind if missing"""
+    global next_account_id
+    account_id = account_cache.get(address)
+    if account_id is not None:
+        return account_id
+    if next_account_id is None:
+        raise DatabaseError('account cache is not warmed')
+    account_id = next_account_id
+    next_account_id += 1
+    account_cache[address] = account_id
+    write_behind_que.append((INSERT_ACCOUNT_SQL, (account_id, address, int(time()))))
+    return account_id
+
+
+def cached_new_subscription(extranonce) -> bytes:
+    """recode extranonce and subscription_id on memory, commit by write-behind"""
+    top_id = urandom(6)
+    ntime = int(time())
+    subscription_cache[int.from_bytes(top_id, 'big')] = (extranonce, ntime)
+    write_behind_que.append((INSERT_SUBSCRIPTION_SQL, (int.from_bytes(top_id, 'big'), extranonce, ntime)))
+    return SUBSCRIPTION_PREFIX + top_id
+
+
+def cached_subscription_id2extranonce(subscription_id: bytes) -> Optional[bytes]:
+    """get extranonce_1 from memory, None if not cached"""
+    data = subscription_cache.get(int.from_bytes(subscription_id[26:32], 'big'))
+    if data is None:
+        return None
+    return data[0]
+
+
+def get_balance_lock() -> asyncio.Lock:
+    """balance writers (flush, payout) and balance check"""
+    return balance_lock.get()
+
+
+async def flush_write_behind(path) -> int:
+    """
+    commit queued inserts and balance deltas by one transaction
+    shielded, a cancelled caller does not stop the commit between database and queue
+    """
+    if len(write_behind_que) == 0 and len(balance_delta) == 0:
+        return 0
+    return await asyncio.shield(_flush_write_behind(path))
+
+
+async def _flush_write_behind(path) -> int:
+    async with get_balance_lock():
+        # keep rows on memory until committed, lookups (ex. account_id -> address) find them
+        rows = list(write_behind_que)
+        deltas = dict(balance_delta)
+        # group by sql to use executemany
+        grouped = defaultdict(list)
+        for sql, params in rows:
+            grouped[sql].append(params)
+        async with create_db(path) as db:
+            for sql, params_list in grouped.items():
+                await db.executemany(sql, params_list)
+            await db.executemany(ADD_BALANCE_SHARE_SQL, deltas.items())
+            await db.commit()
+        # committed, remove them but not the ones added while flushing
+        for _ in range(len(rows)):
+            write_behind_que.popleft()
+        for account_id, share in deltas.items():
+            balance_delta[account_id] -= share
+            if balance_delta[account_id] == 0.0:
+                del balance_delta[account_id]
+        return len(rows) + len(deltas)
+
+
+"""balance
+"""
+
+ADD_BALANCE_SHARE_SQL = """
+INSERT INTO `balance` (`account_id`, `pending_share`, `pending_amount`, `total_paid`)
+VALUES (?, ?, 0, 0) ON CONFLICT(`account_id`) DO UPDATE SET `pending_share`=`pending_share`+excluded.`pending_share`
+"""
+
+
+def add_balance_share(account_id, share):
+    """count unpaid share on memory, commit by write-behind"""
+    balance_delta[account_id] += share
+
+
+def begin_share_writing(account_ids):
+    """share insert in flight, balance check skips these accounts until counted"""
+    for account_id in account_ids:
+        share_writing[account_id] += 1
+
+
+def end_share_writing(account_ids):
+    for account_id in account_ids:
+        share_writing[account_id] -= 1
+        if share_writing[account_id] <= 0:
+            del share_writing[account_id]
+        if share_written is not None:
+            share_written.add(account_id)
+
+
+async def read_account_balance(cur: Cursor, account_id) -> Optional[tuple]:
+    """get (pending_share, pending_amount, total_paid, last_payout)"""
+    await cur.execute("""
+    SELECT `pending_share`, `pending_amount`, `total_paid`, `last_payout` FROM `balance` WHERE `account_id`=?
+    """, (account_id,))
+    return await cur.fetchone()
+
+
+async def update_balance_claimed(cur: Cursor, account_shares: Dict[int, float]):
+    """shares are claimed by payout, remove from pending"""
+    await cur.executemany(ADD_BALANCE_SHARE_SQL, [
+        (account_id, -share) for account_id, share in account_shares.items()])
+
+
+async def update_balance_paid(cur: Cursor, account_amounts: Dict[int, int]):
+    """add sent amount"""
+    ntime = int(time())
+    await cur.executemany("""
+    INSERT INTO `balance` (`account_id`, `pending_share`, `pending_amount`, `total_paid`, `last_payout`)
+    VALUES (?, 0.0, 0, ?, ?) ON CONFLICT(`account_id`) DO UPDATE SET
+    `total_paid`=`total_paid`+excluded.`total_paid`, `last_payout`=excluded.`last_payout`
+    """, [(account_id, amount, ntime) for account_id, amount in account_amounts.items()])
+
+
+async def update_balance_estimate(cur: Cursor, unpaid_amount):
+    """distribute unpaid amount of settled blocks by pending share"""
+    await cur.execute("""
+    SELECT SUM(`pending_share`) FROM `balance` WHERE 0 < `pending_share`
+    """)
+    total_share = (await cur.fetchone())[0]
+    if not total_share:
+        await cur.execute("UPDATE `balance` SET `pending_amount`=0")
+        return
+    await cur.execute("""
+    UPDATE `balance` SET `pending_amount`=CAST(MAX(0.0, `pending_share`) * ? / ? AS INTEGER)
+    """, (unpaid_amount, total_share))
+
+
+async def check_balance(cur: Cursor, share_cur: Cursor, repair=False) -> int:
+    """
+    compare balance table with raw share & transaction tables, rewrite as option
+    cur: core database, share_cur: read only by `attach_shards`
+    unpaid shares waiting for write-behind are counted, accounts with share inserts
+    in flight are skipped, call with `get_balance_lock()` so that no flush or payout runs
+    paid amount is never decreased, its shares may be already pruned
+    return number of inconsistent accounts
+    """
+    global share_written
+    expected = defaultdict(lambda: [0.0, 0, None])
+    share_written = set(share_writing)
+    try:
+        # pending shares
+        await share_cur.execute("""
+        SELECT `account_id`, SUM(`share`) FROM `share` WHERE `payout_id`=0 GROUP BY `account_id`
+        """)
+        for account_id, share in await share_cur.fetchall():
+            expected[account_id][0] = share
+        # sent payouts, split by share ratio same as sending
+        await cur.execute("""
+        SELECT `id`, `amount`, `time` FROM `transaction` WHERE length(`txhash`)=32
+        """)
+        for payout_id, amount, ntime in await cur.fetchall():
+            account_shares = await read_payout_account_shares(cur=share_cur, payout_id=payout_id)
+            total_share = sum(account_shares.values())
+            for account_id, share in account_shares.items():
+                expected[account_id][1] += int(amount * share / total_share)
+                expected[account_id][2] = max(ntime, expected[account_id][2] or 0)
+        # compare
+        await cur.execute("""
+        SELECT `account_id`, `pending_share`, `total_paid`, `last_payout` FROM `balance`
+        """)
+        actual = {account_id: (share, paid, last) for account_id, share, paid, last in await cur.fetchall()}
+        deltas = dict(balance_delta)
+    finally:
+        skipped = share_written | set(share_writing)
+        share_written = None
+    fixed = list()
+    for account_id in set(expected) | set(actual) | set(deltas):
+        if account_id in skipped:
+            continue
+        share, paid, last = expected.get(account_id, (0.0, 0, None))
+        old_share, old_paid, old_last = actual.get(account_id, (0.0, 0, None))
+        delta = deltas.get(account_id, 0.0)
+        paid = max(paid, old_paid)
+        last = max(last or 0, old_last or 0) or None
+        if abs(share - old_share - delta) < 1e-9 and paid == old_paid and last == old_last:
+            continue
+        # write-behind adds delta later
+        fixed.append((account_id, share - delta, paid, last))
+    if repair and 0 < len(fixed):
+        await cur.executemany("""
+        INSERT INTO `balance` (`account_id`, `pending_share`, `pending_amount`, `total_paid`, `last_payout`)
+        VALUES (?, ?, 0, ?, ?) ON CONFLICT(`account_id`) DO UPDATE SET
+        `pending_share`=excluded.`pending_share`, `total_paid`=excluded.`total_paid`,
+        `last_payout`=excluded.`last_payout`
+        """, fixed)
+    log.info(f"check balance inconsistent={len(fixed)} skipped={len(skipped)} repair={repair}")
+    return len(fixed)
 
 
 """share
@@ -268,35 +751,159 @@ async def iter_latest_mined_shares(cur: Cursor):
             yield ntime, blockhash
 
 
-async def insert_new_share(cur: Cursor, account_id, algorithm, blockhash, share, payout_id):
-    """recode account's submit share"""
+async def insert_new_share(cur: Cursor, account_id, algorithm, blockhash, share, payout_id, ntime=None):
+    """recode account's submit share, cursor by create_share_db()"""
     await cur.execute("""
     INSERT INTO `share` (
     `time`, `account_id`, `algorithm`, `blockhash`, `share`, `payout_id`
     ) VALUES (?,?,?,?,?,?)
-    """, (time(), account_id, algorithm, blockhash, share, payout_id))
+    """, (time() if ntime is None else ntime, account_id, algorithm, blockhash, share, payout_id))
 
 
-async def update_shares_as_paid(cur: Cursor, payout_id, begin, end, accounts):
-    """mark paid shares"""
+async def update_shares_as_paid(cur: Cursor, payout_id, begin, end, accounts) -> int:
+    """mark paid shares, accounts are joined by temp table, cursor of one share database"""
     for uuid in accounts:
         assert isinstance(uuid, int)
     await cur.execute("""
+    CREATE TEMP TABLE IF NOT EXISTS `payout_account` (`id` INTEGER PRIMARY KEY)
+    """)
+    await cur.execute("DELETE FROM temp.`payout_account`")
+    await cur.executemany("""
+    INSERT OR IGNORE INTO temp.`payout_account` (`id`) VALUES (?)
+    """, [(uuid,) for uuid in accounts])
+    await cur.execute("""
     UPDATE `share` SET `payout_id`=?
-    WHERE ? <= `time` AND `time` < ? AND `payout_id`=0 AND `account_id` IN (%s)
-    """ % ', '.join(map(str, accounts)), (payout_id, begin, end))
+    WHERE ? <= `time` AND `time` < ? AND `payout_id`=0
+    AND `account_id` IN (SELECT `id` FROM temp.`payout_account`)
+    """, (payout_id, begin, end))
+    return cur.rowcount
+
+
+async def mark_shares_as_paid(path, batches: List[Tuple[int, List[int]]], begin, end) -> int:
+    """
+    mark shares of each payout batch [(payout_id, accounts), ..]
+    a short transaction by batch on each share database, share insert waits only a moment
+    """
+    count = 0
+    for share_path in share_db_paths(path):
+        async with create_db(share_path) as db:
+            cur = await db.cursor()
+            for payout_id, accounts in batches:
+                count += await update_shares_as_paid(
+                    cur=cur, payout_id=payout_id, begin=begin, end=end, accounts=accounts)
+                await db.commit()
+    return count
 
 
-async def revert_paid_shares(cur: Cursor, begin, end, payout_id):
-    """revert paid shares"""
+async def read_payout_account_shares(cur: Cursor, payout_id) -> Dict[int, float]:
+    """get each account's share marked by payout_id"""
+    await cur.execute("""
+    SELECT `account_id`, SUM(`share`) FROM `share` WHERE `payout_id`=? GROUP BY `account_id`
+    """, (payout_id,))
+    return {account_id: share for account_id, share in await cur.fetchall()}
+
+
+async def revert_paid_shares(cur: Cursor, begin, end, payout_id) -> int:
+    """revert paid shares, cursor of one share database"""
     await cur.execute("""
     UPDATE `share` SET `payout_id`=0 WHERE ? <= `time` AND `time` < ? AND `payout_id`=?
     """, (begin, end, payout_id))
+    return cur.rowcount
+
+
+async def revert_planning_payouts(path) -> int:
+    """
+    remove batches not finished planning (stopped between marking shares and commit)
+    their shares are unmarked, mined blocks & balance are not claimed yet
+    """
+    async with create_db(path) as db:
+        cur = await db.cursor()
+        await cur.execute("""
+        SELECT `id`, `begin`, `end` FROM `transaction` WHERE `txhash`=?
+        """, (PLANNING_TXHASH,))
+        planning = await cur.fetchall()
+    if len(planning) == 0:
+        return 0
+    for share_path in share_db_paths(path):
+        async with create_db(share_path) as db:
+            cur = await db.cursor()
+            for payout_id, begin, end in planning:
+                await revert_paid_shares(cur=cur, begin=begin - 1, end=end + 1, payout_id=payout_id)
+            await db.commit()
+    async with create_db(path) as db:
+        cur = await db.cursor()
+        await cur.executemany("""
+        DELETE FROM `transaction` WHERE `id`=? AND `txhash`=?
+        """, [(payout_id, PLANNING_TXHASH) for payout_id, _, _ in planning])
+        await db.commit()
+    log.warning(f"revert unfinished payout plan ids={[payout_id for payout_id, _, _ in planning]}")
+    return len(planning)
+
+
+"""mined block
+"""
+
+MINED_BLOCK_PENDING = 0
+MINED_BLOCK_SETTLED = 1
+MINED_BLOCK_ORPHAN = 2
+
+
+async def insert_new_mined_block(cur: Cursor, blockhash, algorithm, height, payout_id, ntime=None):
+    """recode mined block at submit, status is updated by tracker"""
+    await cur.execute("""
+    INSERT OR IGNORE INTO `mined_block` (
+    `hash`, `time`, `algorithm`, `height`, `reward`, `confirmations`, `status`, `payout_id`
+    ) VALUES (?,?,?,?,NULL,0,?,?)
+    """, (blockhash, time() if ntime is None else ntime, algorithm, height, MINED_BLOCK_PENDING, payout_id))
+
+
+async def read_pending_mined_blocks(cur: Cursor) -> List[tuple]:
+    """get not final blocks [(hash, height, confirmations), ..]"""
+    await cur.execute("""
+    SELECT `hash`, `height`, `confirmations` FROM `mined_block` WHERE `status`=?
+    """, (MINED_BLOCK_PENDING,))
+    return await cur.fetchall()
+
+
+async def update_mined_block(cur: Cursor, blockhash, height, confirmations, status, reward=None):
+    """update confirmation state"""
+    await cur.execute("""
+    UPDATE `mined_block` SET `height`=?, `confirmations`=?, `status`=?, `reward`=? WHERE `hash`=?
+    """, (height, confirmations, status, reward, blockhash))
+
+
+async def read_unpaid_final_blocks(cur: Cursor) -> List[tuple]:
+    """get settled or orphan blocks not paid [(hash, time, status, reward), ..]"""
+    await cur.execute("""
+    SELECT `hash`, `time`, `status`, `reward` FROM `mined_block`
+    WHERE `status`!=? AND `payout_id`=0 ORDER BY `time`
+    """, (MINED_BLOCK_PENDING,))
+    return await cur.fetchall()
+
+
+async def update_mined_blocks_as_paid(cur: Cursor, payout_id, blockhashes: List[bytes]) -> int:
+    """mark final blocks counted in the payout as paid"""
+    count = 0
+    for blockhash in blockhashes:
+        await cur.execute("""
+        UPDATE `mined_block` SET `payout_id`=? WHERE `hash`=? AND `status`!=? AND `payout_id`=0
+        """, (payout_id, blockhash, MINED_BLOCK_PENDING))
+        count += cur.rowcount
+    return count
 
 
 """transaction
 """
 
+# txhash of planned payout before send
+PENDING_TXHASH = b''
+# txhash of payout inserted but shares are not marked yet
+PLANNING_TXHASH = b'planning'
+# txhash while asking node to send, recoded before the request
+SENDING_TXHASH = b'sending'
+# txhash of payout whose send result is unknown, reconcile with wallet and never resend
+PARKED_TXHASH = b'parked'
+
 
 async def read_payout2txhash(cur: Cursor, payout_id):
     """get txhash by payout id"""
@@ -340,6 +947,30 @@ async def iter_payout_transactions(cur: Cursor):
         yield data
 
 
+async def read_unsent_payout_ids(cur: Cursor) -> List[int]:
+    """get payout ids without a sent txhash, their shares are still owed"""
+    await cur.execute("""
+    SELECT `id` FROM `transaction` WHERE length(`txhash`)!=32
+    """)
+    return [payout_id for (payout_id,) in await cur.fetchall()]
+
+
+async def read_pending_payouts(cur: Cursor, state=PENDING_TXHASH) -> List[tuple]:
+    """get planned payouts not sent yet [(id, amount, begin, end), ..], or of other state"""
+    await cur.execute("""
+    SELECT `id`, `amount`, `begin`, `end` FROM `transaction` WHERE `txhash`=? ORDER BY `id`
+    """, (state,))
+    return await cur.fetchall()
+
+
+async def update_payout_txhash(cur: Cursor, payout_id, txhash, state=PENDING_TXHASH) -> bool:
+    """recode sent txhash of planned payout, or move to the next state, return updated"""
+    await cur.execute("""
+    UPDATE `transaction` SET `txhash`=?, `time`=? WHERE `id`=? AND `txhash`=?
+    """, (txhash, int(time()), payout_id, state))
+    return cur.rowcount == 1
+
+
 async def insert_new_transaction(cur: Cursor, txhash, amount, begin, end) -> int:
     await cur.execute("""
     INSERT INTO `transaction` (`txhash`, `amount`, `begin`, `end`, `time`)
@@ -354,12 +985,37 @@ class DatabaseError(Exception):
 
 __all__ = [
     "create_db",
+    "create_share_db",
+    "share_schemas",
+    "share_db_paths",
+    "migrate_shard_shares",
     "first_init_database",
+    "cleanup_database",
+    "PruneResult",
+    "prune_database",
     "read_address2account_id",
     "read_account_id2address",
     "insert_new_account",
     "read_subscription_id2extranonce",
     "insert_new_subscription",
+    "account_cache",
+    "subscription_cache",
+    "write_behind_que",
+    "warm_cache",
+    "is_cache_ready",
+    "cached_address2account_id",
+    "cached_new_subscription",
+    "cached_subscription_id2extranonce",
+    "flush_write_behind",
+    "add_balance_share",
+    "begin_share_writing",
+    "end_share_writing",
+    "get_balance_lock",
+    "read_account_balance",
+    "update_balance_claimed",
+    "update_balance_paid",
+    "update_balance_estimate",
+    "check_balance",
     "read_total_unpaid_shares",
     "read_account_unpaid_shares",
     "read_distribution_shares",
@@ -369,11 +1025,29 @@ __all__ = [
     "iter_latest_mined_shares",
     "insert_new_share",
     "update_shares_as_paid",
+    "mark_shares_as_paid",
+    "read_payout_account_shares",
     "revert_paid_shares",
+    "revert_planning_payouts",
+    "MINED_BLOCK_PENDING",
+    "MINED_BLOCK_SETTLED",
+    "MINED_BLOCK_ORPHAN",
+    "insert_new_mined_block",
+    "read_pending_mined_blocks",
+    "update_mined_block",
+    "read_unpaid_final_blocks",
+    "update_mined_blocks_as_paid",
     "read_payout2txhash",
     "read_txhash2payout",
     "read_last_paid_txhash",
     "iter_payout_transactions",
+    "read_unsent_payout_ids",
+    "read_pending_payouts",
+    "update_payout_txhash",
+    "PENDING_TXHASH",
+    "PLANNING_TXHASH",
+    "SENDING_TXHASH",
+    "PARKED_TXHASH",
     "insert_new_transaction",
     "DatabaseError",
 ]
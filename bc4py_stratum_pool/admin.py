@@ -0,0 +1,128 @@
+from bc4py_stratum_pool.config import Const
+from bc4py_stratum_pool.metrics import DISPATCH_LATENCY, DISPATCH_ERRORS
+from bc4py_stratum_pool.profiler import *
+from bc4py_stratum_pool.autowork import parked_payouts, resolve_parked_payout
+from bc4py_stratum_pool.cluster import worker_metrics
+from bc4py_stratum_pool import link
+from aiohttp.web import Request
+from aiohttp import web
+from binascii import a2b_hex
+from logging import getLogger
+import hmac
+
+"""admin API, disabled until Const.ADMIN_TOKEN is set
+
+token by `X-Admin-Token` header or `token` query
+"""
+
+log = getLogger(__name__)
+PERCENTILES = (0.5, 0.9, 0.99)
+
+
+def check_admin_token(request: Request):
+    if Const.ADMIN_TOKEN is None:
+        raise web.HTTPNotFound()
+    token = request.headers.get('X-Admin-Token') or request.query.get('token', '')
+    if not hmac.compare_digest(token.encode(), Const.ADMIN_TOKEN.encode()):
+        raise web.HTTPForbidden(text='wrong admin token')
+
+
+async def admin_dispatch(request: Request):
+    """
+    per stratum method call counts, errors & latency percentiles by algorithm and port
+    include samples reported by worker processes
+    """
+    check_admin_token(request)
+    remote = worker_metrics().values()
+    latency = DISPATCH_LATENCY.merge_samples(
+        [DISPATCH_LATENCY.samples()] + [samples.get(DISPATCH_LATENCY.name, []) for samples in remote])
+    errors = DISPATCH_ERRORS.merge_samples(
+        [DISPATCH_ERRORS.samples()] + [samples.get(DISPATCH_ERRORS.name, []) for samples in remote])
+    data = list()
+    for (method, algorithm, port), child in sorted(latency.items(), key=str):
+        error = errors.get((method, algorithm, port))
+        data.append({
+            'method': method,
+            'algorithm': algorithm,
+            'port': port,
+            'count': child.count,
+            'errors': 0 if error is None else int(error.value),
+            'average': child.sum / child.count if child.count else None,
+            'percentiles': {str(q): child.quantile(q) for q in PERCENTILES},
+        })
+    return web.json_response(data)
+
+
+async def admin_profile(request: Request):
+    """
+    aggregated cProfile of sampled mining.submit, worker processes are profiled by link
+    ?every=N: profile 1-in-N submits, 0 to disable
+    ?reset=1: clear aggregated stats
+    ?sort=cumulative|tottime|ncalls
+    """
+    check_admin_token(request)
+    try:
+        every = request.query.get('every')
+        every = None if every is None else int(every)
+        reset = request.query.get('reset') == '1'
+        if every is not None or reset:
+            set_submit_profile(profile_stats['every'] if every is None else every, reset)
+        limit = int(request.query.get('limit', 40))
+    except ValueError:
+        raise web.HTTPBadRequest(text='every & limit must be int')
+    sort = request.query.get('sort', 'cumulative')
+    if sort not in ('cumulative', 'tottime', 'ncalls'):
+        raise web.HTTPBadRequest(text='sort must be cumulative, tottime or ncalls')
+    text = dump_submit_profile(sort, limit)
+    if link.link_hub is not None:
+        text = "== coordinator ==\n" + text
+        results = await link.link_hub.request_all(
+            'profile', {'every': every, 'reset': reset, 'sort': sort, 'limit': limit})
+        for name, result in sorted(results.items()):
+            if isinstance(result, Exception):
+                result = f"failed by {result!r}"
+            text += f"\n== worker {name} ==\n{result}"
+    return web.Response(text=text)
+
+
+async def admin_payouts(request: Request):
+    """parked payout batches, send result is unknown and waiting reconciliation"""
+    check_admin_token(request)
+    return web.json_response([
+        {'id': payout_id, 'pairs': payout_pairs, 'amount': sum(account_amounts.values())}
+        for payout_id, (payout_pairs, account_amounts) in sorted(parked_payouts.items())])
+
+
+async def admin_payouts_resolve(request: Request):
+    """
+    resolve parked payout after checking the wallet
+    ?id=N&txhash=HEX: recode as sent by the tx
+    ?id=N&resend=1: node did not send it, back to pending
+    """
+    check_admin_token(request)
+    try:
+        payout_id = int(request.query['id'])
+        txhash = request.query.get('txhash')
+        txhash = None if txhash is None else a2b_hex(txhash)
+    except (KeyError, ValueError):
+        raise web.HTTPBadRequest(text='id is required, txhash must be hex')
+    if txhash is None and request.query.get('resend') != '1':
+        raise web.HTTPBadRequest(text='txhash or resend=1 is required')
+    if txhash is not None and len(txhash) != 32:
+        raise web.HTTPBadRequest(text='txhash must be 32 bytes')
+    if not await resolve_parked_payout(payout_id, txhash):
+        raise web.HTTPNotFound(text=f"not found parked payout id={payout_id}")
+    log.warning(f"resolve parked payout id={payout_id} txhash={txhash and txhash.hex()}")
+    return web.json_response({'id': payout_id, 'txhash': txhash and txhash.hex(), 'resend': txhash is None})
+
+
+def setup_admin_routes(app: web.Application):
+    app.router.add_get('/admin/dispatch', admin_dispatch)
+    app.router.add_get('/admin/profile', admin_profile)
+    app.router.add_get('/admin/payouts', admin_payouts)
+    app.router.add_post('/admin/payouts/resolve', admin_payouts_resolve)
+
+
+__all__ = [
+    "setup_admin_routes",
+]
@@ -0,0 +1,213 @@
+from bc4py_stratum_pool.config import *
+from bc4py_stratum_pool.account import *
+from bc4py_stratum_pool.autowork import block_history_list, consensus_list
+from bc4py_stratum_pool.client import filter_clients
+from bc4py_stratum_pool.cluster import count_workers
+from bc4py_stratum_pool.stratum import stratum_list
+from bc4py_stratum_pool.timeseries import read_pool_status_range, select_resolution
+from bc4py.config import C
+from aiohttp.web import Request
+from aiohttp import web
+from expiringdict import ExpiringDict
+from collections import defaultdict, namedtuple
+from logging import getLogger
+from hashlib import sha1
+from time import time
+import json
+
+"""JSON stats API
+
+snapshots are rebuilt at most once per SNAPSHOT_SPAN and served as pre-serialized bytes
+"""
+
+log = getLogger(__name__)
+SNAPSHOT_SPAN = 10.0
+Snapshot = namedtuple('Snapshot', ['time', 'body', 'etag'])
+snapshot_cache: dict = dict()
+miner_snapshot_cache = ExpiringDict(max_len=10000, max_age_seconds=SNAPSHOT_SPAN)
+snapshot_stats = defaultdict(int)
+
+
+def create_snapshot(data) -> Snapshot:
+    body = json.dumps(data, separators=(',', ':')).encode()
+    return Snapshot(time(), body, '"%s"' % sha1(body).hexdigest()[:20])
+
+
+def snapshot_response(request: Request, snapshot: Snapshot) -> web.Response:
+    """response bytes or 304 by If-None-Match"""
+    headers = {
+        'ETag': snapshot.etag,
+        'Cache-Control': f"public, max-age={int(SNAPSHOT_SPAN)}",
+    }
+    if request.headers.get('If-None-Match') == snapshot.etag:
+        snapshot_stats['not_modified'] += 1
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=snapshot.body, content_type='application/json', headers=headers)
+
+
+def get_snapshot(key, builder) -> Snapshot:
+    """rebuild by builder if expired"""
+    snapshot = snapshot_cache.get(key)
+    if snapshot is None or SNAPSHOT_SPAN < time() - snapshot.time:
+        snapshot = snapshot_cache[key] = create_snapshot(builder())
+        snapshot_stats['rebuild'] += 1
+    else:
+        snapshot_stats['hit'] += 1
+    return snapshot
+
+
+def build_pool():
+    newest = pool_status_list[-1] if 0 < len(pool_status_list) else None
+    return {
+        'time': int(time()),
+        'hostname': Const.HOST_NAME,
+        'payout_method': Const.PAYOUT_METHOD,
+        'workers': sum(count_workers()[0].values()),
+        'pool_hashrate': dict(newest.pool_hashrate) if newest else {},
+        'network_hashrate': dict(newest.network_hashrate) if newest else {},
+        'share': newest.share if newest else 0.0,
+        'best_block': block_history_list[-1] if 0 < len(block_history_list) else None,
+    }
+
+
+def build_algorithms():
+    # local clients and reported by worker processes
+    workers, pool_hashrate = count_workers()
+    network_hashrate = dict(pool_status_list[-1].network_hashrate) if 0 < len(pool_status_list) else {}
+    distribution = dict()
+    for dist in reversed(distribution_list):
+        name = C.consensus2name[dist.algorithm]
+        if name not in distribution:
+            distribution[name] = len(dist.distribution)
+    return [
+        {
+            'algorithm': name,
+            'workers': workers[name],
+            'pool_hashrate': pool_hashrate[name],
+            'network_hashrate': network_hashrate.get(name, 0),
+            'distribution_outputs': distribution.get(name, 0),
+            'ports': [
+                {'port': stratum.port, 'difficulty': stratum.difficulty, 'variable_diff': stratum.variable_diff}
+                for stratum in stratum_list if stratum.algorithm == name],
+        }
+        for name in consensus_list]
+
+
+def build_blocks():
+    return [
+        {
+            'height': block.get('height'),
+            'hash': block.get('hash'),
+            'flag': block.get('flag'),
+            'time': block.get('time'),
+            'difficulty': block.get('difficulty'),
+        }
+        for block in reversed(block_history_list)]
+
+
+async def build_miner(address):
+    workers = [
+        {
+            'version': client.version,
+            'algorithm': client.consensus_name,
+            'difficulty': client.difficulty,
+            'hashrate': client.hashrate,
+            'accept': client.n_accept,
+            'reject': client.n_reject,
+        }
+        for client in filter_clients(address=address)]
+    balance = None
+    account_id = account_cache.get(address)
+    if account_id is not None:
+        async with create_db(Const.DATABASE_PATH) as db:
+            cur = await db.cursor()
+            data = await read_account_balance(cur=cur, account_id=account_id)
+        if data is not None:
+            pending_share, pending_amount, total_paid, last_payout = data
+            balance = {
+                'pending_share': pending_share,
+                'pending_amount': pending_amount,
+                'total_paid': total_paid,
+                'last_payout': last_payout,
+            }
+    distribution = dict()
+    for dist in reversed(distribution_list):
+        name = C.consensus2name[dist.algorithm]
+        if name in distribution:
+            continue
+        distribution[name] = sum(ratio for dist_address, ratio in dist.distribution if dist_address == address)
+    return {
+        'address': address,
+        'time': int(time()),
+        'workers': workers,
+        'balance': balance,
+        'distribution': distribution,
+    }
+
+
+async def api_pool(request: Request):
+    return snapshot_response(request, get_snapshot('pool', build_pool))
+
+
+async def api_algorithms(request: Request):
+    return snapshot_response(request, get_snapshot('algorithms', build_algorithms))
+
+
+async def api_blocks(request: Request):
+    return snapshot_response(request, get_snapshot('blocks', build_blocks))
+
+
+async def api_miner(request: Request):
+    address = request.match_info['address']
+    if len(address) > 100:
+        raise web.HTTPBadRequest(text='too long address')
+    snapshot = miner_snapshot_cache.get(address)
+    if snapshot is None:
+        snapshot = create_snapshot(await build_miner(address))
+        miner_snapshot_cache[address] = snapshot
+        snapshot_stats['rebuild'] += 1
+    else:
+        snapshot_stats['hit'] += 1
+    return snapshot_response(request, snapshot)
+
+
+async def api_history(request: Request):
+    """pool status of range by the finest resolution fitting max 1440 points"""
+    try:
+        end = int(request.query.get('end', time()))
+        begin = int(request.query.get('begin', end - 86400))
+    except ValueError:
+        raise web.HTTPBadRequest(text='begin and end must be unix time')
+    if end <= begin:
+        raise web.HTTPBadRequest(text='begin must be less than end')
+    async with create_db(Const.DATABASE_PATH) as db:
+        cur = await db.cursor()
+        statuses = await read_pool_status_range(cur=cur, begin=begin, end=end)
+    return web.json_response({
+        'begin': begin,
+        'end': end,
+        'resolution': select_resolution(begin, end),
+        'data': [
+            {
+                'time': status.time,
+                'workers': dict(status.workers),
+                'pool_hashrate': dict(status.pool_hashrate),
+                'network_hashrate': dict(status.network_hashrate),
+                'share': status.share,
+            }
+            for status in statuses],
+    })
+
+
+def setup_api_routes(app: web.Application):
+    app.router.add_get('/api/pool', api_pool)
+    app.router.add_get('/api/algorithms', api_algorithms)
+    app.router.add_get('/api/blocks', api_blocks)
+    app.router.add_get('/api/miner/{address}', api_miner)
+    app.router.add_get('/api/history', api_history)
+
+
+__all__ = [
+    "snapshot_stats",
+    "setup_api_routes",
+]
@@ -1,38 +1,132 @@
 from bc4py_stratum_pool.config import Const
+from bc4py_stratum_pool.metrics import NODE_LATENCY
 from logging import getLogger, WARNING
+from collections import OrderedDict
+from typing import Optional, Callable, Dict
+from time import time, perf_counter
 import aiohttp
+import asyncio
 
 
 log = getLogger(__name__)
 getLogger('aiohttp').setLevel(WARNING)
 
 
+class NodeResponseError(ConnectionError):
+    """node answered with error status, the request was handled and refused"""
+
+    def __init__(self, status: int, text: str):
+        super().__init__(text)
+        self.status = status
+
+
 async def ask_get(method: str, params=None):
     """ask node by GET method"""
-    async with aiohttp.ClientSession() as session:
-        async with session.get(Const.REST_API + method, params=params) as response:
-            if response.status == 200:
-                data = await response.json()
-                log.debug(f"REST GET method={method} params={params} success")
-                return data
-            else:
-                text = await response.text()
-                log.error(f"REST GET method={method} params={params} error={text}")
-                raise ConnectionError(text)
+    s = perf_counter()
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(Const.REST_API + method, params=params) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    log.debug(f"REST GET method={method} params={params} success")
+                    return data
+                else:
+                    text = await response.text()
+                    log.error(f"REST GET method={method} params={params} error={text}")
+                    raise NodeResponseError(response.status, text)
+    finally:
+        NODE_LATENCY.labels(method).observe(perf_counter() - s)
 
 
 async def ask_post(method, json=None):
     """ask node by POST method"""
-    async with aiohttp.ClientSession() as session:
-        async with session.post(Const.REST_API + method, json=json) as response:
-            if response.status == 200:
-                data = await response.json()
-                log.debug(f"REST POST method={method} json={json} success={data}")
-                return data
-            else:
-                text = await response.text()
-                log.error(f"REST POST method={method} json={json} error={text}")
-                raise ConnectionError(text)
+    s = perf_counter()
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(Const.REST_API + method, json=json) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    log.debug(f"REST POST method={method} json={json} success={data}")
+                    return data
+                else:
+                    text = await response.text()
+                    log.error(f"REST POST method={method} json={json} error={text}")
+                    raise NodeResponseError(response.status, text)
+    finally:
+        NODE_LATENCY.labels(method).observe(perf_counter() - s)
+
+
+class LRUCache(object):
+    """bounded LRU cache, each item has optional expire time"""
+    __slots__ = ("max_len", "data")
+
+    def __init__(self, max_len):
+        self.max_len = max_len
+        self.data = OrderedDict()
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        expire, value = item
+        if expire is not None and expire < time():
+            del self.data[key]
+            return None
+        self.data.move_to_end(key)
+        return value
+
+    def put(self, key, value, ttl: Optional[float]):
+        """ttl None means no expire"""
+        self.data[key] = (None if ttl is None else time() + ttl, value)
+        self.data.move_to_end(key)
+        while self.max_len < len(self.data):
+            self.data.popitem(last=False)
+
+
+# immutable chain data cache for explorer
+node_cache = LRUCache(max_len=5000)
+node_cache_inflight: Dict[tuple, asyncio.Future] = dict()
+node_cache_stats = {'hit': 0, 'miss': 0, 'coalesced': 0}
+
+
+async def ask_get_cached(method: str, params: dict, ttl_func: Callable[[dict], Optional[float]]):
+    """
+    ask node by GET method through cache
+    concurrent same requests wait for one node call (single-flight)
+    ttl_func: return cache seconds by the response, None means forever
+    """
+    key = (method, tuple(sorted(params.items())))
+    data = node_cache.get(key)
+    if data is not None:
+        node_cache_stats['hit'] += 1
+        return data
+    future = node_cache_inflight.get(key)
+    if future is not None:
+        node_cache_stats['coalesced'] += 1
+        return await asyncio.shield(future)
+    node_cache_stats['miss'] += 1
+    # fetch by own task, a cancelled caller does not leave the waiters hanging
+    future = node_cache_inflight[key] = asyncio.ensure_future(_fetch_cached(key, method, params, ttl_func))
+    future.add_done_callback(_retrieve_exception)
+    return await asyncio.shield(future)
+
+
+async def _fetch_cached(key, method, params, ttl_func):
+    try:
+        data = await ask_get(method, params)
+        node_cache.put(key, data, ttl_func(data))
+        return data
+    finally:
+        del node_cache_inflight[key]
+
+
+def _retrieve_exception(future: asyncio.Future):
+    # mark retrieved when no waiter
+    if not future.cancelled():
+        future.exception()
 
 
 async def ask_json_rpc(method, params, user, pwd):
@@ -42,21 +136,29 @@ async def ask_json_rpc(method, params, user, pwd):
         'params': params,
         'id': None,
     }
-    async with aiohttp.ClientSession() as session:
-        auth = aiohttp.BasicAuth(user, pwd)
-        async with session.post(Const.REST_API, json=json, auth=auth) as response:
-            if response.status == 200:
-                data = await response.json()
-                log.debug(f"JSON-RPC method={method} params={params} success={data}")
-                return data['result']
-            else:
-                text = await response.text()
-                log.error(f"JSON-RPC method={method} params={params} error={text}")
-                raise ConnectionError(text)
+    s = perf_counter()
+    try:
+        async with aiohttp.ClientSession() as session:
+            auth = aiohttp.BasicAuth(user, pwd)
+            async with session.post(Const.REST_API, json=json, auth=auth) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    log.debug(f"JSON-RPC method={method} params={params} success={data}")
+                    return data['result']
+                else:
+                    text = await response.text()
+                    log.error(f"JSON-RPC method={method} params={params} error={text}")
+                    raise NodeResponseError(response.status, text)
+    finally:
+        NODE_LATENCY.labels('rpc/' + method).observe(perf_counter() - s)
 
 
 __all__ = [
+    "NodeResponseError",
     "ask_get",
     "ask_post",
+    "ask_get_cached",
+    "node_cache",
+    "node_cache_stats",
     "ask_json_rpc",
 ]
@@ -2,10 +2,17 @@ from bc4py_stratum_pool.config import *
 from bc4py_stratum_pool.job import *
 from bc4py_stratum_pool.commands import *
 from bc4py_stratum_pool.account import *
-from bc4py_stratum_pool.client import client_list
+from bc4py_stratum_pool.journal import fold_journal
+from bc4py_stratum_pool.cluster import count_workers
 from bc4py_stratum_pool.ask import *
+from bc4py_stratum_pool.feed import publish
+from bc4py_stratum_pool.eventloop import LoopLocal
+from bc4py_stratum_pool.timeseries import load_pool_status, insert_pool_status
+from bc4py_stratum_pool import journal
 from bc4py.config import C
-from collections import deque, defaultdict
+from collections import deque, Counter
+from aiosqlite import Cursor
+from typing import Dict, Optional
 from logging import getLogger
 from asyncio import wait_for
 from binascii import a2b_hex
@@ -15,11 +22,15 @@ import asyncio
 
 
 log = getLogger(__name__)
-loop = asyncio.get_event_loop()
-block_notify_que = asyncio.queues.Queue()
+block_notify_que = LoopLocal(asyncio.Queue)
+new_block_event = LoopLocal(asyncio.Event)
 block_history_list = deque(maxlen=50)
 tx_history_list = deque(maxlen=50)
 consensus_list = list()
+# payout_id -> (txhash, account_amounts, state) sent but failed to recode
+sent_payouts: Dict[int, tuple] = dict()
+# payout_id -> (payout_pairs, account_amounts) send result unknown
+parked_payouts: Dict[int, tuple] = dict()
 f_enable = True
 
 
@@ -33,7 +44,7 @@ async def auto_distribution_recode(
     while f_enable:
         try:
             await asyncio.sleep(job_span)
-            async with create_db(Const.DATABASE_PATH, strict=True) as db:
+            async with create_db(Const.DATABASE_PATH, attach_shards=True) as db:
                 cur = await db.cursor()
                 end = time()
                 begin = end - search_span
@@ -70,14 +81,17 @@ async def auto_distribution_recode(
 
 
 async def auto_payout_system(
-        min_confirm: int, min_amount=5000000000, owner_fee=0.05, ignore_amount=10000, check_span=3600):
+        min_confirm: int, min_amount=5000000000, owner_fee=0.05, ignore_amount=10000, check_span=3600,
+        max_outputs=200, max_concurrent=2):
     """
     auto payout to miners
-    :param min_confirm: minimum confirmation heights
+    :param min_confirm: minimum confirmation heights (settled by auto_mined_block_tracker)
     :param min_amount: minimum send amount at once
     :param owner_fee: Owner's share ratio (note: owner pay sending fee)
     :param ignore_amount: ignore too few sending
     :param check_span: loop check span
+    :param max_outputs: maximum outputs of one payout transaction
+    :param max_concurrent: maximum concurrent sending transactions
     """
     assert 0.0 < owner_fee < 1.0
     assert Const.PAYOUT_METHOD == 'transaction'
@@ -85,85 +99,324 @@ async def auto_payout_system(
     while f_enable:
         await asyncio.sleep(check_span)
         log.info("auto payout process start")
-        async with create_db(Const.DATABASE_PATH, strict=True) as db:
+        await recode_payout_plan(min_amount, owner_fee, ignore_amount, max_outputs)
+        # send planned batches, refused batches are retried next time
+        try:
+            await send_pending_payouts(max_concurrent)
+        except Exception:
+            log.error("send pending payouts exception", exc_info=True)
+        # estimate pending amount of each account
+        try:
+            async with create_db(Const.DATABASE_PATH) as db:
+                cur = await db.cursor()
+                unpaid_amount = sum(reward for _, _, status, reward in await read_unpaid_final_blocks(cur)
+                                    if status == MINED_BLOCK_SETTLED)
+                await update_balance_estimate(cur=cur, unpaid_amount=int(unpaid_amount * (1.0 - owner_fee)))
+                await db.commit()
+        except Exception:
+            log.error("balance estimate exception", exc_info=True)
+
+
+async def recode_payout_plan(min_amount, owner_fee, ignore_amount, max_outputs):
+    """
+    split payees into batches and recode each batch as pending transaction
+    shares are marked by the batch's payout_id before sending, never paid twice
+    plan on a read only snapshot and mark shares by short transactions on each share database,
+    batches stay PLANNING until balance & mined blocks are claimed and reverted if stopped between
+    """
+    path = Const.DATABASE_PATH
+    try:
+        async with get_balance_lock():
+            await revert_planning_payouts(path)
+        async with create_db(path, attach_shards=True) as db:
+            cur = await db.cursor()
+            # find settled blocks by mined block tracker
+            total_mined_amount = 0
+            total_block_count = 0
+            end = None
+            blockhashes = list()
+            for blockhash, ntime, status, reward in await read_unpaid_final_blocks(cur):
+                end = float(ntime)
+                blockhashes.append(blockhash)
+                if status == MINED_BLOCK_SETTLED:
+                    total_mined_amount += reward
+                    total_block_count += 1
+            # check
+            total_send_amount = int(total_mined_amount * (1.0 - owner_fee))
+            if min_amount > total_send_amount:
+                log.info(f"too few mined amount {min_amount} > {total_send_amount}")
+                return
+            if end is None:
+                log.info("end time is not defied")
+                return
+            # let's try to send
+            log.debug(f"total send amount is {total_send_amount}, owner get {total_mined_amount-total_send_amount}")
+            # find begin time
+            begin = await read_last_unpaid_time(cur)
+            # calculate distribution
+            related_accounts = await read_related_accounts(cur=cur, begin=begin, end=end)
+            account_share_dict = dict()
+            for account_id in related_accounts:
+                account_share_dict[account_id] = await read_account_unpaid_shares(
+                    cur=cur, begin=begin, end=end, account_id=account_id)
+        log.debug(f"auto send span {begin} -> {end}")
+        # setup payout pairs
+        total_share = sum(account_share_dict.values())
+        payout_pairs = list()
+        for account_id, share in account_share_dict.items():
+            amount = int(total_send_amount * share / total_share)
+            if ignore_amount < amount:
+                payout_pairs.append((account_id, amount))
+            else:
+                log.debug(f"ignore by too low share id={account_id} amount={amount}")
+        if len(payout_pairs) == 0:
+            log.info(f"no payout accounts")
+            return
+        # recode batches as planning
+        batches = list()
+        async with create_db(path, strict=True) as db:
+            cur = await db.cursor()
+            for index in range(0, len(payout_pairs), max_outputs):
+                batch = payout_pairs[index:index + max_outputs]
+                batch_id = await insert_new_transaction(
+                    cur=cur, txhash=PLANNING_TXHASH, amount=sum(amount for _, amount in batch), begin=begin, end=end)
+                batches.append((batch_id, [uuid for uuid, _ in batch]))
+            await db.commit()
+        # balance check does not run between marking shares and claiming balance
+        async with get_balance_lock():
+            count = await mark_shares_as_paid(path, batches, begin, end)
+            log.info(f"mark payout shares batches={len(batches)} shares={count}")
+            # claim balance & mined blocks, batches are ready to send
+            async with create_db(path, attach_shards=True) as db:
+                cur = await db.cursor()
+                claimed = [await read_payout_account_shares(cur=cur, payout_id=batch_id) for batch_id, _ in batches]
+            async with create_db(path, strict=True) as db:
+                cur = await db.cursor()
+                for (batch_id, accounts), account_shares in zip(batches, claimed):
+                    await update_balance_claimed(cur=cur, account_shares=account_shares)
+                    await update_payout_txhash(cur=cur, payout_id=batch_id, txhash=PENDING_TXHASH, state=PLANNING_TXHASH)
+                    log.info(f"recode payout batch id={batch_id} outputs={len(accounts)}")
+                count = await update_mined_blocks_as_paid(cur=cur, payout_id=batches[0][0], blockhashes=blockhashes)
+                await db.commit()
+        log.info(f"success update mined blocks row={count}")
+    except DatabaseError:
+        log.debug("database error", exc_info=True)
+    except Exception:
+        log.error("auto_payout_system exception", exc_info=True)
+
+
+async def read_payout_batch(cur: Cursor, payout_id, amount) -> Optional[tuple]:
+    """(payout_pairs, account_amounts) of the batch, amount is split by share ratio again"""
+    account_share_dict = await read_payout_account_shares(cur=cur, payout_id=payout_id)
+    total_share = sum(account_share_dict.values())
+    if total_share == 0:
+        log.warning(f"no shares related payout id={payout_id}")
+        return None
+    account_amounts = {
+        account_id: int(amount * share / total_share)
+        for account_id, share in account_share_dict.items()}
+    payout_pairs = [
+        (await read_account_id2address(cur=cur, account_id=account_id), 0, amount)
+        for account_id, amount in account_amounts.items()]
+    return payout_pairs, account_amounts
+
+
+def is_rejected_before_send(e: Exception) -> bool:
+    """node surely did not send, refused the request or not connected"""
+    if isinstance(e, NodeResponseError):
+        return 400 <= e.status < 500
+    return isinstance(e, aiohttp.ClientConnectorError)
+
+
+async def change_payout_state(payout_id, txhash, state) -> bool:
+    async with create_db(Const.DATABASE_PATH) as db:
+        cur = await db.cursor()
+        updated = await update_payout_txhash(cur=cur, payout_id=payout_id, txhash=txhash, state=state)
+        await db.commit()
+    return updated
+
+
+async def record_payout_sent(payout_id, txhash: bytes, account_amounts, state=SENDING_TXHASH) -> bool:
+    """recode txhash & paid balance, keep on memory to retry if failed"""
+    try:
+        async with create_db(Const.DATABASE_PATH) as db:
+            cur = await db.cursor()
+            if not await update_payout_txhash(cur=cur, payout_id=payout_id, txhash=txhash, state=state):
+                log.warning(f"payout id={payout_id} is not {state} state, ignore txhash {txhash.hex()}")
+                return False
+            await update_balance_paid(cur=cur, account_amounts=account_amounts)
+            await db.commit()
+        sent_payouts.pop(payout_id, None)
+        parked_payouts.pop(payout_id, None)
+        return True
+    except Exception:
+        sent_payouts[payout_id] = (txhash, account_amounts, state)
+        log.error(f"failed to recode sent payout id={payout_id} {txhash.hex()}, retry next time", exc_info=True)
+        return False
+
+
+async def load_parked_payouts():
+    """park batches left in sending state (stopped or failed to recode), load outputs to reconcile"""
+    for payout_id, (txhash, account_amounts, state) in list(sent_payouts.items()):
+        await record_payout_sent(payout_id, txhash, account_amounts, state)
+    async with create_db(Const.DATABASE_PATH, attach_shards=True) as db:
+        cur = await db.cursor()
+        sending = await read_pending_payouts(cur, state=SENDING_TXHASH)
+        parked = await read_pending_payouts(cur, state=PARKED_TXHASH)
+        parked_payouts.clear()
+        for payout_id, amount, _, _ in sending + parked:
+            batch = await read_payout_batch(cur=cur, payout_id=payout_id, amount=amount)
+            if batch is not None:
+                parked_payouts[payout_id] = batch
+    for payout_id, _, _, _ in sending:
+        if payout_id not in sent_payouts and await change_payout_state(payout_id, PARKED_TXHASH, SENDING_TXHASH):
+            log.error(f"park payout id={payout_id}, send result is unknown")
+    # reconcile by wallet transactions received by stream
+    for tx in list(tx_history_list):
+        await reconcile_parked_payout(tx)
+
+
+async def reconcile_parked_payout(tx: dict) -> Optional[int]:
+    """recode parked payout as sent when the tx has all outputs of the batch"""
+    if len(parked_payouts) == 0 or 'outputs' not in tx or 'hash' not in tx:
+        return None
+    outputs = Counter(tuple(output) for output in tx['outputs'])
+    for payout_id, (payout_pairs, account_amounts) in list(parked_payouts.items()):
+        if len(Counter(tuple(pair) for pair in payout_pairs) - outputs) == 0:
+            log.warning(f"reconcile parked payout id={payout_id} with {tx['hash']}")
+            for state in (PARKED_TXHASH, SENDING_TXHASH):
+                if await record_payout_sent(payout_id, a2b_hex(tx['hash']), account_amounts, state):
+                    return payout_id
+    return None
+
+
+async def send_pending_payouts(max_concurrent=2):
+    """
+    send planned payout batches with bounded concurrency
+    sending state is recoded before asking node, a batch is sent again only when node surely refused it.
+    timeout, disconnection or failed recode after the request park the batch,
+    it is reconciled by wallet txs on stream or resolved by admin API, never resent automatically
+    """
+    await load_parked_payouts()
+    pending = list()
+    async with create_db(Const.DATABASE_PATH, attach_shards=True) as db:
+        cur = await db.cursor()
+        for payout_id, amount, begin, end in await read_pending_payouts(cur):
+            batch = await read_payout_batch(cur=cur, payout_id=payout_id, amount=amount)
+            if batch is not None:
+                pending.append((payout_id, *batch))
+    semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def send(payout_id, payout_pairs, account_amounts):
+        async with semaphore:
+            if not await change_payout_state(payout_id, SENDING_TXHASH, PENDING_TXHASH):
+                return
+            try:
+                result = await ask_post('/private/sendmany', {'pairs': payout_pairs})
+            except Exception as e:
+                if is_rejected_before_send(e):
+                    log.warning(f"failed payout id={payout_id} by {e}, retry next time")
+                    await change_payout_state(payout_id, PENDING_TXHASH, SENDING_TXHASH)
+                else:
+                    log.error(f"park payout id={payout_id} by {e!r}, reconcile with wallet")
+                    parked_payouts[payout_id] = (payout_pairs, account_amounts)
+                    await change_payout_state(payout_id, PARKED_TXHASH, SENDING_TXHASH)
+                return
+        log.info(f"success payout! id={payout_id} {result['hash']}")
+        await record_payout_sent(payout_id, a2b_hex(result['hash']), account_amounts)
+
+    await asyncio.gather(*(send(*args) for args in pending))
+
+
+async def resolve_parked_payout(payout_id, txhash: Optional[bytes]) -> bool:
+    """
+    admin resolution after checking the wallet
+    txhash: recode as sent by the tx, None: node did not send, back to pending
+    """
+    if txhash is None:
+        parked_payouts.pop(payout_id, None)
+        return await change_payout_state(payout_id, PENDING_TXHASH, PARKED_TXHASH)
+    batch = parked_payouts.get(payout_id)
+    if batch is None:
+        await load_parked_payouts()
+        batch = parked_payouts.get(payout_id)
+    if batch is None:
+        return False
+    return await record_payout_sent(payout_id, txhash, batch[1], PARKED_TXHASH)
+
+
+async def auto_mined_block_tracker(min_confirm: int, check_span=600, max_concurrent=4):
+    """
+    update confirmation state of mined blocks
+    height is known by websocket block stream, REST check only for pending blocks
+    reaching min_confirm or unknown height
+    :param min_confirm: minimum confirmation heights to settle
+    :param check_span: check span when no new block received
+    :param max_concurrent: max concurrent REST requests
+    """
+    global f_enable
+    log.info("start auto mined block tracker")
+    semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def check_block(blockhash):
+        async with semaphore:
+            params = {'hash': blockhash.hex(), 'txinfo': 'true'}
             try:
+                return await ask_get('/public/getblockbyhash', params)
+            except ConnectionError as e:
+                log.warning(f"orphan? REST returns error {e} by {params}")
+                return None
+
+    while f_enable:
+        try:
+            try:
+                await wait_for(new_block_event.get().wait(), check_span)
+            except asyncio.TimeoutError:
+                pass
+            new_block_event.get().clear()
+            async with create_db(Const.DATABASE_PATH) as db:
                 cur = await db.cursor()
-                # get best height on chain
-                best_info = await ask_get('/public/getchaininfo')
-                best_height = best_info['best']['height']
-                # find mined block status
-                total_mined_amount = 0
-                total_block_count = 0
-                end = None
-                async for ntime, blockhash in iter_latest_mined_shares(cur):
-                    params = {'hash': blockhash.hex(), 'txinfo': 'true'}
-                    try:
-                        block = await ask_get('/public/getblockbyhash', params)
-                    except ConnectionError as e:
-                        log.warning(f"orphan? REST returns error {e} by {params}")
-                        continue
-                    if best_height - min_confirm < block['height']:
+                pending = await read_pending_mined_blocks(cur)
+                if len(pending) == 0:
+                    continue
+                # best height on chain
+                if 0 < len(block_history_list):
+                    best_height = block_history_list[-1]['height']
+                else:
+                    best_info = await ask_get('/public/getchaininfo')
+                    best_height = best_info['best']['height']
+                stream_heights = {a2b_hex(block['hash']): block['height'] for block in block_history_list}
+                # select blocks need REST check
+                require_check = list()
+                for blockhash, height, confirmations in pending:
+                    height = stream_heights.get(blockhash, height)
+                    if height == 0 or min_confirm <= best_height - height + 1:
+                        require_check.append(blockhash)
+                    else:
+                        await update_mined_block(cur=cur, blockhash=blockhash, height=height,
+                                                 confirmations=best_height - height + 1,
+                                                 status=MINED_BLOCK_PENDING)
+                blocks = await asyncio.gather(*map(check_block, require_check))
+                for blockhash, block in zip(require_check, blocks):
+                    if block is None:
                         continue
-                    # mined block
-                    if end is None:
-                        end = float(ntime)
+                    confirmations = best_height - block['height'] + 1
                     if block['f_orphan']:
-                        continue
-                    _, _, amount = block['txs'][0]['outputs'][0]
-                    total_mined_amount += amount
-                    total_block_count += 1
-                # check
-                total_send_amount = int(total_mined_amount * (1.0 - owner_fee))
-                if min_amount > total_send_amount:
-                    log.info(f"too few mined amount {min_amount} > {total_send_amount}")
-                    continue
-                if end is None:
-                    log.info("end time is not defied")
-                    continue
-                # let's try to send
-                log.debug(f"total send amount is {total_send_amount}, owner get {total_mined_amount-total_send_amount}")
-                # find begin time
-                begin = await read_last_unpaid_time(cur)
-                # calculate distribution
-                related_accounts = await read_related_accounts(cur=cur, begin=begin, end=end)
-                account_share_dict = dict()
-                for account_id in related_accounts:
-                    account_share_dict[account_id] = await read_account_unpaid_shares(
-                        cur=cur, begin=begin, end=end, account_id=account_id)
-                log.debug(f"auto send span {begin} -> {end}")
-                # setup payout pairs
-                total_share = sum(account_share_dict.values())
-                payout_pairs = list()
-                paid_accounts = list()
-                for account_id, share in account_share_dict.items():
-                    address = await read_account_id2address(cur=cur, account_id=account_id)
-                    amount = int(total_send_amount * share / total_share)
-                    if ignore_amount < amount:
-                        payout_pairs.append((address, 0, amount))
-                        paid_accounts.append(account_id)
+                        status = MINED_BLOCK_ORPHAN
+                        reward = None
+                    elif min_confirm <= confirmations:
+                        status = MINED_BLOCK_SETTLED
+                        _, _, reward = block['txs'][0]['outputs'][0]
                     else:
-                        log.debug(f"ignore by too low share id={account_id} amount={amount}")
-                if len(payout_pairs) == 0:
-                    log.info(f"no payout accounts")
-                    continue
-                # try to send
-                params = {'pairs': payout_pairs}
-                result = await ask_post('/private/sendmany', params)
-                log.info(f"success payout! {result['hash']}")
-                # recode payout
-                payout_id = await insert_new_transaction(
-                    cur=cur, txhash=a2b_hex(result['hash']), amount=total_send_amount, begin=begin, end=end)
-                log.info(f"success recode payout id={payout_id}")
-                await update_shares_as_paid(
-                    cur=cur, payout_id=payout_id, begin=begin, end=end, accounts=paid_accounts)
-                log.info(f"success update shares row={cur.rowcount}")
+                        status = MINED_BLOCK_PENDING
+                        reward = None
+                    await update_mined_block(cur=cur, blockhash=blockhash, height=block['height'],
+                                             confirmations=confirmations, status=status, reward=reward)
+                    log.debug(f"mined block {blockhash.hex()} status={status} confirm={confirmations}")
                 await db.commit()
-            except DatabaseError:
-                log.debug("database error", exc_info=True)
-                await db.rollback()
-            except Exception:
-                log.error("auto_payout_system exception", exc_info=True)
-                await db.rollback()
+                log.debug(f"track mined blocks pending={len(pending)} REST={len(require_check)}")
+        except Exception:
+            log.error("auto mined block tracker exception", exc_info=True)
 
 
 async def auto_pool_status_recode(job_span=60):
@@ -171,23 +424,26 @@ async def auto_pool_status_recode(job_span=60):
     global f_enable
     log.info("start auto recode status")
     last_update_time = int(time())
+    try:
+        async with create_db(Const.DATABASE_PATH) as db:
+            cur = await db.cursor()
+            await load_pool_status(cur)
+            await db.commit()
+    except Exception:
+        log.error("load pool status exception", exc_info=True)
     while f_enable:
         try:
             await asyncio.sleep(job_span)
-            async with create_db(Const.DATABASE_PATH) as db:
+            ntime = int(time())
+            # mined share
+            async with create_db(Const.DATABASE_PATH, attach_shards=True) as db:
                 cur = await db.cursor()
-                ntime = int(time())
-                # mined share
                 share = await read_total_unpaid_shares(cur=cur, begin=last_update_time, end=ntime, f_raise=False)
-                # workers
-                workers = defaultdict(int)
-                for client in client_list:
-                    workers[client.consensus_name] += 1
+            async with create_db(Const.DATABASE_PATH) as db:
+                cur = await db.cursor()
+                # workers & pool hashrate, include worker processes
+                workers, pool_hashrate = count_workers()
                 workers = tuple(workers.items())
-                # pool hashrate
-                pool_hashrate = defaultdict(int)
-                for client in client_list:
-                    pool_hashrate[client.consensus_name] += client.hashrate
                 pool_hashrate = tuple(pool_hashrate.items())
                 # network hashrate
                 network_hashrate = dict()
@@ -196,8 +452,16 @@ async def auto_pool_status_recode(job_span=60):
                         network_hashrate[block['flag']] = int(block['difficulty'] * 7158278.8)
                 network_hashrate = tuple(network_hashrate.items())
                 # recode pool status
-                pool_status_list.append(PoolStatus(
-                    ntime, workers, pool_hashrate, network_hashrate, share))
+                status = PoolStatus(ntime, workers, pool_hashrate, network_hashrate, share)
+                pool_status_list.append(status)
+                await insert_pool_status(cur, status)
+                await db.commit()
+                publish('PoolStatus', {
+                    'workers': dict(workers),
+                    'pool_hashrate': dict(pool_hashrate),
+                    'network_hashrate': dict(network_hashrate),
+                    'share': share,
+                })
                 log.debug(f"recode pool status time={ntime}")
         except DatabaseError as e:
             log.debug(f"database {e}")
@@ -213,7 +477,7 @@ async def auto_block_notify(algorithm_list: list, job_span=60):
     log.info(f"start auto notify {consensus_list}")
     while f_enable:
         try:
-            data = await wait_for(block_notify_que.get(), 1)
+            data = await wait_for(block_notify_que.get().get(), 1)
             for algorithm in algorithm_list:
                 job = await add_new_job(algorithm, force_renew=True)
                 await mining_notify(job, f_clean=True)
@@ -260,10 +524,20 @@ async def auto_notify_by_ws(dest='/public/ws'):
                         try:
                             data: dict = await ws.receive_json(timeout=1)
                             if data['cmd'] == 'Block':
-                                await block_notify_que.put(data['data'])
+                                await block_notify_que.get().put(data['data'])
                                 block_history_list.append(data['data'])
+                                new_block_event.get().set()
+                                block = data['data']
+                                publish('Block', {
+                                    'height': block.get('height'),
+                                    'hash': block.get('hash'),
+                                    'flag': block.get('flag'),
+                                    'time': block.get('time'),
+                                    'difficulty': block.get('difficulty'),
+                                })
                             if data['cmd'] == 'TX':
                                 tx_history_list.append(data['data'])
+                                await reconcile_parked_payout(data['data'])
                         except asyncio.TimeoutError:
                             pass
                         except TypeError as e:
@@ -276,6 +550,82 @@ async def auto_notify_by_ws(dest='/public/ws'):
             await asyncio.sleep(10.0)
 
 
+async def auto_write_behind(job_span=1.0):
+    """commit cached account & subscription inserts in background"""
+    global f_enable
+    log.info("start auto write-behind")
+    while f_enable:
+        try:
+            await asyncio.sleep(job_span)
+            count = await flush_write_behind(Const.DATABASE_PATH)
+            if 0 < count:
+                log.debug(f"write-behind commit {count} rows")
+        except Exception:
+            log.error("auto write-behind exception", exc_info=True)
+    # flush remaining rows
+    try:
+        await flush_write_behind(Const.DATABASE_PATH)
+    except Exception:
+        log.error("last write-behind exception", exc_info=True)
+
+
+async def auto_prune_database(past=60*24*3600, check_span=3600, chunk_size=500):
+    """remove old subscriptions & paid shares little by little, keep 60 days by default"""
+    global f_enable
+    log.info("start auto prune database")
+    while f_enable:
+        try:
+            await asyncio.sleep(check_span)
+            await prune_database(Const.DATABASE_PATH, past=past,
+                                 chunk_size=chunk_size, archive_dir=Const.ARCHIVE_DIR)
+        except Exception:
+            log.error("auto prune database exception", exc_info=True)
+
+
+async def auto_share_journal(sync_span=0.5, fold_span=5.0):
+    """fsync share journal and fold it into database"""
+    global f_enable
+    assert journal.share_journal is not None, 'journal is not opened'
+    log.info("start auto share journal")
+    last_fold_time = time()
+    while f_enable:
+        try:
+            await asyncio.sleep(sync_span)
+            await journal.share_journal.sync()
+            if fold_span < time() - last_fold_time:
+                last_fold_time = time()
+                count = await fold_journal(Const.DATABASE_PATH, journal.share_journal.directory)
+                if 0 < count:
+                    log.debug(f"fold journal {count} shares")
+        except Exception:
+            log.error("auto share journal exception", exc_info=True)
+    # fold remaining records
+    try:
+        await journal.share_journal.sync()
+        await fold_journal(Const.DATABASE_PATH, journal.share_journal.directory)
+    except Exception:
+        log.error("last share journal exception", exc_info=True)
+
+
+async def auto_balance_check(check_span=86400, repair=True):
+    """rebuild balance table from raw tables when inconsistent"""
+    global f_enable
+    log.info("start auto balance check")
+    while f_enable:
+        try:
+            await asyncio.sleep(check_span)
+            await flush_write_behind(Const.DATABASE_PATH)
+            # no write-behind flush or payout while comparing
+            async with get_balance_lock(), create_db(Const.DATABASE_PATH) as db, \
+                    create_db(Const.DATABASE_PATH, attach_shards=True) as share_db:
+                cur = await db.cursor()
+                share_cur = await share_db.cursor()
+                await check_balance(cur=cur, share_cur=share_cur, repair=repair)
+                await db.commit()
+        except Exception:
+            log.error("auto balance check exception", exc_info=True)
+
+
 def close_auto_works():
     global f_enable
     log.info("close auto notify")
@@ -286,10 +636,17 @@ __all__ = [
     "block_history_list",
     "tx_history_list",
     "consensus_list",
+    "parked_payouts",
     "auto_distribution_recode",
     "auto_payout_system",
+    "resolve_parked_payout",
+    "auto_mined_block_tracker",
     "auto_pool_status_recode",
     "auto_block_notify",
     "auto_notify_by_ws",
+    "auto_write_behind",
+    "auto_prune_database",
+    "auto_share_journal",
+    "auto_balance_check",
     "close_auto_works",
 ]
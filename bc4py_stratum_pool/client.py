@@ -1,23 +1,28 @@
 from bc4py_stratum_pool.config import co_efficiency
+from bc4py_stratum_pool.metrics import Gauge
+from bc4py_stratum_pool.eventloop import LoopLocal
 from bc4py.config import C
 from asyncio.streams import StreamReader, StreamWriter
 from logging import getLogger
-from typing import Optional, List, Deque
-from collections import deque
+from typing import Optional, List, Deque, Dict, Set
+from collections import deque, defaultdict
 from time import time
 import asyncio
 import json
 
-loop = asyncio.get_event_loop()
 client_list: List['Client'] = list()  # working clients
-client_lock = asyncio.Lock()
+client_lock = LoopLocal(asyncio.Lock)
 closed_deque: Deque['Client'] = deque(maxlen=25)  # disconnected clients
+# listing index, updated when clients connect, authorize and close
+username_index: Dict[str, Set['Client']] = defaultdict(set)
+algorithm_index: Dict[int, Set['Client']] = defaultdict(set)
 log = getLogger(__name__)
+CONNECTIONS = Gauge('pool_connections', 'stratum clients connected', func=lambda: len(client_list))
 
 
 class Client(object):
     __slots__ = ("f_enable", "reader", "writer", "algorithm",
-                 "diff_list", "username", "password","account_id",
+                 "diff_list", "_username", "password","account_id",
                  "subscription_id", "extranonce_1", "version",
                  "time_works", "submit_span", "n_accept", "n_reject")
 
@@ -28,7 +33,7 @@ class Client(object):
         self.algorithm: int = algorithm
         self.diff_list = deque(maxlen=5)
         self.diff_list.append(difficulty)
-        self.username: Optional[str] = None
+        self._username: Optional[str] = None
         self.password: Optional[str] = None
         self.account_id: Optional[int] = None
         self.subscription_id: Optional[bytes] = None
@@ -49,6 +54,25 @@ class Client(object):
             return None
         return host[0]
 
+    @property
+    def username(self) -> Optional[str]:
+        return self._username
+
+    @username.setter
+    def username(self, value):
+        """update username index"""
+        if self._username is not None:
+            username_index[self._username].discard(self)
+            if len(username_index[self._username]) == 0:
+                del username_index[self._username]
+        self._username = value
+        if value is not None and self.f_enable:
+            username_index[value].add(self)
+
+    @property
+    def reject_rate(self) -> float:
+        return self.n_reject / max(1, self.n_accept + self.n_reject)
+
     @property
     def consensus_name(self):
         return C.consensus2name[self.algorithm]
@@ -133,18 +157,53 @@ class Client(object):
         self.f_enable = False
         if not self.writer.transport.is_closing():
             self.writer.close()
-        async with client_lock:
+        async with client_lock.get():
             if self in client_list:
                 client_list.remove(self)
+        algorithm_index[self.algorithm].discard(self)
+        if self._username is not None:
+            username_index[self._username].discard(self)
+            if len(username_index[self._username]) == 0:
+                del username_index[self._username]
 
 
 async def create_client(*args):
     client = Client(*args)
-    async with client_lock:
+    async with client_lock.get():
         client_list.append(client)
+    algorithm_index[client.algorithm].add(client)
     return client
 
 
+# sort key of listing
+CLIENT_SORT_KEYS = {
+    'hashrate': lambda client: client.hashrate,
+    'difficulty': lambda client: client.difficulty,
+    'reject': lambda client: client.reject_rate,
+}
+
+
+def filter_clients(address: Optional[str] = None, algorithm: Optional[int] = None) -> List[Client]:
+    """select clients by index"""
+    if address is not None:
+        clients = username_index.get(address, ())
+        if algorithm is not None:
+            clients = [client for client in clients if client.algorithm == algorithm]
+        return list(clients)
+    elif algorithm is not None:
+        return list(algorithm_index.get(algorithm, ()))
+    else:
+        return client_list.copy()
+
+
+def sort_clients(clients: List[Client], sort='hashrate', reverse=True) -> List[Client]:
+    """each sort key is computed once per client"""
+    key_func = CLIENT_SORT_KEYS[sort]
+    keyed = [(key_func(client), index) for index, client in enumerate(clients)]
+    keyed.sort(reverse=reverse)
+    return [clients[index] for _, index in keyed]
+
+
 async def response_success(client: Client, result, uuid):
     response = json.dumps({'result': result, 'error': None, 'id': uuid})
     client.writer.write(response.encode() + b'\n')
@@ -166,7 +225,7 @@ async def broadcast_clients(method, params, algorithm) -> int:
     })
     data = data.encode() + b'\n'
     count = 0
-    async with client_lock:
+    async with client_lock.get():
         for client in client_list:
             try:
                 if client.algorithm == algorithm:
@@ -175,7 +234,7 @@ async def broadcast_clients(method, params, algorithm) -> int:
                     count += 1
             except ConnectionResetError:
                 # warning: don't remove from client_list
-                log.debug(f"broadcast: connection reset by {client}")
+                log.debug("broadcast: connection reset by %s", client)
             except Exception:
                 log.error("broadcast_clients exception", exc_info=True)
     return count
@@ -195,6 +254,9 @@ __all__ = [
     "closed_deque",
     "Client",
     "create_client",
+    "CLIENT_SORT_KEYS",
+    "filter_clients",
+    "sort_clients",
     "response_success",
     "response_failed",
     "broadcast_clients",
@@ -0,0 +1,238 @@
+from bc4py_stratum_pool.config import Const
+from bc4py_stratum_pool.client import client_list
+from bc4py_stratum_pool.job import Job, add_new_job, get_best_job, store_job
+from bc4py_stratum_pool.commands import mining_notify
+from bc4py_stratum_pool.methods import *
+from bc4py_stratum_pool.stratum import stratum_server, stratum_list, Stratum
+from bc4py_stratum_pool.eventloop import setup_event_loop
+from bc4py_stratum_pool.monitor import start_loop_monitor
+from bc4py_stratum_pool.logqueue import start_log_listener
+from bc4py_stratum_pool.metrics import export_samples
+from bc4py_stratum_pool.profiler import set_submit_profile, dump_submit_profile, profile_stats
+from bc4py_stratum_pool import link
+from bc4py.config import C
+from binascii import a2b_hex
+from collections import defaultdict
+from logging import getLogger
+from typing import Dict, List, Tuple, Callable, Optional
+from time import time
+import multiprocessing
+import asyncio
+import socket
+
+"""multi-process & multi-host stratum
+
+worker processes accept stratum connections on shared ports (SO_REUSEPORT),
+validate shares locally and forward accounts, shares and mined blocks to the coordinator by link.
+the coordinator owns jobs, database and payout, new jobs are broadcast to workers.
+frontends are workers on other hosts, connected to the coordinator (aggregator) by authenticated TCP link.
+"""
+
+log = getLogger(__name__)
+STATS_SPAN = 10.0
+SUPERVISE_SPAN = 5.0
+# worker name -> (time, {'workers': {name: int}, 'hashrate': {name: int}, 'metrics': {name: samples}})
+worker_stats: Dict[str, Tuple[float, dict]] = dict()
+
+
+"""coordinator side
+"""
+
+
+async def on_job(peer, data):
+    job = None if data['force_renew'] else get_best_job(data['algorithm'])
+    if job is None:
+        job = await add_new_job(data['algorithm'], force_renew=data['force_renew'])
+    return job.to_dict()
+
+
+async def on_account(peer, address):
+    return await get_account_id(address)
+
+
+async def on_subscribe(peer, extranonce):
+    subscription_id = await new_subscription(a2b_hex(extranonce))
+    return subscription_id.hex()
+
+
+async def on_resume(peer, subscription_id):
+    extranonce = await get_subscription_extranonce(a2b_hex(subscription_id))
+    return None if extranonce is None else extranonce.hex()
+
+
+async def on_mined(peer, data):
+    return await submit_mined_block(data['algorithm'], data['height'], a2b_hex(data['hash']), a2b_hex(data['data']))
+
+
+async def on_shares(peer, data):
+    """apply a batch once, retried batch after lost ack is ignored"""
+    if not link.link_hub.begin_batch(data['id']):
+        return 0
+    try:
+        rows = [(ntime, account_id, algorithm, blockhash and a2b_hex(blockhash), share, payout_id)
+                for ntime, account_id, algorithm, blockhash, share, payout_id in data['rows']]
+        await record_shares(rows)
+    except Exception:
+        link.link_hub.abort_batch(data['id'])
+        raise
+    return len(rows)
+
+
+async def on_stats(peer, data):
+    worker_stats[peer.name] = (time(), data)
+
+
+coordinator_handlers = {
+    'job': on_job,
+    'account': on_account,
+    'subscribe': on_subscribe,
+    'resume': on_resume,
+    'mined': on_mined,
+    'shares': on_shares,
+    'stats': on_stats,
+}
+
+
+def count_workers() -> Tuple[Dict[str, int], Dict[str, int]]:
+    """workers & hashrate by algorithm name, local clients and reported by workers"""
+    workers = defaultdict(int)
+    hashrate = defaultdict(int)
+    for client in client_list:
+        workers[client.consensus_name] += 1
+        hashrate[client.consensus_name] += client.hashrate
+    limit = time() - STATS_SPAN * 3
+    for ntime, data in worker_stats.values():
+        if ntime < limit:
+            continue  # lost worker
+        for name, count in data['workers'].items():
+            workers[name] += count
+        for name, value in data['hashrate'].items():
+            hashrate[name] += value
+    return workers, hashrate
+
+
+def worker_metrics() -> Dict[str, Dict[str, list]]:
+    """metric samples reported by alive workers"""
+    limit = time() - STATS_SPAN * 3
+    return {name: data['metrics'] for name, (ntime, data) in worker_stats.items()
+            if limit <= ntime and 'metrics' in data}
+
+
+def spawn_stratum_worker(index, ipc_path, stratum_args, setup) -> multiprocessing.Process:
+    const = {key: value for key, value in vars(Const).items() if not key.startswith('_')}
+    context = multiprocessing.get_context('spawn')
+    process = context.Process(target=worker_main, args=(index, ipc_path, stratum_args, const, setup),
+                              name=f"stratum-worker{index}", daemon=True)
+    process.start()
+    log.info(f"spawn stratum worker{index} pid={process.pid}")
+    return process
+
+
+async def auto_stratum_workers(number: int, ipc_path: str, stratum_args: List[tuple], setup: Optional[Callable] = None):
+    """
+    start coordinator & worker processes, restart dead workers
+    :param number: worker processes, CPU cores
+    :param ipc_path: unix socket path of link
+    :param stratum_args: [(port, algorithm, difficulty, variable_diff), ...]
+    :param setup: picklable function called first on workers, ex. set V.BECH32_HRP
+    """
+    await link.start_link_hub(ipc_path, coordinator_handlers)
+    for port, algorithm, difficulty, *others in stratum_args:
+        variable_diff = others[0] if others else True
+        stratum_list.append(Stratum(port, C.consensus2name[algorithm], difficulty, variable_diff))
+    processes = [spawn_stratum_worker(index, ipc_path, stratum_args, setup) for index in range(number)]
+    while True:
+        await asyncio.sleep(SUPERVISE_SPAN)
+        for index, process in enumerate(processes):
+            if not process.is_alive():
+                log.warning(f"stratum worker{index} exit code={process.exitcode}, restart")
+                processes[index] = spawn_stratum_worker(index, ipc_path, stratum_args, setup)
+
+
+"""worker side
+"""
+
+
+async def on_new_job(peer, data):
+    job = store_job(Job.from_dict(data['job']))
+    await mining_notify(job, f_clean=data['f_clean'])
+
+
+async def on_profile(peer, data):
+    """same as /admin/profile on the coordinator"""
+    if data['every'] is not None or data['reset']:
+        set_submit_profile(profile_stats['every'] if data['every'] is None else data['every'], data['reset'])
+    return dump_submit_profile(data['sort'], data['limit'])
+
+
+worker_handlers = {
+    'job': on_new_job,
+    'profile': on_profile,
+}
+
+
+async def report_worker_stats():
+    while True:
+        await asyncio.sleep(STATS_SPAN)
+        workers = defaultdict(int)
+        hashrate = defaultdict(int)
+        for client in client_list:
+            workers[client.consensus_name] += 1
+            hashrate[client.consensus_name] += client.hashrate
+        link.link_client.notify('stats', {'workers': workers, 'hashrate': hashrate, 'metrics': export_samples()})
+
+
+async def start_worker(addresses, stratum_args, name, secret=None, reuse_port=True):
+    await link.connect_link(addresses, worker_handlers, name, secret)
+    for port, algorithm, difficulty, *others in stratum_args:
+        variable_diff = others[0] if others else True
+        await stratum_server(port, algorithm, difficulty, variable_diff, reuse_port=reuse_port)
+    asyncio.ensure_future(report_worker_stats())
+    start_loop_monitor()
+
+
+async def start_aggregator(address: str, secret):
+    """
+    accept stratum frontends of other hosts, run with database & auto_* tasks
+    :param address: listen address `tcp://host:port`
+    :param secret: shared secret of frontends
+    """
+    assert secret, 'aggregator open to network require secret'
+    await link.start_link_hub(address, coordinator_handlers, secret)
+
+
+async def start_frontend(addresses: List[str], stratum_args: List[tuple], secret, name=None):
+    """
+    stateless stratum frontend, shares are streamed to aggregator by batch
+    buffered shares are kept and resent while aggregator is down, next address is tried on failure
+    :param addresses: aggregator addresses `tcp://host:port`, primary first
+    :param stratum_args: [(port, algorithm, difficulty, variable_diff), ...]
+    :param secret: shared secret of aggregator
+    """
+    await start_worker(addresses, stratum_args, name or socket.gethostname(), secret, reuse_port=False)
+
+
+def worker_main(index, ipc_path, stratum_args, const, setup):
+    """entry point of a worker process"""
+    if setup is not None:
+        setup()
+    start_log_listener()
+    for key, value in const.items():
+        setattr(Const, key, value)
+    loop = setup_event_loop(Const.EVENT_LOOP)
+    loop.run_until_complete(start_worker(ipc_path, stratum_args, f"worker{index}"))
+    log.info(f"stratum worker{index} ready")
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+__all__ = [
+    "worker_stats",
+    "count_workers",
+    "worker_metrics",
+    "auto_stratum_workers",
+    "start_aggregator",
+    "start_frontend",
+]
@@ -1,8 +1,12 @@
 from bc4py_stratum_pool.client import *
 from bc4py_stratum_pool.job import *
+from bc4py_stratum_pool.metrics import NOTIFY_LATENCY
+from bc4py_stratum_pool import link
 from bc4py_extension import sha256d_hash
+from bc4py.config import C
 from more_itertools import chunked
 from logging import getLogger
+from time import perf_counter
 
 log = getLogger(__name__)
 
@@ -34,8 +38,21 @@ async def mining_notify(job: Job, f_clean=False):
         nTime. The current time     nTime rolling should be supported, but should not increase faster than actual time.
         Clean Jobs    If true, miners should abort their current work and immediately use the new job. If false, they can still use the current job, but should move to the new one after exhausting the current nonce range.
     """
+    params = build_notify_params(job, f_clean)
+    s = perf_counter()
+    count = await broadcast_clients('mining.notify', params, job.algorithm)
+    NOTIFY_LATENCY.labels(C.consensus2name[job.algorithm]).observe(perf_counter() - s)
+    log.debug(f"broadcast {count} clients")
+    if link.link_hub is not None:
+        # coordinator mode, workers notify their clients
+        count = link.link_hub.broadcast('job', {'job': job.to_dict(), 'f_clean': f_clean})
+        log.debug(f"broadcast {count} workers")
+
+
+def build_notify_params(job: Job, f_clean: bool) -> list:
+    """mining.notify params of the job"""
     unconfirmed = [txhash for txhash, _ in job.unconfirmed]
-    params = [
+    return [
         job.job_id.to_bytes(4, 'big').hex(),
         swap_pre_processed_sha2(job.previous_hash).hex(),
         job.coinbase1.hex(),
@@ -46,8 +63,6 @@ async def mining_notify(job: Job, f_clean=False):
         job.ntime.to_bytes(4, 'big').hex(),
         f_clean,
     ]
-    count = await broadcast_clients('mining.notify', params, job.algorithm)
-    log.debug(f"broadcast {count} clients")
 
 
 async def client_reconnect(client: Client, host, port):
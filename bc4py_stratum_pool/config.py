@@ -7,11 +7,19 @@ class Const:
     """const params, do not edit this file"""
     REST_API = 'http://127.0.0.1:3000'
     DATABASE_PATH = 'pool.db'
+    # pruned shares archive folder, disabled by None
+    ARCHIVE_DIR: Optional[str] = None
     HOST_NAME = 'localhost'
 
     # how to payout? 'transaction' or 'coinbase'
     PAYOUT_METHOD: Optional[str] = None
 
+    # event loop of worker processes, 'auto' (uvloop if installed), 'uvloop' or 'default'
+    EVENT_LOOP = 'auto'
+
+    # admin API token (dispatch stats & sampling profiler), disabled by None
+    ADMIN_TOKEN: Optional[str] = None
+
 
 # accept lower works divided by co_efficiency
 co_efficiency = {
@@ -0,0 +1,62 @@
+from logging import getLogger
+import asyncio
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+"""event loop selection
+
+call setup_event_loop() once at startup before any task is created,
+modules get the running loop when they need it.
+module level Lock/Event/Queue are LoopLocal, created on first use in the running loop
+(on Python < 3.10 they bind the loop of import time otherwise).
+"""
+
+log = getLogger(__name__)
+LOOP_POLICIES = ('auto', 'uvloop', 'default')
+
+
+class LoopLocal(object):
+    """asyncio primitive created on first use, again when the loop is replaced"""
+    __slots__ = ("factory", "obj", "loop")
+
+    def __init__(self, factory, *args):
+        self.factory = (factory, args)
+        self.obj = None
+        self.loop = None
+
+    def get(self):
+        loop = asyncio.get_event_loop()
+        if self.obj is None or self.loop is not loop:
+            factory, args = self.factory
+            self.obj = factory(*args)
+            self.loop = loop
+        return self.obj
+
+
+def setup_event_loop(policy='auto') -> asyncio.AbstractEventLoop:
+    """
+    create new event loop and set as current
+    :param policy: 'auto' uvloop if installed, 'uvloop' required, 'default' asyncio loop
+    """
+    if policy not in LOOP_POLICIES:
+        raise ValueError(f"unknown loop policy {policy}, select {LOOP_POLICIES}")
+    if policy == 'uvloop' and uvloop is None:
+        raise ImportError('uvloop is not installed, pip3 install uvloop')
+    if policy != 'default' and uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    else:
+        asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    log.info(f"setup event loop {type(loop).__module__}.{type(loop).__name__}")
+    return loop
+
+
+__all__ = [
+    "LOOP_POLICIES",
+    "LoopLocal",
+    "setup_event_loop",
+]
@@ -0,0 +1,91 @@
+from aiohttp.web import Request
+from aiohttp import web, WSCloseCode, WSMsgType
+from logging import getLogger
+from typing import Set
+from time import time
+import asyncio
+import json
+
+"""WebSocket push feed
+
+messages: {"cmd": "Block"|"PoolStatus"|"Mined", "time": int, "data": ...}
+a subscriber overflowing its queue is dropped, client should reconnect
+"""
+
+log = getLogger(__name__)
+SUBSCRIBER_QUEUE_SIZE = 64
+subscribers: Set['Subscriber'] = set()
+feed_stats = {'published': 0, 'dropped': 0}
+
+
+class Subscriber(object):
+    __slots__ = ("que", "peer", "f_dropped")
+
+    def __init__(self, peer):
+        self.que = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.peer = peer
+        self.f_dropped = False
+
+    def __repr__(self):
+        return f"<Subscriber {self.peer} que={self.que.qsize()} dropped={self.f_dropped}>"
+
+    def push(self, msg: str):
+        if self.f_dropped:
+            return
+        try:
+            self.que.put_nowait(msg)
+        except asyncio.QueueFull:
+            # slow consumer, clear queue and notify close by None
+            self.f_dropped = True
+            while not self.que.empty():
+                self.que.get_nowait()
+            self.que.put_nowait(None)
+            feed_stats['dropped'] += 1
+            log.debug(f"drop slow subscriber {self}")
+
+
+def publish(cmd: str, data):
+    """serialize once and push to all subscribers"""
+    if len(subscribers) == 0:
+        return
+    msg = json.dumps({'cmd': cmd, 'time': int(time()), 'data': data}, separators=(',', ':'))
+    for subscriber in subscribers:
+        subscriber.push(msg)
+    feed_stats['published'] += 1
+
+
+async def ws_feed(request: Request):
+    """push delta messages to subscriber"""
+    ws = web.WebSocketResponse(heartbeat=30.0)
+    await ws.prepare(request)
+    subscriber = Subscriber(request.remote)
+    subscribers.add(subscriber)
+    log.debug(f"new subscriber {subscriber}")
+
+    async def sender():
+        while not ws.closed:
+            msg = await subscriber.que.get()
+            if msg is None:
+                await ws.close(code=WSCloseCode.TRY_AGAIN_LATER, message=b'slow consumer')
+                return
+            await ws.send_str(msg)
+
+    task = asyncio.ensure_future(sender())
+    try:
+        # receive to handle close & ping frames, ignore client messages
+        async for msg in ws:
+            if msg.type == WSMsgType.ERROR:
+                break
+    finally:
+        subscribers.discard(subscriber)
+        task.cancel()
+        log.debug(f"close subscriber {subscriber}")
+    return ws
+
+
+__all__ = [
+    "subscribers",
+    "feed_stats",
+    "publish",
+    "ws_feed",
+]
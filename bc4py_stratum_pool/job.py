@@ -1,5 +1,8 @@
 from bc4py_stratum_pool.config import *
 from bc4py_stratum_pool.ask import *
+from bc4py_stratum_pool.metrics import Gauge
+from bc4py_stratum_pool.eventloop import LoopLocal
+from bc4py_stratum_pool import link
 from bc4py.config import C
 from bc4py.chain.tx import TX
 from bc4py.chain.block import Block
@@ -8,17 +11,17 @@ from bc4py.chain.workhash import update_work_hash
 from bc4py_extension import merkleroot_hash, sha256d_hash, PyAddress
 from expiringdict import ExpiringDict
 from binascii import a2b_hex
-from logging import getLogger
+from logging import getLogger, DEBUG
 from typing import Optional, List, Tuple, Dict
 from time import time
 import asyncio
 
-loop = asyncio.get_event_loop()
-lock = asyncio.Lock()
+lock = LoopLocal(asyncio.Lock)
 # job will expired in 5min
 job_dict: Dict[int, 'Job'] = ExpiringDict(max_len=2000, max_age_seconds=300)
 DEFAULT_TARGET = float(0x00000000ffff0000000000000000000000000000000000000000000000000000)
 log = getLogger(__name__)
+JOBS = Gauge('pool_jobs', 'jobs kept for submit', func=lambda: len(job_dict))
 
 
 class Job(object):
@@ -53,6 +56,34 @@ class Job(object):
     def difficulty(self):
         return round(DEFAULT_TARGET / bits2target(int.from_bytes(self.bits, 'big')), 8)
 
+    def to_dict(self) -> dict:
+        """serialize for link"""
+        return {
+            'job_id': self.job_id,
+            'previous_hash': self.previous_hash.hex(),
+            'coinbase1': self.coinbase1.hex(),
+            'unconfirmed': [(txhash.hex(), data.hex()) for txhash, data in self.unconfirmed],
+            'version': self.version,
+            'bits': self.bits.hex(),
+            'ntime': self.ntime,
+            'height': self.height,
+            'algorithm': self.algorithm,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Job':
+        return cls(
+            job_id=data['job_id'],
+            previous_hash=a2b_hex(data['previous_hash']),
+            coinbase=a2b_hex(data['coinbase1']) + b'\x00' * 8,
+            unconfirmed=[(a2b_hex(txhash), a2b_hex(tx)) for txhash, tx in data['unconfirmed']],
+            version=data['version'],
+            bits=a2b_hex(data['bits']),
+            ntime=data['ntime'],
+            height=data['height'],
+            algorithm=data['algorithm'],
+        )
+
 
 def get_submit_data(job: Job, extranonce1: bytes, extranonce2: bytes, nonce: bytes, difficulty: float) \
         -> (Optional[bytes], bytes, bool, bool):
@@ -77,11 +108,13 @@ def get_submit_data(job: Job, extranonce1: bytes, extranonce2: bytes, nonce: byt
     update_work_hash(block)
     f_mined = block.pow_check()
     f_shared = block.pow_check(int(DEFAULT_TARGET / difficulty))
-    log.debug(f"block -> {block.height} {block.hash.hex()}")
-    log.debug(f"coinbase -> {coinbase.hex()}")
-    log.debug(f"header -> {block.b.hex()}")
-    log.debug(f"merkleroot -> {len(merkleroot_list)} {merkleroot.hex()}")
-    log.debug(f"workhash -> {block.work_hash.hex()} mined:{f_mined} shared:{f_shared}")
+    if log.isEnabledFor(DEBUG):
+        # hex encoding is not free, skip when debug is off
+        log.debug(f"block -> {block.height} {block.hash.hex()}")
+        log.debug(f"coinbase -> {coinbase.hex()}")
+        log.debug(f"header -> {block.b.hex()}")
+        log.debug(f"merkleroot -> {len(merkleroot_list)} {merkleroot.hex()}")
+        log.debug(f"workhash -> {block.work_hash.hex()} mined:{f_mined} shared:{f_shared}")
     # generate submit data when mined
     if f_mined:
         submit_data = block.b
@@ -109,7 +142,11 @@ async def add_new_job(algorithm: int, force_renew=False) -> Job:
     :param algorithm: specify by algorithm int
     :param force_renew: flag use template method
     """
-    async with lock:
+    if link.link_client is not None:
+        # worker mode, coordinator creates jobs
+        data = await link.link_client.request('job', {'algorithm': algorithm, 'force_renew': force_renew})
+        return store_job(Job.from_dict(data))
+    async with lock.get():
         if len(job_dict) == 0:
             job_id = 1
         else:
@@ -175,6 +212,12 @@ async def add_new_job(algorithm: int, force_renew=False) -> Job:
     return new_job
 
 
+def store_job(job: Job) -> Job:
+    """add job created by coordinator"""
+    job_dict[job.job_id] = job
+    return job
+
+
 def get_job_by_id(job_id: int) -> Optional[Job]:
     if job_id in job_dict:
         return job_dict[job_id]
@@ -196,6 +239,7 @@ __all__ = [
     "Job",
     "get_submit_data",
     "add_new_job",
+    "store_job",
     "get_job_by_id",
     "get_best_job",
 ]
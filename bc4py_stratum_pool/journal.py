@@ -0,0 +1,282 @@
+from bc4py_stratum_pool.account import *
+from bc4py_stratum_pool.eventloop import setup_event_loop
+from bc4py_stratum_pool.metrics import DB_WRITE_LATENCY
+from typing import Optional, List, Iterator, Tuple
+from logging import getLogger
+from zlib import crc32
+from time import time, perf_counter
+import asyncio
+import struct
+import mmap
+import os
+
+"""append-only share journal
+
+record: fixed 60 bytes
+    time(double), account_id(uint32), algorithm(uint16), payout_id(int8),
+    has_blockhash(uint8), share(double), blockhash(32bytes), crc32(uint32)
+segment: `{number:08d}.jnl` rotated by `segment_records`
+"""
+
+log = getLogger(__name__)
+RECORD = struct.Struct('<dIHbBd32s')
+CRC = struct.Struct('<I')
+RECORD_SIZE = RECORD.size + CRC.size
+SEGMENT_SUFFIX = '.jnl'
+share_journal: Optional['ShareJournal'] = None
+
+
+class ShareJournal(object):
+    __slots__ = ("directory", "segment_records", "segment", "count", "fp", "f_dirty")
+
+    def __init__(self, directory, segment_records=65536):
+        self.directory = directory
+        self.segment_records = segment_records
+        os.makedirs(directory, exist_ok=True)
+        segments = list_segments(directory)
+        self.segment = segments[-1] if segments else 1
+        self.fp = None
+        self.count = 0
+        self.f_dirty = False
+        self._open_segment()
+
+    def __repr__(self):
+        return f"<ShareJournal {self.directory} segment={self.segment} count={self.count}>"
+
+    def _open_segment(self):
+        path = get_segment_path(self.directory, self.segment)
+        # cut torn tail written on crash
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size % RECORD_SIZE:
+            log.warning(f"truncate torn record {path} {size % RECORD_SIZE}bytes")
+            with open(path, 'r+b') as fp:
+                fp.truncate(size - size % RECORD_SIZE)
+        self.fp = open(path, 'ab', buffering=0)
+        self.count = size // RECORD_SIZE
+
+    def append(self, account_id, algorithm, blockhash, share, payout_id, ntime=None):
+        """write one share record, durable after next sync()"""
+        if self.segment_records <= self.count:
+            self.rotate()
+        b = RECORD.pack(time() if ntime is None else ntime, account_id, algorithm, payout_id,
+                        0 if blockhash is None else 1, share, blockhash or b'')
+        self.fp.write(b + CRC.pack(crc32(b)))
+        self.count += 1
+        self.f_dirty = True
+
+    def rotate(self):
+        """close current segment and start next"""
+        os.fsync(self.fp.fileno())
+        self.fp.close()
+        self.segment += 1
+        self._open_segment()
+        log.debug(f"rotate journal segment={self.segment}")
+
+    async def sync(self):
+        """fsync on executor"""
+        if not self.f_dirty:
+            return
+        self.f_dirty = False
+        await asyncio.get_event_loop().run_in_executor(None, os.fsync, self.fp.fileno())
+
+    def close(self):
+        os.fsync(self.fp.fileno())
+        self.fp.close()
+
+
+def open_journal(directory, segment_records=65536) -> ShareJournal:
+    """enable journal as the primary share write path"""
+    global share_journal
+    share_journal = ShareJournal(directory, segment_records)
+    log.info(f"open share journal {share_journal}")
+    return share_journal
+
+
+def get_segment_path(directory, segment) -> str:
+    return os.path.join(directory, f"{segment:08d}{SEGMENT_SUFFIX}")
+
+
+def list_segments(directory) -> List[int]:
+    if not os.path.isdir(directory):
+        return []
+    return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory)
+                  if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+
+
+def iter_segment(path, offset=0) -> Iterator[Tuple[int, tuple]]:
+    """read records by mmap, yield (next_offset, row), stop at torn or broken record"""
+    size = os.path.getsize(path)
+    size -= size % RECORD_SIZE
+    if size <= offset:
+        return
+    with open(path, 'rb') as fp:
+        with mmap.mmap(fp.fileno(), size, access=mmap.ACCESS_READ) as mm:
+            for pos in range(offset, size, RECORD_SIZE):
+                b = mm[pos:pos + RECORD.size]
+                if CRC.unpack_from(mm, pos + RECORD.size)[0] != crc32(b):
+                    log.warning(f"broken journal record {path} offset={pos}")
+                    return
+                ntime, account_id, algorithm, payout_id, has_blockhash, share, blockhash = RECORD.unpack(b)
+                yield pos + RECORD_SIZE, (ntime, account_id, algorithm,
+                                          blockhash if has_blockhash else None, share, payout_id)
+
+
+def iter_window(directory, begin, end) -> Iterator[tuple]:
+    """scan shares begin <= time < end without database"""
+    for segment in list_segments(directory):
+        for _, row in iter_segment(get_segment_path(directory, segment)):
+            if begin <= row[0] < end:
+                yield row
+
+
+async def fold_journal(path, directory, max_rows=50000, keep_segments=16) -> int:
+    """
+    fold journal records into database (background indexer)
+    insert is idempotent by share `time` primary key, replay after crash is safe
+    unpaid shares are counted to balance here, by rows actually inserted
+    """
+    async with create_db(path) as db:
+        cur = await db.cursor()
+        checkpoint = await read_journal_checkpoint(cur)
+    segments = list_segments(directory)
+    count = 0
+    for segment in segments:
+        if checkpoint is not None and segment < checkpoint[0]:
+            continue
+        offset = checkpoint[1] if checkpoint and segment == checkpoint[0] else 0
+        rows = list()
+        for offset, row in iter_segment(get_segment_path(directory, segment), offset):
+            rows.append(row)
+            if max_rows <= count + len(rows):
+                break
+        checkpoint = (segment, offset)
+        if 0 < len(rows):
+            await insert_journal_shares(path, rows)
+            count += len(rows)
+            async with create_db(path) as db:
+                cur = await db.cursor()
+                await write_journal_checkpoint(cur, segment, offset)
+                await db.commit()
+        if max_rows <= count:
+            break
+    # remove old folded segments
+    if checkpoint is not None:
+        for segment in segments[:-keep_segments]:
+            if segment < checkpoint[0]:
+                os.remove(get_segment_path(directory, segment))
+                log.debug(f"remove folded journal segment={segment}")
+    return count
+
+
+async def insert_journal_shares(path, rows) -> int:
+    """
+    insert rows by each share database, ignore rows already recoded (same share time)
+    unpaid share is counted to balance only by actually inserted rows, resent rows are not counted twice
+    """
+    count = 0
+    grouped = dict()
+    for row in rows:
+        grouped.setdefault(row[2], list()).append(row)
+    for algorithm, algorithm_rows in grouped.items():
+        s = perf_counter()
+        account_ids = {row[1] for row in algorithm_rows}
+        begin_share_writing(account_ids)
+        try:
+            async with create_share_db(path, algorithm) as db:
+                cur = await db.cursor()
+                await cur.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS `incoming` (
+                `time` REAL, `account_id` INTEGER, `algorithm` INTEGER, `blockhash` BLOB, `share` REAL, `payout_id` INTEGER
+                )""")
+                await cur.execute("DELETE FROM temp.`incoming`")
+                await cur.executemany("""
+                INSERT INTO temp.`incoming` VALUES (?,?,?,?,?,?)
+                """, algorithm_rows)
+                # first row of each time in the batch, not recoded yet
+                await cur.execute("""
+                SELECT `account_id`, `share`, `payout_id` FROM temp.`incoming` AS i
+                WHERE i.`rowid` IN (SELECT MIN(`rowid`) FROM temp.`incoming` GROUP BY `time`)
+                AND NOT EXISTS (SELECT 1 FROM `share` AS s WHERE s.`time`=i.`time`)
+                """)
+                inserted = await cur.fetchall()
+                await cur.execute("""
+                INSERT OR IGNORE INTO `share` (
+                `time`, `account_id`, `algorithm`, `blockhash`, `share`, `payout_id`
+                ) SELECT `time`, `account_id`, `algorithm`, `blockhash`, `share`, `payout_id`
+                FROM temp.`incoming` ORDER BY `rowid`
+                """)
+                await db.commit()
+            for account_id, share, payout_id in inserted:
+                if payout_id == 0:
+                    add_balance_share(account_id, share)
+        finally:
+            end_share_writing(account_ids)
+        count += len(inserted)
+        DB_WRITE_LATENCY.labels('batch').observe(perf_counter() - s)
+    return count
+
+
+async def read_journal_checkpoint(cur) -> Optional[Tuple[int, int]]:
+    await cur.execute("""
+    CREATE TABLE IF NOT EXISTS `journal` (
+    `segment` INTEGER PRIMARY KEY,
+    `offset` INTEGER NOT NULL
+    )""")
+    await cur.execute("""
+    SELECT `segment`, `offset` FROM `journal` ORDER BY `segment` DESC
+    """)
+    return await cur.fetchone()
+
+
+async def write_journal_checkpoint(cur, segment, offset):
+    await cur.execute("DELETE FROM `journal`")
+    await cur.execute("""
+    INSERT INTO `journal` (`segment`, `offset`) VALUES (?, ?)
+    """, (segment, offset))
+
+
+async def replay_journal(path, directory) -> int:
+    """rebuild share tables from journal after crash"""
+    async with create_db(path) as db:
+        cur = await db.cursor()
+        await read_journal_checkpoint(cur)
+        await cur.execute("DELETE FROM `journal`")
+        await db.commit()
+    total = 0
+    while True:
+        count = await fold_journal(path, directory, keep_segments=len(list_segments(directory)))
+        if count == 0:
+            break
+        total += count
+    log.info(f"replay journal {total} shares")
+    return total
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='rebuild share database from journal')
+    parser.add_argument('journal', help='journal folder')
+    parser.add_argument('--db', default='pool.db', help='core database path')
+    parser.add_argument('--shard', type=int, nargs='*', default=None, help='shard algorithms')
+    args = parser.parse_args()
+    loop = setup_event_loop()
+    loop.run_until_complete(first_init_database(args.db, shard_algorithms=args.shard))
+    count = loop.run_until_complete(replay_journal(args.db, args.journal))
+    # balance of replayed unpaid shares
+    loop.run_until_complete(flush_write_behind(args.db))
+    print(f"replayed {count} shares")
+
+
+__all__ = [
+    "RECORD_SIZE",
+    "ShareJournal",
+    "open_journal",
+    "iter_segment",
+    "iter_window",
+    "fold_journal",
+    "replay_journal",
+]
+
+
+if __name__ == '__main__':
+    main()
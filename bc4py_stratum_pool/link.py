@@ -0,0 +1,381 @@
+from typing import Optional, Dict, Set, Callable, List, Deque, Tuple
+from collections import deque, OrderedDict
+from logging import getLogger
+from hashlib import sha256
+import asyncio
+import hmac
+import json
+import os
+
+"""link between stratum workers (or frontends) and the coordinator (aggregator)
+
+address: unix socket path or `tcp://host:port`
+line-delimited json
+    request:  {"id": int, "cmd": str, "data": ...}
+    notify:   {"id": null, "cmd": str, "data": ...}
+    response: {"id": int, "result": ..., "error": str or null}
+handshake: hub sends `challenge` nonce, client answers `auth` by HMAC-SHA256(secret, nonce), hub sends `ready`
+shares are buffered on client and sent by `shares` batch request, retried with same batch id until acked
+"""
+
+log = getLogger(__name__)
+MAX_LINE_SIZE = 16 * 1024 * 1024  # job with many txs
+HANDSHAKE_TIMEOUT = 10.0
+RECONNECT_SPAN = 1.0
+BATCH_SPAN = 0.1
+BATCH_SIZE = 1000
+SHARE_BUFFER_SIZE = 1000000  # kept while hub is down
+MAX_DISPATCH = 64  # running handlers by a worker connection on hub, stop reading when full
+link_hub: Optional['LinkHub'] = None  # coordinator side
+link_client: Optional['LinkClient'] = None  # worker side
+link_stats = {'request': 0, 'notify': 0, 'batch': 0, 'retry': 0, 'duplicate': 0,
+              'dropped': 0, 'error': 0, 'auth_failed': 0, 'throttled': 0}
+
+
+class LinkError(Exception):
+    pass
+
+
+def parse_address(address) -> Tuple[Optional[str], Optional[str], Optional[int]]:
+    """(path, host, port)"""
+    if address.startswith('tcp://'):
+        host, port = address[6:].rsplit(':', 1)
+        return None, host, int(port)
+    return address, None, None
+
+
+def sign(secret, nonce: bytes) -> str:
+    if not secret:
+        return ''
+    if isinstance(secret, str):
+        secret = secret.encode()
+    return hmac.new(secret, nonce, sha256).hexdigest()
+
+
+async def read_message(reader: asyncio.StreamReader) -> dict:
+    line = await asyncio.wait_for(reader.readline(), HANDSHAKE_TIMEOUT)
+    if not line:
+        raise ConnectionError('link closed on handshake')
+    return json.loads(line)
+
+
+class LinkPeer(object):
+    """one end of a link connection"""
+    __slots__ = ("name", "reader", "writer", "handlers", "pending", "request_id", "dispatching")
+
+    def __init__(self, name, reader, writer, handlers, max_dispatch=None):
+        """
+        max_dispatch: bound of running handlers, only on hub side because
+        worker handlers may request to the hub and wait the response on this reader
+        """
+        self.name = name
+        self.reader: asyncio.StreamReader = reader
+        self.writer: asyncio.StreamWriter = writer
+        self.handlers: Dict[str, Callable] = handlers
+        self.pending: Dict[int, asyncio.Future] = dict()
+        self.request_id = 0
+        self.dispatching = asyncio.Semaphore(max_dispatch) if max_dispatch else None
+
+    def __repr__(self):
+        return f"<LinkPeer {self.name} pending={len(self.pending)}>"
+
+    def send(self, msg: dict):
+        self.writer.write(json.dumps(msg, separators=(',', ':')).encode() + b'\n')
+
+    async def request(self, cmd, data, timeout=10.0):
+        """send request & wait for the response"""
+        self.request_id += 1
+        request_id = self.request_id
+        future = self.pending[request_id] = asyncio.get_event_loop().create_future()
+        try:
+            self.send({'id': request_id, 'cmd': cmd, 'data': data})
+            await self.writer.drain()
+            link_stats['request'] += 1
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(request_id, None)
+
+    def notify(self, cmd, data):
+        """send without response"""
+        self.send({'id': None, 'cmd': cmd, 'data': data})
+        link_stats['notify'] += 1
+
+    async def serve(self):
+        """receive loop until disconnected"""
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                msg = json.loads(line)
+                if 'cmd' in msg:
+                    if self.dispatching is not None:
+                        # back pressure to the peer by socket buffer
+                        if self.dispatching.locked():
+                            link_stats['throttled'] += 1
+                        await self.dispatching.acquire()
+                    asyncio.ensure_future(self.dispatch(msg))
+                else:
+                    future = self.pending.get(msg['id'])
+                    if future is None or future.done():
+                        continue
+                    elif msg['error'] is None:
+                        future.set_result(msg['result'])
+                    else:
+                        future.set_exception(LinkError(msg['error']))
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"link closed {self.name}"))
+            self.writer.close()
+
+    async def dispatch(self, msg):
+        result = error = None
+        try:
+            handler = self.handlers.get(msg['cmd'])
+            if handler is None:
+                raise LinkError(f"unknown cmd {msg['cmd']}")
+            result = await handler(self, msg['data'])
+        except Exception as e:
+            link_stats['error'] += 1
+            log.warning(f"link cmd {msg['cmd']} failed by {e!r}", exc_info=not isinstance(e, LinkError))
+            error = str(e)
+        finally:
+            if self.dispatching is not None:
+                self.dispatching.release()
+        if msg['id'] is not None and not self.writer.is_closing():
+            self.send({'id': msg['id'], 'result': result, 'error': error})
+
+
+class LinkHub(object):
+    """coordinator accepts workers, listen on one or more addresses"""
+    __slots__ = ("handlers", "peers", "servers", "count", "batches")
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.peers: Set[LinkPeer] = set()
+        self.servers: List[asyncio.AbstractServer] = list()
+        self.count = 0
+        self.batches: OrderedDict = OrderedDict()  # recently applied batch ids
+
+    def __repr__(self):
+        return f"<LinkHub peers={len(self.peers)}>"
+
+    async def start(self, address, secret=None):
+        """secret: None for local unix socket"""
+        path, host, port = parse_address(address)
+
+        async def accept(reader, writer):
+            await self.accept(reader, writer, secret)
+
+        if path is not None:
+            if os.path.exists(path):
+                os.remove(path)  # stale socket of previous run
+            server = await asyncio.start_unix_server(accept, path, limit=MAX_LINE_SIZE)
+        else:
+            server = await asyncio.start_server(accept, host, port, limit=MAX_LINE_SIZE)
+        self.servers.append(server)
+        log.info(f"start link hub on {address} auth={bool(secret)}")
+
+    def close(self):
+        for server in self.servers:
+            server.close()
+        for peer in self.peers:
+            peer.writer.close()
+        self.servers.clear()
+
+    async def handshake(self, reader, writer, secret) -> str:
+        """return peer name, raise ConnectionError if not authorized"""
+        nonce = os.urandom(16)
+        writer.write(json.dumps({'id': None, 'cmd': 'challenge', 'data': nonce.hex()}).encode() + b'\n')
+        msg = await read_message(reader)
+        if msg.get('cmd') != 'auth' or not hmac.compare_digest(msg['data']['mac'], sign(secret, nonce)):
+            link_stats['auth_failed'] += 1
+            raise ConnectionError(f"link auth failed from {writer.get_extra_info('peername')}")
+        self.count += 1
+        name = f"{msg['data']['name']}#{self.count}"
+        writer.write(json.dumps({'id': None, 'cmd': 'ready', 'data': name}).encode() + b'\n')
+        return name
+
+    async def accept(self, reader, writer, secret):
+        try:
+            name = await self.handshake(reader, writer, secret)
+        except (ConnectionError, asyncio.TimeoutError, ValueError, KeyError, TypeError) as e:
+            log.warning(f"link handshake failed by {e!r}")
+            writer.close()
+            return
+        peer = LinkPeer(name, reader, writer, self.handlers, MAX_DISPATCH)
+        self.peers.add(peer)
+        log.info(f"link connected {peer}")
+        try:
+            await peer.serve()
+        except Exception as e:
+            log.warning(f"link disconnected {peer} by {e!r}")
+        finally:
+            self.peers.discard(peer)
+
+    def begin_batch(self, batch_id) -> bool:
+        """False if already applied (response lost and retried)"""
+        if batch_id in self.batches:
+            link_stats['duplicate'] += 1
+            return False
+        self.batches[batch_id] = None
+        while 100000 < len(self.batches):
+            self.batches.popitem(last=False)
+        return True
+
+    def abort_batch(self, batch_id):
+        """failed to apply, accept the retry"""
+        self.batches.pop(batch_id, None)
+
+    def broadcast(self, cmd, data) -> int:
+        for peer in self.peers:
+            peer.notify(cmd, data)
+        return len(self.peers)
+
+    async def request_all(self, cmd, data, timeout=10.0) -> Dict[str, object]:
+        """request to all peers, {peer name: result or exception}"""
+        peers = list(self.peers)
+        results = await asyncio.gather(
+            *(peer.request(cmd, data, timeout) for peer in peers), return_exceptions=True)
+        return {peer.name: result for peer, result in zip(peers, results)}
+
+
+class LinkClient(object):
+    """worker connects to coordinator, reconnect or fail over to next address when lost"""
+    __slots__ = ("addresses", "handlers", "name", "secret", "peer", "connected",
+                 "share_buffer", "inflight", "session", "batch_number")
+
+    def __init__(self, addresses: List[str], handlers, name='worker', secret=None):
+        self.addresses = addresses
+        self.handlers = handlers
+        self.name = name
+        self.secret = secret
+        self.peer: Optional[LinkPeer] = None
+        self.connected = asyncio.Event()
+        self.share_buffer: Deque[list] = deque()
+        self.inflight: Optional[Tuple[str, List[list]]] = None  # batch waiting ack
+        self.session = os.urandom(8).hex()
+        self.batch_number = 0
+
+    def __repr__(self):
+        address = self.peer.name if self.peer else None
+        return f"<LinkClient {self.name} hub={address} buffer={len(self.share_buffer)}>"
+
+    async def open(self, address) -> LinkPeer:
+        path, host, port = parse_address(address)
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path, limit=MAX_LINE_SIZE)
+        else:
+            reader, writer = await asyncio.open_connection(host, port, limit=MAX_LINE_SIZE)
+        try:
+            msg = await read_message(reader)
+            if msg.get('cmd') != 'challenge':
+                raise ConnectionError('link handshake expect challenge')
+            auth = {'name': self.name, 'mac': sign(self.secret, bytes.fromhex(msg['data']))}
+            writer.write(json.dumps({'id': None, 'cmd': 'auth', 'data': auth}).encode() + b'\n')
+            msg = await read_message(reader)
+            if msg.get('cmd') != 'ready':
+                raise ConnectionError('link handshake expect ready')
+        except Exception:
+            writer.close()
+            raise
+        return LinkPeer(address, reader, writer, self.handlers)
+
+    async def run(self):
+        index = 0
+        while True:
+            address = self.addresses[index % len(self.addresses)]
+            try:
+                self.peer = await self.open(address)
+                self.connected.set()
+                log.info(f"link connected {self}")
+                await self.peer.serve()
+                log.warning(f"link lost {address}")
+            except asyncio.CancelledError:
+                break
+            except (OSError, ConnectionError, ValueError, asyncio.TimeoutError) as e:
+                log.debug(f"link error {address} {e!r}")
+                index += 1  # fail over
+            finally:
+                self.connected.clear()
+                self.peer = None
+            await asyncio.sleep(RECONNECT_SPAN)
+
+    def push_share(self, row: list):
+        """buffer a share, sent by flush_shares"""
+        if SHARE_BUFFER_SIZE <= len(self.share_buffer):
+            self.share_buffer.popleft()
+            link_stats['dropped'] += 1
+        self.share_buffer.append(row)
+
+    async def flush_shares(self):
+        """send buffered shares by batch, keep them until acked"""
+        while True:
+            await asyncio.sleep(BATCH_SPAN)
+            while self.connected.is_set():
+                if self.inflight is None:
+                    if len(self.share_buffer) == 0:
+                        break
+                    self.batch_number += 1
+                    rows = [self.share_buffer.popleft() for _ in range(min(BATCH_SIZE, len(self.share_buffer)))]
+                    self.inflight = (f"{self.session}:{self.batch_number}", rows)
+                batch_id, rows = self.inflight
+                try:
+                    await self.peer.request('shares', {'id': batch_id, 'rows': rows})
+                    self.inflight = None
+                    link_stats['batch'] += 1
+                except (ConnectionError, asyncio.TimeoutError, AttributeError, LinkError) as e:
+                    # retry by same batch id, hub ignores if already applied
+                    link_stats['retry'] += 1
+                    log.debug(f"retry batch {batch_id} by {e!r}")
+                    break
+
+    async def request(self, cmd, data, timeout=10.0):
+        await asyncio.wait_for(self.connected.wait(), timeout)
+        return await self.peer.request(cmd, data, timeout)
+
+    def notify(self, cmd, data) -> bool:
+        if self.peer is None:
+            link_stats['dropped'] += 1
+            return False
+        self.peer.notify(cmd, data)
+        return True
+
+
+async def start_link_hub(address, handlers, secret=None) -> LinkHub:
+    """enable coordinator mode, called again to listen on another address"""
+    global link_hub
+    if link_hub is None:
+        link_hub = LinkHub(handlers)
+    await link_hub.start(address, secret)
+    return link_hub
+
+
+async def connect_link(addresses, handlers, name='worker', secret=None, timeout=10.0) -> LinkClient:
+    """
+    enable worker mode, shares & blocks are forwarded to coordinator
+    addresses: an address or list of addresses tried in order on failure
+    """
+    global link_client
+    if isinstance(addresses, str):
+        addresses = [addresses]
+    link_client = LinkClient(addresses, handlers, name, secret)
+    asyncio.ensure_future(link_client.run())
+    asyncio.ensure_future(link_client.flush_shares())
+    try:
+        await asyncio.wait_for(link_client.connected.wait(), timeout)
+    except asyncio.TimeoutError:
+        log.warning(f"link not connected yet {link_client}")
+    return link_client
+
+
+__all__ = [
+    "LinkError",
+    "LinkPeer",
+    "LinkHub",
+    "LinkClient",
+    "link_stats",
+    "start_link_hub",
+    "connect_link",
+]
@@ -0,0 +1,44 @@
+from logging.handlers import QueueHandler, QueueListener
+from logging import getLogger, Logger
+from typing import Optional
+import queue
+
+"""off-loop logging
+
+root handlers (console, file) are moved to a listener thread,
+the loop only puts records into a queue and never waits for I/O.
+"""
+
+log = getLogger(__name__)
+log_listener: Optional[QueueListener] = None
+
+
+def start_log_listener(logger: Optional[Logger] = None) -> QueueListener:
+    """call after handlers are set up, ex. `set_logger(logging.INFO)`"""
+    global log_listener
+    if log_listener is not None:
+        return log_listener
+    logger = logger or getLogger()
+    handlers = [handler for handler in logger.handlers if not isinstance(handler, QueueHandler)]
+    log_queue = queue.SimpleQueue()
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(QueueHandler(log_queue))
+    log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    log_listener.start()
+    log.debug(f"log listener start handlers={len(handlers)}")
+    return log_listener
+
+
+def stop_log_listener():
+    """flush queued records"""
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
+
+
+__all__ = [
+    "start_log_listener",
+    "stop_log_listener",
+]
@@ -4,12 +4,16 @@ from bc4py_stratum_pool.job import *
 from bc4py_stratum_pool.ask import *
 from bc4py_stratum_pool.commands import *
 from bc4py_stratum_pool.account import *
+from bc4py_stratum_pool import journal, link
+from bc4py_stratum_pool.feed import publish
+from bc4py_stratum_pool.metrics import *
 from bc4py_extension import address2bech
-from bc4py.config import V
+from bc4py.config import C, V
 from aiohttp import client_exceptions
 from binascii import a2b_hex
 from os import urandom
-from time import time
+from typing import Optional
+from time import time, perf_counter
 from logging import getLogger
 
 """Methods (client to server)
@@ -42,11 +46,8 @@ async def mining_authorize(client: Client, params: list, uuid: int):
         job = get_best_job(client.algorithm)
         if job is None:
             job = await add_new_job(client.algorithm)
-        async with create_db(Const.DATABASE_PATH) as db:
-            cur = await db.cursor()
-            account_id = await read_address2account_id(cur=cur, address=username, create_if_missing=True)
-            await db.commit()
-            client.account_id = account_id
+        account_id = await get_account_id(username)
+        client.account_id = account_id
         await mining_notify(job, f_clean=False)
         log.debug(f"authorize success by '{username}:{password}' id={account_id}")
         await response_success(client, True, uuid)
@@ -97,6 +98,9 @@ async def mining_submit(client: Client, params: list, uuid: int):
         nonce.
     Server response is result: true for accepted, false for rejected (or you may get an error with more details).
     """
+    s = perf_counter()
+    result = 'rejected'
+    SUBMIT_INFLIGHT.inc()
     try:
         username, job_id, extranonce2, ntime, nonce, *others = params
         job_id = int.from_bytes(a2b_hex(job_id), 'big')
@@ -112,10 +116,12 @@ async def mining_submit(client: Client, params: list, uuid: int):
             await response_failed(client, NOT_SUBSCRIBED, uuid)
             return
         if job is None:
+            result = 'stale'
             await response_failed(client, JOB_NOT_FOUND, uuid)
             return
         if job.ntime != ntime:
             log.warning(f"submit different time, {job.ntime} != {ntime}")
+            result = 'stale'
             await response_failed(client, OTHER_UNKNOWN, uuid)
             return
         if client.algorithm not in co_efficiency:
@@ -124,45 +130,47 @@ async def mining_submit(client: Client, params: list, uuid: int):
             return
         # try to generate submit data
         fixed_difficulty = min(client.diff_list) / co_efficiency[client.algorithm]
+        hash_time = perf_counter()
         submit_data, block, f_mined, f_shared = get_submit_data(
             job, client.extranonce_1, extranonce2, nonce, fixed_difficulty)
+        HASH_LATENCY.labels(client.consensus_name).observe(perf_counter() - hash_time)
         if block.hash in job.submit_hashs:
+            result = 'duplicate'
             await response_failed(client, DUPLICATE_SHARE, uuid)
             return
         # try to submit work
         if f_mined or f_shared:
+            result = 'accepted'
             client.n_accept += 1
             average_difficulty = sum(client.diff_list)/len(client.diff_list)
             client.time_works.append((time(), average_difficulty))
             job.submit_hashs.append(block.hash)
             # submit block
             if f_mined:
-                pwd = str(job.algorithm)
-                response = await ask_json_rpc('submitblock', [submit_data.hex()], 'user', pwd)
-                if response:
-                    f_mined = False
-                    log.warning(f"failed mine by '{response}'")
-                else:
-                    log.info(f"mined yey!! {client.consensus_name} {job.height} diff={client.difficulty}")
+                f_mined = await submit_mined_block(job.algorithm, job.height, block.hash, submit_data)
+                if f_mined:
+                    log.info("mined yey!! %s %d diff=%s", client.consensus_name, job.height, client.difficulty)
             else:
-                log.debug(f"shared work!! {client.consensus_name} {job.height} diff={client.difficulty}")
+                log.debug("shared work!! %s %d diff=%s", client.consensus_name, job.height, client.difficulty)
             await response_success(client, True, uuid)
             # recode share
-            async with create_db(Const.DATABASE_PATH) as db:
-                cur = await db.cursor()
-                # how many ratio you generate hash (target/work)
-                share = average_difficulty / block.difficulty / co_efficiency[client.algorithm]
-                recode_hash = block.hash if f_mined else None
-                payout_id = 0 if Const.PAYOUT_METHOD == 'transaction' else -1
-                await insert_new_share(cur=cur, account_id=client.account_id, algorithm=client.algorithm,
-                                       blockhash=recode_hash, share=share, payout_id=payout_id)
-                await db.commit()
+            # how many ratio you generate hash (target/work)
+            share = average_difficulty / block.difficulty / co_efficiency[client.algorithm]
+            recode_hash = block.hash if f_mined else None
+            payout_id = 0 if Const.PAYOUT_METHOD == 'transaction' else -1
+            await record_share(client.account_id, client.algorithm, recode_hash, share, payout_id)
         else:
+            result = 'low_diff'
             client.n_reject += 1
             await response_failed(client, LOW_DIFFICULTY_SHARE, uuid)
     except Exception:
         log.warning("unexpected error on mining_submit", exc_info=True)
         await response_failed(client, OTHER_UNKNOWN, uuid)
+    finally:
+        SUBMIT_INFLIGHT.dec()
+        port = client.writer.get_extra_info('sockname', (None, None))[1]
+        SHARES.labels(client.consensus_name, port, result).inc()
+        SUBMIT_LATENCY.labels(client.consensus_name).observe(perf_counter() - s)
 
 
 async def mining_subscribe(client: Client, params: list, uuid: int):
@@ -186,11 +194,8 @@ async def mining_subscribe(client: Client, params: list, uuid: int):
     client.subscription_id = a2b_hex(params[1]) if 1 < len(params) else None
     if client.subscription_id is None:
         # setup new subscription info
-        async with create_db(Const.DATABASE_PATH) as db:
-            cur = await db.cursor()
-            client.extranonce_1 = urandom(4)
-            client.subscription_id = await insert_new_subscription(cur=cur, extranonce=client.extranonce_1)
-            await db.commit()
+        client.extranonce_1 = urandom(4)
+        client.subscription_id = await new_subscription(client.extranonce_1)
     else:
         # restore works from close_deque
         for old_client in reversed(closed_deque):
@@ -209,18 +214,15 @@ async def mining_subscribe(client: Client, params: list, uuid: int):
                 closed_deque.remove(old_client)
                 break
         else:
-            # recover subscription from database
-            async with create_db(Const.DATABASE_PATH) as db:
-                cur = await db.cursor()
-                extranonce_1 = await read_subscription_id2extranonce(
-                    cur=cur, subscription_id=client.subscription_id)
-                if extranonce_1 is None:
-                    # remove client info
-                    client.subscription_id = None
-                    raise ConnectionError('unknown subscription id')
-                else:
-                    client.extranonce_1 = extranonce_1
-                    log.debug("resume from database")
+            # recover subscription from memory or database
+            extranonce_1 = await get_subscription_extranonce(client.subscription_id)
+            if extranonce_1 is None:
+                # remove client info
+                client.subscription_id = None
+                raise ConnectionError('unknown subscription id')
+            else:
+                client.extranonce_1 = extranonce_1
+                log.debug("resume from subscription recode")
     # notify subscription info
     extranonce_2_size = 4
     result = [
@@ -231,7 +233,7 @@ async def mining_subscribe(client: Client, params: list, uuid: int):
         client.extranonce_1.hex(),
         extranonce_2_size
     ]
-    log.debug(f"subscribe {client}")
+    log.debug("subscribe %s", client)
     await response_success(client, result, uuid)
 
 
@@ -258,7 +260,124 @@ async def mining_suggest_target(client: Client, params: list, uuid: int):
     # client.difficulty = round(DEFAULT_TARGET / float(int.from_bytes(target, 'little')), 8)
 
 
+"""Storage (local or forwarded to coordinator by link)
+note: don't name these with `mining_` or `client_` prefix, stratum calls them by method name
+"""
+
+
+async def get_account_id(address) -> int:
+    if link.link_client is not None:
+        return await link.link_client.request('account', address)
+    if is_cache_ready():
+        # new account is committed by write-behind
+        return cached_address2account_id(address)
+    async with create_db(Const.DATABASE_PATH) as db:
+        cur = await db.cursor()
+        account_id = await read_address2account_id(cur=cur, address=address, create_if_missing=True)
+        await db.commit()
+    return account_id
+
+
+async def new_subscription(extranonce: bytes) -> bytes:
+    if link.link_client is not None:
+        return a2b_hex(await link.link_client.request('subscribe', extranonce.hex()))
+    if is_cache_ready():
+        # new subscription is committed by write-behind
+        return cached_new_subscription(extranonce=extranonce)
+    async with create_db(Const.DATABASE_PATH) as db:
+        cur = await db.cursor()
+        subscription_id = await insert_new_subscription(cur=cur, extranonce=extranonce)
+        await db.commit()
+    return subscription_id
+
+
+async def get_subscription_extranonce(subscription_id: bytes) -> Optional[bytes]:
+    if link.link_client is not None:
+        extranonce = await link.link_client.request('resume', subscription_id.hex())
+        return None if extranonce is None else a2b_hex(extranonce)
+    extranonce = cached_subscription_id2extranonce(subscription_id)
+    if extranonce is None and not is_cache_ready():
+        async with create_db(Const.DATABASE_PATH) as db:
+            cur = await db.cursor()
+            extranonce = await read_subscription_id2extranonce(cur=cur, subscription_id=subscription_id)
+    return extranonce
+
+
+async def submit_mined_block(algorithm, height, blockhash: bytes, submit_data: bytes) -> bool:
+    """submit block to node & recode mined block, return accepted"""
+    if link.link_client is not None:
+        return await link.link_client.request('mined', {
+            'algorithm': algorithm,
+            'height': height,
+            'hash': blockhash.hex(),
+            'data': submit_data.hex(),
+        }, timeout=60.0)
+    response = await ask_json_rpc('submitblock', [submit_data.hex()], 'user', str(algorithm))
+    if response:
+        log.warning(f"failed mine by '{response}'")
+        return False
+    publish('Mined', {
+        'height': height,
+        'hash': blockhash.hex(),
+        'algorithm': C.consensus2name[algorithm],
+    })
+    async with create_db(Const.DATABASE_PATH) as db:
+        cur = await db.cursor()
+        await insert_new_mined_block(
+            cur=cur, blockhash=blockhash, algorithm=algorithm, height=height,
+            payout_id=0 if Const.PAYOUT_METHOD == 'transaction' else -1)
+        await db.commit()
+    return True
+
+
+async def record_share(account_id, algorithm, blockhash: Optional[bytes], share, payout_id, ntime=None):
+    if link.link_client is not None:
+        # sent by batch
+        link.link_client.push_share([
+            time(), account_id, algorithm, blockhash and blockhash.hex(), share, payout_id])
+        return
+    if journal.share_journal is not None:
+        # folded into database and counted to balance by auto_share_journal
+        journal.share_journal.append(account_id=account_id, algorithm=algorithm,
+                                     blockhash=blockhash, share=share, payout_id=payout_id, ntime=ntime)
+    else:
+        s = perf_counter()
+        begin_share_writing((account_id,))
+        try:
+            async with create_share_db(Const.DATABASE_PATH, algorithm) as db:
+                cur = await db.cursor()
+                await insert_new_share(cur=cur, account_id=account_id, algorithm=algorithm,
+                                       blockhash=blockhash, share=share, payout_id=payout_id, ntime=ntime)
+                await db.commit()
+            if payout_id == 0:
+                add_balance_share(account_id, share)
+        finally:
+            end_share_writing((account_id,))
+        DB_WRITE_LATENCY.labels('share').observe(perf_counter() - s)
+
+
+async def record_shares(rows: list) -> int:
+    """
+    record batch of shares forwarded by link, row: (time, account_id, algorithm, blockhash, share, payout_id)
+    a batch resent after aggregator restart is ignored by share time, balance counts only inserted rows
+    """
+    if journal.share_journal is not None:
+        # duplicates are ignored and balance is counted on fold
+        for ntime, account_id, algorithm, blockhash, share, payout_id in rows:
+            journal.share_journal.append(account_id=account_id, algorithm=algorithm,
+                                         blockhash=blockhash, share=share, payout_id=payout_id, ntime=ntime)
+        return len(rows)
+    else:
+        return await journal.insert_journal_shares(Const.DATABASE_PATH, rows)
+
+
 __all__ = [
+    "get_account_id",
+    "new_subscription",
+    "get_subscription_extranonce",
+    "submit_mined_block",
+    "record_share",
+    "record_shares",
     "mining_authorize",
     "mining_extranonce_subscribe",
     "mining_get_transactions",
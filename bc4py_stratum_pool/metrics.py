@@ -0,0 +1,273 @@
+from typing import Dict, List, Tuple, Optional, Callable
+from bisect import bisect_left
+from logging import getLogger
+
+"""lightweight metrics registry, Prometheus text exposition
+
+hot path cost is a dict lookup & a few int/float updates, resolve labels once where possible
+    SHARES.labels('X16S', 5000, 'accept').inc()
+    SUBMIT_LATENCY.labels('X16S').observe(perf_counter() - s)
+"""
+
+log = getLogger(__name__)
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+registry: List['Metric'] = list()
+
+
+class CounterValue(object):
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1.0):
+        self.value += amount
+
+
+class GaugeValue(object):
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1.0):
+        self.value += amount
+
+    def dec(self, amount=1.0):
+        self.value -= amount
+
+
+class HistogramValue(object):
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q) -> Optional[float]:
+        """estimate by linear interpolation in the bucket, like histogram_quantile()"""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if rank <= cumulative + count and 0 < count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]  # over the last bound
+                lower = self.buckets[index - 1] if 0 < index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+
+class Metric(object):
+    kind = 'untyped'
+    __slots__ = ("name", "help", "label_names", "children")
+
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names: Tuple[str, ...] = tuple(label_names)
+        self.children: Dict[tuple, object] = dict()
+        registry.append(self)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.name} children={len(self.children)}>"
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            assert len(values) == len(self.label_names), (self.name, values)
+            child = self.children[values] = self.new_child()
+        return child
+
+    def samples(self) -> List[Tuple[str, tuple, float]]:
+        """[(suffix, ((label, value), ...), value), ...]"""
+        return [('', tuple(zip(self.label_names, key)), child.value) for key, child in self.children.items()]
+
+
+class Counter(Metric):
+    kind = 'counter'
+    __slots__ = ()
+
+    def new_child(self):
+        return CounterValue()
+
+    def inc(self, amount=1.0):
+        self.labels().inc(amount)
+
+    def merge_samples(self, sources: List[list]) -> Dict[tuple, CounterValue]:
+        """sum samples of processes by label values"""
+        children = dict()
+        for samples in sources:
+            for suffix, labels, value in samples:
+                key = tuple(label for _, label in labels)
+                child = children.get(key)
+                if child is None:
+                    child = children[key] = self.new_child()
+                child.inc(value)
+        return children
+
+
+class Gauge(Metric):
+    """func: read value on exposition, for values already kept elsewhere"""
+    kind = 'gauge'
+    __slots__ = ("func",)
+
+    def __init__(self, name, help, label_names=(), func: Optional[Callable[[], float]] = None):
+        super().__init__(name, help, label_names)
+        self.func = func
+
+    def new_child(self):
+        return GaugeValue()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def inc(self, amount=1.0):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1.0):
+        self.labels().dec(amount)
+
+    def samples(self):
+        if self.func is not None:
+            return [('', (), self.func())]
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+    __slots__ = ("buckets",)
+
+    def __init__(self, name, help, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, label_names)
+
+    def new_child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def merge_samples(self, sources: List[list]) -> Dict[tuple, HistogramValue]:
+        """sum samples of processes by label values, cumulative buckets back to counts"""
+        index = {'+Inf' if bound == float('inf') else repr(bound): i
+                 for i, bound in enumerate(self.buckets + (float('inf'),))}
+        children = dict()
+        for samples in sources:
+            previous = dict()
+            for suffix, labels, value in samples:
+                key = tuple(label for name, label in labels if name != 'le')
+                child = children.get(key)
+                if child is None:
+                    child = children[key] = self.new_child()
+                if suffix == '_bucket':
+                    child.counts[index[labels[-1][1]]] += value - previous.get(key, 0)
+                    previous[key] = value
+                elif suffix == '_sum':
+                    child.sum += value
+                elif suffix == '_count':
+                    child.count += value
+        return children
+
+    def samples(self):
+        samples = list()
+        for key, child in self.children.items():
+            labels = tuple(zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                samples.append(('_bucket', labels + (('le', le),), cumulative))
+            samples.append(('_sum', labels, child.sum))
+            samples.append(('_count', labels, child.count))
+        return samples
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def export_samples() -> Dict[str, list]:
+    """samples by metric name, worker processes report them to the coordinator"""
+    return {metric.name: metric.samples() for metric in registry}
+
+
+def format_sample(name, suffix, labels, value) -> str:
+    if labels:
+        label_str = ','.join(f'{key}="{escape(value)}"' for key, value in labels)
+        return f"{name}{suffix}{{{label_str}}} {value}"
+    else:
+        return f"{name}{suffix} {value}"
+
+
+def render_metrics(remote: Optional[Dict[str, Dict[str, list]]] = None) -> str:
+    """
+    Prometheus text format 0.0.4
+    remote: {worker name: exported samples}, rendered with `worker` label
+    """
+    lines = list()
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for suffix, labels, value in metric.samples():
+            lines.append(format_sample(metric.name, suffix, labels, value))
+        for worker, samples in (remote or {}).items():
+            for suffix, labels, value in samples.get(metric.name, ()):
+                labels = (('worker', worker),) + tuple(tuple(label) for label in labels)
+                lines.append(format_sample(metric.name, suffix, labels, value))
+    return '\n'.join(lines) + '\n'
+
+
+# shares
+SHARES = Counter('pool_shares_total', 'submitted shares by result',
+                 ('algorithm', 'port', 'result'))
+SUBMIT_LATENCY = Histogram('pool_submit_seconds', 'mining.submit handling time', ('algorithm',))
+HASH_LATENCY = Histogram('pool_hash_seconds', 'share hashing & block build time', ('algorithm',))
+SUBMIT_INFLIGHT = Gauge('pool_submit_inflight', 'mining.submit being handled')
+# stratum dispatch
+DISPATCH_LATENCY = Histogram('pool_stratum_method_seconds', 'stratum method handling time',
+                             ('method', 'algorithm', 'port'))
+DISPATCH_ERRORS = Counter('pool_stratum_method_errors_total', 'stratum method raised exception',
+                          ('method', 'algorithm', 'port'))
+# storage
+DB_WRITE_LATENCY = Histogram('pool_db_write_seconds', 'share database write time', ('kind',))
+# jobs & node
+NOTIFY_LATENCY = Histogram('pool_notify_seconds', 'mining.notify fan-out time', ('algorithm',))
+NODE_LATENCY = Histogram('pool_node_rpc_seconds', 'node REST & RPC time', ('method',))
+# event loop
+LOOP_LAG = Gauge('pool_loop_lag_seconds', 'event loop scheduling delay percentiles', ('quantile',))
+
+
+__all__ = [
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "registry",
+    "export_samples",
+    "render_metrics",
+    "SHARES",
+    "SUBMIT_LATENCY",
+    "HASH_LATENCY",
+    "SUBMIT_INFLIGHT",
+    "DISPATCH_LATENCY",
+    "DISPATCH_ERRORS",
+    "DB_WRITE_LATENCY",
+    "NOTIFY_LATENCY",
+    "NODE_LATENCY",
+    "LOOP_LAG",
+]
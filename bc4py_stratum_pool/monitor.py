@@ -0,0 +1,103 @@
+from bc4py_stratum_pool.metrics import LOOP_LAG
+from logging import getLogger
+from collections import deque
+from typing import Deque, Dict, Optional
+from time import time, perf_counter, sleep
+import traceback
+import threading
+import asyncio
+import sys
+
+"""event loop lag monitor & blocking call watchdog
+
+sampler: a task sleeps `interval` and records how late it wakes up (scheduling delay)
+watchdog: a thread checks the sampler heartbeat, when the loop does not come back
+    for `threshold` seconds it logs the stack of the loop thread (the blocking code)
+"""
+
+log = getLogger(__name__)
+LAG_SAMPLES = 6000  # 60s by 10ms
+QUANTILES = (0.5, 0.9, 0.99, 1.0)
+lag_samples: Deque[float] = deque(maxlen=LAG_SAMPLES)
+watchdog_stats = {'blocked': 0, 'logged': 0, 'max_block': 0.0}
+monitor_beat = perf_counter()
+monitor_thread: Optional[threading.Thread] = None
+
+
+def loop_lag_percentiles() -> Dict[float, float]:
+    """{quantile: lag seconds} of recent samples"""
+    if len(lag_samples) == 0:
+        return dict()
+    samples = sorted(lag_samples)
+    last = len(samples) - 1
+    return {q: samples[round(last * q)] for q in QUANTILES}
+
+
+async def sample_loop_lag(interval=0.01, publish_span=1.0):
+    """measure delay of a sleep wake up, publish percentiles to metrics"""
+    global monitor_beat
+    publish_time = time()
+    while True:
+        s = perf_counter()
+        await asyncio.sleep(interval)
+        monitor_beat = now = perf_counter()
+        lag_samples.append(max(0.0, now - s - interval))
+        if publish_time < time():
+            publish_time = time() + publish_span
+            for q, lag in loop_lag_percentiles().items():
+                LOOP_LAG.labels(str(q)).set(lag)
+
+
+def format_blocking_stack(thread_id) -> str:
+    frame = sys._current_frames().get(thread_id)
+    if frame is None:
+        return 'no frame'
+    return ''.join(traceback.format_stack(frame))
+
+
+def watchdog(thread_id, threshold, log_span):
+    """run on a thread, log blocking stack at most once per log_span"""
+    log_time = 0.0
+    blocked = False
+    while True:
+        sleep(threshold / 2)
+        block = perf_counter() - monitor_beat
+        if block < threshold:
+            blocked = False
+            continue
+        watchdog_stats['max_block'] = max(watchdog_stats['max_block'], block)
+        if blocked:
+            continue  # same blocking
+        blocked = True
+        watchdog_stats['blocked'] += 1
+        if time() < log_time:
+            continue
+        log_time = time() + log_span
+        watchdog_stats['logged'] += 1
+        log.warning(f"event loop blocked over {round(block, 3)}s, stack:\n{format_blocking_stack(thread_id)}")
+
+
+def start_loop_monitor(interval=0.01, threshold=0.1, log_span=60.0):
+    """
+    start lag sampler on running loop & watchdog thread
+    :param interval: sampling interval seconds
+    :param threshold: blocking seconds to capture stack
+    :param log_span: log stack at most once per seconds
+    """
+    global monitor_beat, monitor_thread
+    if monitor_thread is not None:
+        return
+    monitor_beat = perf_counter()
+    asyncio.ensure_future(sample_loop_lag(interval))
+    monitor_thread = threading.Thread(target=watchdog, args=(threading.get_ident(), threshold, log_span),
+                                      name='loop-watchdog', daemon=True)
+    monitor_thread.start()
+    log.info(f"start loop monitor interval={interval}s threshold={threshold}s")
+
+
+__all__ = [
+    "lag_samples",
+    "watchdog_stats",
+    "loop_lag_percentiles",
+    "start_loop_monitor",
+]
@@ -0,0 +1,82 @@
+from logging import getLogger
+from typing import Optional
+import cProfile
+import pstats
+import types
+import io
+
+"""sampling profiler of live stratum traffic
+
+profile 1-in-N mining.submit calls into one aggregated cProfile,
+the profiler is enabled only while the sampled coroutine runs, other tasks
+running during its awaits are not mixed in.
+"""
+
+log = getLogger(__name__)
+profile_stats = {'every': 0, 'calls': 0, 'sampled': 0}
+submit_profile: Optional[cProfile.Profile] = None
+f_profiling = False
+
+
+def set_submit_profile(every: int, reset=False):
+    """profile 1-in-`every` mining.submit, 0 to disable"""
+    global submit_profile
+    profile_stats['every'] = max(0, every)
+    if reset or submit_profile is None:
+        submit_profile = cProfile.Profile()
+        profile_stats['calls'] = profile_stats['sampled'] = 0
+    log.info(f"submit profile every={profile_stats['every']} reset={reset}")
+
+
+@types.coroutine
+def profiled(profile: cProfile.Profile, coro):
+    """drive the coroutine with profiler enabled on each step"""
+    global f_profiling
+    value, error = None, None
+    while True:
+        f_profiling = True
+        profile.enable()
+        try:
+            if error is None:
+                future = coro.send(value)
+            else:
+                future = coro.throw(error)
+        except StopIteration as e:
+            return e.value
+        finally:
+            profile.disable()
+            f_profiling = False
+        try:
+            value, error = (yield future), None
+        except BaseException as e:
+            value, error = None, e
+
+
+def sample_submit(coro):
+    """return the coroutine profiled when sampled"""
+    every = profile_stats['every']
+    if every == 0:
+        return coro
+    profile_stats['calls'] += 1
+    if profile_stats['calls'] % every or f_profiling:
+        return coro
+    profile_stats['sampled'] += 1
+    return profiled(submit_profile, coro)
+
+
+def dump_submit_profile(sort='cumulative', limit=40) -> str:
+    """aggregated stats as text"""
+    if submit_profile is None or profile_stats['sampled'] == 0:
+        return 'no sampled call'
+    stream = io.StringIO()
+    stats = pstats.Stats(submit_profile, stream=stream)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return f"sampled {profile_stats['sampled']} of {profile_stats['calls']} calls\n" + stream.getvalue()
+
+
+__all__ = [
+    "profile_stats",
+    "set_submit_profile",
+    "sample_submit",
+    "dump_submit_profile",
+]
@@ -0,0 +1,121 @@
+from aiohttp.web import Request
+from aiohttp import web
+from collections import namedtuple
+from logging import getLogger
+from typing import Dict
+from hashlib import sha1
+import mimetypes
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+"""static asset pipeline
+
+assets are fingerprinted by content hash & compressed once at startup
+fingerprinted url never changes its content, so it is cached as immutable
+"""
+
+log = getLogger(__name__)
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+PLAIN_CACHE = 'public, max-age=3600'
+StaticAsset = namedtuple('StaticAsset', ['name', 'content_type', 'etag', 'body', 'gzip_body', 'br_body'])
+static_assets: Dict[str, StaticAsset] = dict()  # fingerprinted name -> asset
+static_names: Dict[str, str] = dict()  # original name -> fingerprinted name
+static_stats = {'immutable': 0, 'plain': 0, 'not_modified': 0}
+
+
+def fingerprint_name(name, digest) -> str:
+    """css/sidebar.css -> css/sidebar.{digest}.css"""
+    root, ext = os.path.splitext(name)
+    return f"{root}.{digest}{ext}"
+
+
+def compress_smaller(body: bytes, func):
+    """compressed bytes or None when not smaller"""
+    if func is None:
+        return None
+    compressed = func(body)
+    return compressed if len(compressed) < len(body) else None
+
+
+def build_static_assets(static_path) -> int:
+    """read & compress all files under static_path"""
+    static_assets.clear()
+    static_names.clear()
+    for root, dirs, files in os.walk(static_path):
+        for file in files:
+            path = os.path.join(root, file)
+            name = os.path.relpath(path, static_path).replace(os.sep, '/')
+            with open(path, mode='rb') as fp:
+                body = fp.read()
+            digest = sha1(body).hexdigest()[:12]
+            content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            asset = StaticAsset(
+                name=name,
+                content_type=content_type,
+                etag=f'"{digest}"',
+                body=body,
+                gzip_body=compress_smaller(body, lambda b: gzip.compress(b, 9)),
+                br_body=compress_smaller(body, brotli.compress if brotli else None),
+            )
+            static_names[name] = fingerprint_name(name, digest)
+            static_assets[static_names[name]] = asset
+    log.info(f"build {len(static_assets)} static assets brotli={bool(brotli)}")
+    return len(static_assets)
+
+
+def static_url(name) -> str:
+    """template global, fingerprinted url of the asset"""
+    return 'static/' + static_names.get(name, name)
+
+
+async def static_handler(request: Request):
+    """serve pre-compressed asset by Accept-Encoding"""
+    name = request.match_info['name']
+    asset = static_assets.get(name)
+    if asset is not None:
+        cache_control = IMMUTABLE_CACHE
+        static_stats['immutable'] += 1
+    elif name in static_names:
+        # not fingerprinted old link
+        asset = static_assets[static_names[name]]
+        cache_control = PLAIN_CACHE
+        static_stats['plain'] += 1
+    else:
+        raise web.HTTPNotFound()
+    headers = {
+        'Cache-Control': cache_control,
+        'ETag': asset.etag,
+        'Vary': 'Accept-Encoding',
+    }
+    if request.headers.get('If-None-Match') == asset.etag:
+        static_stats['not_modified'] += 1
+        return web.Response(status=304, headers=headers)
+    accept_encoding = request.headers.get('Accept-Encoding', '')
+    if asset.br_body is not None and 'br' in accept_encoding:
+        headers['Content-Encoding'] = 'br'
+        body = asset.br_body
+    elif asset.gzip_body is not None and 'gzip' in accept_encoding:
+        headers['Content-Encoding'] = 'gzip'
+        body = asset.gzip_body
+    else:
+        body = asset.body
+    return web.Response(body=body, content_type=asset.content_type, headers=headers)
+
+
+def setup_static_routes(app: web.Application, static_path):
+    build_static_assets(static_path)
+    app.router.add_get('/static/{name:.+}', static_handler)
+
+
+__all__ = [
+    "static_assets",
+    "static_stats",
+    "build_static_assets",
+    "static_url",
+    "setup_static_routes",
+]
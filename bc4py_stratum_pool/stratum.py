@@ -2,15 +2,17 @@ from bc4py_stratum_pool.config import Const
 from bc4py_stratum_pool import methods
 from bc4py_stratum_pool.client import *
 from bc4py_stratum_pool.commands import mining_set_difficulty, client_reconnect
+from bc4py_stratum_pool.metrics import DISPATCH_LATENCY, DISPATCH_ERRORS
+from bc4py_stratum_pool.profiler import sample_submit
 from asyncio.streams import StreamReader, StreamWriter
 from bc4py.config import C
 from typing import List
-from logging import getLogger
+from logging import getLogger, DEBUG
 from collections import namedtuple
+from time import perf_counter
 import asyncio
 import json
 
-loop = asyncio.get_event_loop()
 log = getLogger(__name__)
 SOCKET_TIMEOUT = 1200  # 20min
 Stratum = namedtuple('Stratum', ['port', 'algorithm', 'difficulty', 'variable_diff'])
@@ -21,7 +23,7 @@ async def get_atomic_message(prefix: bytes, reader: StreamReader):
     """receive message one by one"""
     data = prefix
     while True:
-        data += await asyncio.wait_for(reader.read(1024), SOCKET_TIMEOUT, loop=loop)
+        data += await asyncio.wait_for(reader.read(1024), SOCKET_TIMEOUT)
         if b'\n' not in data:
             continue
         raw, prefix = data.split(b'\n', 1)
@@ -39,20 +41,20 @@ def stratum_handle(algorithm: int, difficulty: float, variable_diff=True, submit
     async def handle(reader: StreamReader, writer: StreamWriter):
         # create new client
         client = await create_client(reader, writer, algorithm, difficulty, submit_span)
-        log.info(f"new client join {client.get_peer_name()}")
+        port = writer.transport.get_extra_info('sockname')[1]
+        log.info("new client join %s", client.get_peer_name())
         try:
             # note: some miners hate quick difficulty notification
             if variable_diff:
-                asyncio.run_coroutine_threadsafe(schedule_dynamic_difficulty(client), loop)
+                asyncio.ensure_future(schedule_dynamic_difficulty(client))
             # notify first difficulty
-            asyncio.run_coroutine_threadsafe(wrap_with_delay(5, mining_set_difficulty, client), loop)
+            asyncio.ensure_future(wrap_with_delay(5, mining_set_difficulty, client))
             # wait for data
             prefix = b''
             while client.f_enable:
                 msg, prefix = await get_atomic_message(prefix, reader)
                 # check client status
                 if 100 < client.n_reject and client.n_accept < client.n_reject:
-                    port = writer.transport.get_extra_info('sockname')[1]
                     await client_reconnect(client, Const.HOST_NAME, port)
                     log.debug("too match fail, ask client reconnect")
                     break
@@ -70,8 +72,19 @@ def stratum_handle(algorithm: int, difficulty: float, variable_diff=True, submit
                 if function is None:
                     await response_failed(client, OTHER_UNKNOWN, msg.get('id'))
                     continue  # ignore
-                log.debug(f"stratum request id={msg.get('id')} method={method} params={params}")
-                comment = await function(client, params, msg.get('id'))
+                if log.isEnabledFor(DEBUG):
+                    log.debug(f"stratum request id={msg.get('id')} method={method} params={params}")
+                s = perf_counter()
+                try:
+                    coro = function(client, params, msg.get('id'))
+                    if function is methods.mining_submit:
+                        coro = sample_submit(coro)
+                    comment = await coro
+                except Exception:
+                    DISPATCH_ERRORS.labels(method, client.consensus_name, port).inc()
+                    raise
+                finally:
+                    DISPATCH_LATENCY.labels(method, client.consensus_name, port).observe(perf_counter() - s)
                 # response
                 if comment is not None:
                     log.info(f"stratum get comment '{comment}'")
@@ -86,12 +99,13 @@ def stratum_handle(algorithm: int, difficulty: float, variable_diff=True, submit
         if client.subscription_id:
             closed_deque.append(client)
         await client.close()
-        log.info(f"close and remove {client}")
+        log.info("close and remove %s", client)
     # wrap handle
     return handle
 
 
-def stratum_server(port: int, algorithm: int, difficulty: float, variable_diff=True, host='0.0.0.0'):
+def stratum_server(port: int, algorithm: int, difficulty: float, variable_diff=True, host='0.0.0.0', reuse_port=False):
+    """reuse_port: worker processes share the port by SO_REUSEPORT"""
     assert algorithm in C.consensus2name
     # port duplication check
     for stratum in stratum_list:
@@ -101,7 +115,8 @@ def stratum_server(port: int, algorithm: int, difficulty: float, variable_diff=T
     log.info(f"add new stratum {algorithm_name} stratum+tcp://{host}:{port} "
              f"diff={difficulty} variable_diff={variable_diff}")
     stratum_list.append(Stratum(port, algorithm_name, difficulty, variable_diff))
-    return asyncio.start_server(stratum_handle(algorithm, difficulty, variable_diff), host, port, loop=loop)
+    return asyncio.start_server(stratum_handle(algorithm, difficulty, variable_diff),
+                                host, port, reuse_port=reuse_port or None)
 
 
 async def wrap_with_delay(sec, func, *args):
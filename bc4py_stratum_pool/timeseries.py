@@ -0,0 +1,125 @@
+from bc4py_stratum_pool.config import PoolStatus, pool_status_list
+from aiosqlite import Cursor
+from collections import defaultdict
+from logging import getLogger
+from typing import List
+from time import time
+
+"""pool status time-series
+
+each PoolStatus is recoded by minute and rolled up into hour & day buckets per algorithm.
+pool total share is recoded with empty algorithm name.
+"""
+
+log = getLogger(__name__)
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+# resolution -> retention seconds
+RETENTION = {
+    MINUTE: 2 * DAY,
+    HOUR: 90 * DAY,
+    DAY: 3650 * DAY,
+}
+TOTAL = ''  # algorithm name of pool total
+
+
+async def init_pool_status_table(cur: Cursor):
+    await cur.execute("""
+    CREATE TABLE IF NOT EXISTS `pool_status` (
+    `resolution` INTEGER NOT NULL,
+    `time` INTEGER NOT NULL,
+    `algorithm` TEXT NOT NULL,
+    `workers` REAL NOT NULL,
+    `pool_hashrate` REAL NOT NULL,
+    `network_hashrate` REAL NOT NULL,
+    `share` REAL NOT NULL,
+    `samples` INTEGER NOT NULL,
+    PRIMARY KEY (`resolution`, `time`, `algorithm`)
+    ) WITHOUT ROWID""")
+
+
+async def insert_pool_status(cur: Cursor, status: PoolStatus):
+    """recode a minute status and update rollups by average"""
+    workers = dict(status.workers)
+    pool_hashrate = dict(status.pool_hashrate)
+    network_hashrate = dict(status.network_hashrate)
+    rows = [
+        (name, workers.get(name, 0), pool_hashrate.get(name, 0), network_hashrate.get(name, 0), 0.0)
+        for name in set(workers) | set(pool_hashrate) | set(network_hashrate)]
+    rows.append((TOTAL, sum(workers.values()), sum(pool_hashrate.values()), 0, status.share))
+    for resolution, retention in RETENTION.items():
+        bucket = status.time - status.time % resolution
+        await cur.executemany("""
+        INSERT INTO `pool_status` (
+        `resolution`, `time`, `algorithm`, `workers`, `pool_hashrate`, `network_hashrate`, `share`, `samples`
+        ) VALUES (?,?,?,?,?,?,?,1) ON CONFLICT(`resolution`, `time`, `algorithm`) DO UPDATE SET
+        `workers`=(`workers`*`samples`+excluded.`workers`)/(`samples`+1),
+        `pool_hashrate`=(`pool_hashrate`*`samples`+excluded.`pool_hashrate`)/(`samples`+1),
+        `network_hashrate`=(`network_hashrate`*`samples`+excluded.`network_hashrate`)/(`samples`+1),
+        `share`=(`share`*`samples`+excluded.`share`)/(`samples`+1),
+        `samples`=`samples`+1
+        """, [(resolution, bucket) + row for row in rows])
+        await cur.execute("""
+        DELETE FROM `pool_status` WHERE `resolution`=? AND `time` < ?
+        """, (resolution, status.time - retention))
+
+
+async def load_pool_status(cur: Cursor, window=60*24) -> int:
+    """restore pool_status_list from recent minute records"""
+    await init_pool_status_table(cur)
+    begin = int(time()) - window * MINUTE
+    statuses = await read_pool_status(cur, MINUTE, begin, int(time()) + MINUTE)
+    pool_status_list.clear()
+    pool_status_list.extend(statuses)
+    log.info(f"load pool status {len(statuses)} records")
+    return len(statuses)
+
+
+async def read_pool_status(cur: Cursor, resolution, begin, end) -> List[PoolStatus]:
+    """get PoolStatus list of a resolution begin <= time < end"""
+    await cur.execute("""
+    SELECT `time`, `algorithm`, `workers`, `pool_hashrate`, `network_hashrate`, `share` FROM `pool_status`
+    WHERE `resolution`=? AND ? <= `time` AND `time` < ? ORDER BY `time`
+    """, (resolution, begin, end))
+    grouped = defaultdict(lambda: ([], [], [], 0.0))
+    for ntime, name, workers, pool_hashrate, network_hashrate, share in await cur.fetchall():
+        if name == TOTAL:
+            data = grouped[ntime]
+            grouped[ntime] = (data[0], data[1], data[2], share)
+        else:
+            data = grouped[ntime]
+            data[0].append((name, round(workers)))
+            data[1].append((name, int(pool_hashrate)))
+            data[2].append((name, int(network_hashrate)))
+    return [
+        PoolStatus(ntime, tuple(workers), tuple(pool_hashrate), tuple(network_hashrate), share)
+        for ntime, (workers, pool_hashrate, network_hashrate, share) in sorted(grouped.items())]
+
+
+def select_resolution(begin, end, max_points=1440) -> int:
+    """finest resolution kept for the span within max_points, coarsest as fallback"""
+    now = time()
+    for resolution in sorted(RETENTION):
+        if (end - begin) / resolution <= max_points and now - RETENTION[resolution] <= begin:
+            return resolution
+    return max(RETENTION)
+
+
+async def read_pool_status_range(cur: Cursor, begin, end, max_points=1440) -> List[PoolStatus]:
+    resolution = select_resolution(begin, end, max_points)
+    return await read_pool_status(cur, resolution, begin, end)
+
+
+__all__ = [
+    "MINUTE",
+    "HOUR",
+    "DAY",
+    "RETENTION",
+    "init_pool_status_table",
+    "insert_pool_status",
+    "load_pool_status",
+    "read_pool_status",
+    "select_resolution",
+    "read_pool_status_range",
+]
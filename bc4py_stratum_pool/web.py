@@ -1,43 +1,143 @@
 from bc4py_stratum_pool.config import *
 from bc4py_stratum_pool.ask import *
 from bc4py_stratum_pool.autowork import *
-from bc4py_stratum_pool.client import client_list
+from bc4py_stratum_pool.client import filter_clients, sort_clients, CLIENT_SORT_KEYS
 from bc4py_stratum_pool.stratum import stratum_list
+from bc4py_stratum_pool.api import setup_api_routes, build_miner
+from bc4py_stratum_pool.cluster import count_workers, worker_metrics
+from bc4py_stratum_pool.admin import setup_admin_routes
+from bc4py_stratum_pool.feed import ws_feed
+from bc4py_stratum_pool.static import setup_static_routes, static_url
+from bc4py_stratum_pool.metrics import render_metrics
+from bc4py_stratum_pool.monitor import loop_lag_percentiles, watchdog_stats, start_loop_monitor
 from bc4py.config import C
 from logging import getLogger
 from aiohttp.web import Request
 from aiohttp import web
 from jinja2 import FileSystemLoader, FileSystemBytecodeCache
+from expiringdict import ExpiringDict
+from collections import defaultdict, namedtuple
+from typing import Dict, Optional
+from urllib.parse import urlencode
 import aiohttp_jinja2
 from time import time
 import asyncio
+import gzip
 import os
 
 
-loop = asyncio.get_event_loop()
 log = getLogger(__name__)
 DISABLE_EXPLORER = False
+# explorer cache, deep blocks never change
+DEEP_CONFIRMATIONS = 100
+RECENT_CACHE_TTL = 10.0
+# node status is refreshed on background, handlers only read cache
+NODE_STATUS_SPAN = 30.0
+node_status_task: Optional[asyncio.Future] = None
 cache = dict()
+# rendered page cache by template name
+PageCache = namedtuple('PageCache', ['version', 'body', 'gzip_body'])
+page_cache: Dict[str, PageCache] = dict()
+page_cache_stats = defaultdict(lambda: {'hit': 0, 'miss': 0})
+# sorted connection listing by (address, algorithm, sort)
+CONNECTION_PAGE_SIZE = 50
+connection_cache = ExpiringDict(max_len=256, max_age_seconds=10.0)
 
 
-async def check_node_status() -> bool:
-    """update status cache & return is_online"""
+def explorer_cache_ttl(data) -> Optional[float]:
+    """cache forever when confirmed deeply"""
+    if not isinstance(data, dict) or 0 == len(block_history_list):
+        return RECENT_CACHE_TTL
+    height = data.get('height')
+    if height is None:
+        return RECENT_CACHE_TTL  # unconfirmed tx
+    if DEEP_CONFIRMATIONS < block_history_list[-1]['height'] - height and not data.get('f_orphan'):
+        return None
+    return RECENT_CACHE_TTL
+
+
+async def refresh_node_status():
+    """ask node & update status cache"""
     try:
-        status_time = cache.get('status_time')
-        ntime = time()
-        if status_time is None or 30.0 < ntime - status_time:
-            cache['status_time'] = time()
-            cache['system_info'] = await ask_get('/public/getsysteminfo')
-            cache['chain_info'] = await ask_get('/public/getchaininfo')
-            cache['is_online'] = True
-            return True
-        else:
-            return cache.get('is_online', False)
-    except Exception:
-        return False
+        system_info, chain_info = await asyncio.gather(
+            ask_get('/public/getsysteminfo'), ask_get('/public/getchaininfo'))
+        cache['system_info'] = system_info
+        cache['chain_info'] = chain_info
+        cache['is_online'] = True
+    except Exception as e:
+        log.debug(f"node status refresh failed by {e!r}")
+        cache['is_online'] = False
+    finally:
+        cache['status_time'] = time()
+
+
+def schedule_node_status_refresh() -> asyncio.Future:
+    """start refresh if not running (single-flight)"""
+    global node_status_task
+    if node_status_task is None or node_status_task.done():
+        node_status_task = asyncio.ensure_future(refresh_node_status())
+    return node_status_task
+
+
+async def node_status_refresher():
+    """background owner of node status cache"""
+    while True:
+        try:
+            await asyncio.shield(schedule_node_status_refresh())
+        except asyncio.CancelledError:
+            break
+        except Exception:
+            log.error("node status refresher exception", exc_info=True)
+        await asyncio.sleep(NODE_STATUS_SPAN)
 
 
-@aiohttp_jinja2.template('index.html')
+async def check_node_status() -> bool:
+    """
+    return cached is_online without waiting node
+    stale status is served while refreshing on background
+    """
+    status_time = cache.get('status_time')
+    if status_time is None or 2.0 * NODE_STATUS_SPAN < time() - status_time:
+        # refresher stopped or slow, kick it
+        schedule_node_status_refresh()
+    return cache.get('is_online', False)
+
+
+def cached_template(template_name, version_func=tuple):
+    """
+    render once per state version and serve pre-compressed body
+    version_func: return tuple changing when context data updated, is_online is added
+    """
+    def wrapper(handler):
+        async def wrapped(request: Request):
+            version = (await check_node_status(),) + version_func()
+            page = page_cache.get(template_name)
+            if page is None or page.version != version:
+                context = await handler(request)
+                body = aiohttp_jinja2.render_string(template_name, request, context).encode()
+                page = page_cache[template_name] = PageCache(version, body, gzip.compress(body))
+                page_cache_stats[template_name]['miss'] += 1
+            else:
+                page_cache_stats[template_name]['hit'] += 1
+            headers = {'Vary': 'Accept-Encoding'}
+            if 'gzip' in request.headers.get('Accept-Encoding', ''):
+                headers['Content-Encoding'] = 'gzip'
+                return web.Response(body=page.gzip_body, content_type='text/html', headers=headers)
+            return web.Response(body=page.body, content_type='text/html', headers=headers)
+        return wrapped
+    return wrapper
+
+
+def dashboard_version():
+    return (
+        pool_status_list[-1].time if 0 < len(pool_status_list) else None,
+        block_history_list[-1].get('hash') if 0 < len(block_history_list) else None,
+        distribution_list[-1].time if 0 < len(distribution_list) else None,
+        len(consensus_list),
+    )
+
+
+@cached_template('index.html')
 async def page_index(request: Request):
     return {
         'title': 'main page',
@@ -45,7 +145,7 @@ async def page_index(request: Request):
     }
 
 
-@aiohttp_jinja2.template('started.html')
+@cached_template('started.html', lambda: (len(stratum_list),))
 async def page_started(request: Request):
     return {
         'title': 'getting started',
@@ -55,7 +155,7 @@ async def page_started(request: Request):
     }
 
 
-@aiohttp_jinja2.template('dashboard.html')
+@cached_template('dashboard.html', dashboard_version)
 async def page_dashboard(request: Request):
     if len(block_history_list) == 0 or len(pool_status_list) == 0:
         return {
@@ -68,7 +168,7 @@ async def page_dashboard(request: Request):
     data = {
         'title': 'dashboard',
         'is_online': await check_node_status(),
-        'workers': len(client_list),
+        'workers': sum(count_workers()[0].values()),
         'pool_hashrate': newest.pool_hashrate,
         'network_hashrate': newest.network_hashrate,
         'best_block': block_history_list[-1],
@@ -96,8 +196,9 @@ async def page_explorer(request: Request):
             blockhash = request.query['blockhash'].lower()
             int(blockhash, 16)  # check
             params = {'hash': blockhash, 'txinfo': 'true'}
-            block = await ask_get('/public/getblockbyhash', params)
+            block = await ask_get_cached('/public/getblockbyhash', params, explorer_cache_ttl)
             if isinstance(block, dict):
+                block = dict(block)
                 best_height = block_history_list[-1]['height'] if 0 < len(block_history_list) else None
                 block['title'] = 'block info'
                 return {
@@ -114,8 +215,9 @@ async def page_explorer(request: Request):
         try:
             height = int(request.query['height'])
             params = {'height': height, 'txinfo': 'true'}
-            block = await ask_get('/public/getblockbyheight', params)
+            block = await ask_get_cached('/public/getblockbyheight', params, explorer_cache_ttl)
             if isinstance(block, dict):
+                block = dict(block)
                 best_height = block_history_list[-1]['height'] if 0 < len(block_history_list) else None
                 block['title'] = 'block info'
                 return {
@@ -133,7 +235,7 @@ async def page_explorer(request: Request):
             txhash = request.query['txhash'].lower()
             int(txhash, 16)  # check
             params = {'hash': txhash}
-            tx = await ask_get('/public/gettxbyhash', params)
+            tx = await ask_get_cached('/public/gettxbyhash', params, explorer_cache_ttl)
             if isinstance(tx, dict):
                 best_height = block_history_list[-1]['height'] if 0 < len(block_history_list) else None
                 return {
@@ -157,6 +259,27 @@ async def page_explorer(request: Request):
 
 @aiohttp_jinja2.template('connection.html')
 async def page_connection(request: Request):
+    """sorted listing is cached for a while, only a page of rows is rendered"""
+    address = request.query.get('address') or None
+    consensus = request.query.get('algorithm') or None
+    sort = request.query.get('sort', 'hashrate')
+    if sort not in CLIENT_SORT_KEYS:
+        raise web.HTTPBadRequest(text=f"sort is one of {list(CLIENT_SORT_KEYS)}")
+    name2consensus = {name: algorithm for algorithm, name in C.consensus2name.items()}
+    if consensus is not None and consensus not in name2consensus:
+        raise web.HTTPBadRequest(text=f"unknown algorithm {consensus}")
+    try:
+        page = max(1, int(request.query.get('page', 1)))
+    except ValueError:
+        raise web.HTTPBadRequest(text='page must be int')
+    key = (address, consensus, sort)
+    clients = connection_cache.get(key)
+    if clients is None:
+        clients = filter_clients(address, name2consensus.get(consensus))
+        clients = connection_cache[key] = sort_clients(clients, sort, reverse=(sort != 'reject'))
+    pages = max(1, (len(clients) + CONNECTION_PAGE_SIZE - 1) // CONNECTION_PAGE_SIZE)
+    page = min(page, pages)
+    begin = (page - 1) * CONNECTION_PAGE_SIZE
     data = [
         {
             'version': client.version,
@@ -167,14 +290,60 @@ async def page_connection(request: Request):
             'accept': client.n_accept,
             'reject': client.n_reject,
         }
-        for client in client_list]
+        for client in clients[begin:begin + CONNECTION_PAGE_SIZE]]
     return {
         'title': 'connection',
         'is_online': await check_node_status(),
-        'data': data
+        'data': data,
+        'total': len(clients),
+        'page': page,
+        'pages': pages,
+        'address': address,
+        'algorithm': consensus,
+        'algorithms': sorted(name2consensus),
+        'sort': sort,
+        'sort_keys': list(CLIENT_SORT_KEYS),
     }
 
 
+@aiohttp_jinja2.template('miner.html')
+async def page_miner(request: Request):
+    """workers, balance and share ratio of an address"""
+    address = request.query.get('address', '')
+    if len(address) == 0:
+        raise web.HTTPBadRequest(text='address is required')
+    if len(address) > 100:
+        raise web.HTTPBadRequest(text='too long address')
+    miner = await build_miner(address)
+    workers = [
+        {
+            'version': client.version,
+            'username': client.username,
+            'consensus': client.consensus_name,
+            'difficulty': client.difficulty,
+            'hashrate': client.hashrate_str,
+            'accept': client.n_accept,
+            'reject': client.n_reject,
+        }
+        for client in filter_clients(address=address)]
+    return {
+        'title': 'miner',
+        'is_online': await check_node_status(),
+        'address': address,
+        'workers': workers,
+        'balance': miner['balance'],
+        'distribution': miner['distribution'],
+    }
+
+
+async def page_miner_path(request: Request):
+    """short url `/miner/{address}` of miner page"""
+    address = request.match_info['address']
+    if len(address) > 100:
+        raise web.HTTPBadRequest(text='too long address')
+    raise web.HTTPFound("../miner.html?" + urlencode({'address': address}))
+
+
 @aiohttp_jinja2.template('status.html')
 async def page_status(request: Request):
     return {
@@ -182,10 +351,15 @@ async def page_status(request: Request):
         'is_online': await check_node_status(),
         'system_info': cache.get('system_info'),
         'chain_info': cache.get('chain_info'),
+        'page_cache_stats': dict(page_cache_stats),
+        'node_cache_stats': node_cache_stats,
+        'node_cache_size': len(node_cache),
+        'loop_lag': loop_lag_percentiles(),
+        'watchdog_stats': watchdog_stats,
     }
 
 
-@aiohttp_jinja2.template('terms.html')
+@cached_template('terms.html')
 async def page_terms(request: Request):
     return {
         'title': 'Terms&Conditions',
@@ -193,6 +367,12 @@ async def page_terms(request: Request):
     }
 
 
+async def page_metrics(request: Request):
+    """Prometheus scrape endpoint, include samples reported by worker processes"""
+    return web.Response(body=render_metrics(worker_metrics()).encode(),
+                        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
 async def error_middleware(app, handler):
     async def middleware_handler(request: Request):
         try:
@@ -204,6 +384,8 @@ async def error_middleware(app, handler):
                 'status': 400,  # bad request
                 'message': str(e)}
             return aiohttp_jinja2.render_template('error.html', request, context)
+        except web.HTTPRedirection:
+            raise
         except web.HTTPException as e:
             context = {
                 'title': 'error page',
@@ -223,12 +405,13 @@ async def web_server(port, host='0.0.0.0', ssl_context=None):
         static_path = os.path.join(web_root_dir, 'templates', 'static')
         if not os.path.exists(cache_path):
             os.mkdir(cache_path)
-        aiohttp_jinja2.setup(
+        env = aiohttp_jinja2.setup(
             app=app,
             loader=FileSystemLoader(os.path.join(web_root_dir, 'templates')),
             bytecode_cache=FileSystemBytecodeCache(directory=cache_path, pattern='%s.cache'),
             extensions=['jinja2_time.TimeExtension'],
         )
+        env.globals['static_url'] = static_url
         # add routes
         app.router.add_get('/', page_index)
         app.router.add_get('/index.html', page_index)
@@ -236,14 +419,22 @@ async def web_server(port, host='0.0.0.0', ssl_context=None):
         app.router.add_get('/dashboard.html', page_dashboard)
         app.router.add_get('/explorer.html', page_explorer)
         app.router.add_get('/connection.html', page_connection)
+        app.router.add_get('/miner.html', page_miner)
+        app.router.add_get('/miner/{address}', page_miner_path)
         app.router.add_get('/status.html', page_status)
         app.router.add_get('/terms.html', page_terms)
-        app.router.add_static('/static', static_path)
+        setup_static_routes(app, static_path)
+        setup_api_routes(app)
+        setup_admin_routes(app)
+        app.router.add_get('/ws', ws_feed)
+        app.router.add_get('/metrics', page_metrics)
         # start server
         runner = web.AppRunner(app)
         await runner.setup()
         site = web.TCPSite(runner, host=host, port=port, ssl_context=ssl_context)
         await site.start()
+        asyncio.ensure_future(node_status_refresher())
+        start_loop_monitor()
         log.info(f"start web server {host}:{port} ssl={bool(ssl_context)}")
     except Exception:
         log.error("web server exception", exc_info=True)
@@ -0,0 +1,143 @@
+#!/user/env python3
+# -*- coding: utf-8 -*-
+"""
+frontends stream shares to an aggregator over authenticated TCP link
+
+N frontend processes push shares at full speed, the aggregator is stopped for
+`--down` seconds in the middle and started again on the same port.
+batches go through the real coordinator handler (`record_shares`) into a temp
+database, one applied batch is replayed at the end like a resend after restart.
+shows shares/s, lost & resent shares, balance over share table and time to recover.
+
+python3 -m benchmark.bench_aggregator --frontends 3 --shares 30000
+"""
+from bc4py_stratum_pool.config import Const
+from bc4py_stratum_pool.link import *
+from bc4py_stratum_pool.account import create_db, first_init_database, flush_write_behind
+from bc4py_stratum_pool.cluster import coordinator_handlers
+from bc4py_stratum_pool import link
+from tempfile import TemporaryDirectory
+from time import time
+import multiprocessing
+import argparse
+import asyncio
+import os
+
+SECRET = 'bench secret'
+
+
+def frontend(address, index, shares, rate, start):
+    async def run():
+        client = await connect_link([address], {}, name=f"frontend{index}", secret=SECRET)
+        for i in range(shares):
+            # share id in account_id field to check lost & duplicate, unique share time
+            client.push_share([start + (index * shares + i) * 1e-6, index * shares + i, 1, None, 0.001, 0])
+            if i % 100 == 0:
+                await asyncio.sleep(100 / rate)
+        while client.share_buffer or client.inflight:
+            await asyncio.sleep(0.05)
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+async def read_totals(path):
+    """(share rows, unpaid share sum, balance pending_share sum)"""
+    await flush_write_behind(path)
+    async with create_db(path) as db:
+        cur = await db.cursor()
+        await cur.execute("SELECT COUNT(*), SUM(`share`) FROM `share`")
+        rows, shares = await cur.fetchone()
+        await cur.execute("SELECT SUM(`pending_share`) FROM `balance`")
+        balance, = await cur.fetchone()
+    return rows, shares or 0.0, balance or 0.0
+
+
+async def bench(address, frontends, shares, rate, down):
+    received = list()
+    applied = set()
+    replay = list()
+    done = asyncio.Event()
+
+    async def on_shares(peer, data):
+        count = await coordinator_handlers['shares'](peer, data)
+        if count:
+            received.extend(row[1] for row in data['rows'])
+            applied.update(row[1] for row in data['rows'])
+            if not replay:
+                replay.append(data)
+        if len(applied) == frontends * shares:
+            done.set()
+        return count
+
+    handlers = dict(coordinator_handlers, shares=on_shares)
+    hub = await start_link_hub(address, handlers, SECRET)
+    # wrong secret is rejected
+    reader, writer = await asyncio.open_connection(*address[6:].split(':'))
+    await reader.readline()
+    writer.write(b'{"id":null,"cmd":"auth","data":{"name":"evil","mac":"00"}}\n')
+    rejected = (await reader.readline()) == b''
+    writer.close()
+
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=frontend, args=(address, index, shares, rate, time() - 3600))
+                 for index in range(frontends)]
+    s = time()
+    for process in processes:
+        process.start()
+    # stop aggregator in the middle
+    while len(applied) < frontends * shares // 3:
+        await asyncio.sleep(0.01)
+    hub.close()
+    link.link_hub = None
+    stop_count = len(applied)
+    await asyncio.sleep(down)
+    # restarted aggregator forgets batch ids, database insert is idempotent by share time
+    hub = await start_link_hub(address, handlers, SECRET)
+    restart = time()
+    while len(applied) == stop_count:
+        await asyncio.sleep(0.01)
+    recover = time() - restart
+    await asyncio.wait_for(done.wait(), 120)
+    spend = time() - s
+    for process in processes:
+        process.join()
+    # a batch resent after restart must not be counted to balance again
+    await on_shares(None, dict(replay[0], id='replayed'))
+    hub.close()
+    rows, share_sum, balance_sum = await read_totals(Const.DATABASE_PATH)
+    return {
+        'shares/s': round(frontends * shares / spend, 1),
+        'spend': round(spend, 2),
+        'down': down,
+        'recover': round(recover, 2),
+        'lost': frontends * shares - rows,
+        'resent': len(received) - len(applied),
+        'balance_over': round(balance_sum - share_sum, 6),
+        'auth_rejected': rejected,
+    }
+
+
+async def run(address, frontends, shares, rate, down):
+    with TemporaryDirectory() as tmp:
+        Const.DATABASE_PATH = os.path.join(tmp, 'pool.db')
+        Const.PAYOUT_METHOD = 'transaction'
+        await first_init_database(Const.DATABASE_PATH)
+        return await bench(address, frontends, shares, rate, down)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frontends', type=int, default=3)
+    parser.add_argument('--shares', type=int, default=30000, help='shares by each frontend')
+    parser.add_argument('--rate', type=float, default=10000.0, help='shares/s by each frontend')
+    parser.add_argument('--down', type=float, default=2.0, help='aggregator down seconds')
+    parser.add_argument('--port', type=int, default=38555)
+    args = parser.parse_args()
+    address = f"tcp://127.0.0.1:{args.port}"
+    result = asyncio.get_event_loop().run_until_complete(
+        run(address, args.frontends, args.shares, args.rate, args.down))
+    for key, value in result.items():
+        print(f"{key:14} {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/user/env python3
+# -*- coding: utf-8 -*-
+"""
+shares/sec, share journal append vs direct SQLite insert
+
+direct: one connection & commit per share like mining_submit
+journal: append + periodic fsync, fold into SQLite after
+
+python3 -m benchmark.bench_journal --shares 20000
+"""
+from bc4py_stratum_pool.account import *
+from bc4py_stratum_pool.journal import *
+from tempfile import TemporaryDirectory
+from time import time
+import argparse
+import asyncio
+import os
+
+
+async def bench_direct(path, shares):
+    s = time()
+    for i in range(shares):
+        async with create_share_db(path, 1) as db:
+            cur = await db.cursor()
+            await insert_new_share(cur=cur, account_id=i % 1000, algorithm=1,
+                                   blockhash=None, share=0.001, payout_id=0)
+            await db.commit()
+    return time() - s
+
+
+async def bench_journal(path, directory, shares, sync_every):
+    journal = ShareJournal(directory)
+    s = time()
+    for i in range(shares):
+        journal.append(account_id=i % 1000, algorithm=1, blockhash=None, share=0.001, payout_id=0)
+        if i % sync_every == 0:
+            await journal.sync()
+    await journal.sync()
+    append_time = time() - s
+    journal.close()
+    s = time()
+    count = 0
+    while True:
+        folded = await fold_journal(path, directory)
+        if folded == 0:
+            break
+        count += folded
+    assert count == shares, (count, shares)
+    return append_time, time() - s
+
+
+async def run(shares, sync_every):
+    with TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'pool.db')
+        await first_init_database(path)
+        direct = await bench_direct(path, shares)
+    with TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'pool.db')
+        await first_init_database(path)
+        append, fold = await bench_journal(path, os.path.join(tmp, 'journal'), shares, sync_every)
+        scan_s = time()
+        scanned = sum(1 for _ in iter_window(os.path.join(tmp, 'journal'), 0.0, time()))
+        scan = time() - scan_s
+    print(f"direct sqlite   {round(shares / direct, 1)} shares/s")
+    print(f"journal append  {round(shares / append, 1)} shares/s (fsync every {sync_every})")
+    print(f"journal fold    {round(shares / fold, 1)} shares/s")
+    print(f"journal scan    {round(scanned / scan, 1)} records/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shares', type=int, default=20000)
+    parser.add_argument('--sync-every', type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(run(args.shares, args.sync_every))
+
+
+if __name__ == '__main__':
+    main()
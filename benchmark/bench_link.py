@@ -0,0 +1,79 @@
+#!/user/env python3
+# -*- coding: utf-8 -*-
+"""
+shares/sec, worker processes forward shares to one coordinator by link
+
+each worker hashes a header per share (validation cost) and pushes the share,
+shares are sent by batch, coordinator only counts them. compare 1 worker with N workers for scaling.
+
+python3 -m benchmark.bench_link --workers 4 --shares 20000
+"""
+from bc4py_stratum_pool.link import *
+from bc4py_stratum_pool import link
+from tempfile import TemporaryDirectory
+from hashlib import sha256
+from time import time
+import multiprocessing
+import argparse
+import asyncio
+import os
+
+
+def worker(path, shares, work):
+    async def run():
+        client = await connect_link(path, {})
+        header = os.urandom(80)
+        for i in range(shares):
+            for _ in range(work):
+                header = sha256(sha256(header).digest()).digest() + header[32:]
+            client.push_share([time(), i % 1000, 1, None, 0.001, 0])
+            if i % 256 == 0:
+                await asyncio.sleep(0)
+        while client.share_buffer or client.inflight:
+            await asyncio.sleep(0.05)
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+async def bench(path, workers, shares, work):
+    received = 0
+    done = asyncio.Event()
+
+    async def on_shares(peer, data):
+        nonlocal received
+        received += len(data['rows'])
+        if received == workers * shares:
+            done.set()
+
+    hub = await start_link_hub(path, {'shares': on_shares})
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=worker, args=(path, shares, work)) for _ in range(workers)]
+    s = time()
+    for process in processes:
+        process.start()
+    await done.wait()
+    spend = time() - s
+    for process in processes:
+        process.join()
+    hub.close()
+    link.link_hub = None
+    return spend
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--shares', type=int, default=20000, help='shares by each worker')
+    parser.add_argument('--work', type=int, default=20, help='sha256d per share')
+    args = parser.parse_args()
+    loop = asyncio.get_event_loop()
+    with TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'link.sock')
+        single = loop.run_until_complete(bench(path, 1, args.shares, args.work))
+        multi = loop.run_until_complete(bench(path, args.workers, args.shares, args.work))
+    print(f"1 worker   {round(args.shares / single, 1)} shares/s")
+    print(f"{args.workers} workers  {round(args.workers * args.shares / multi, 1)} shares/s "
+          f"(x{round(args.workers * single / multi, 2)})")
+
+
+if __name__ == '__main__':
+    main()
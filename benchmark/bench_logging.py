@@ -0,0 +1,84 @@
+#!/user/env python3
+# -*- coding: utf-8 -*-
+"""
+submit cost of share path logging, at INFO and at DEBUG
+
+eager: f-string debug lines formatted always (old get_submit_data)
+guarded: same lines behind `log.isEnabledFor(DEBUG)`
+direct: file handler writes on the caller (loop) thread
+queue: QueueHandler, the file is written by the listener thread
+
+python3 -m benchmark.bench_logging --submits 50000
+"""
+from bc4py_stratum_pool.logqueue import start_log_listener, stop_log_listener
+from logging import getLogger, FileHandler, Formatter, DEBUG, INFO
+from hashlib import sha256
+from time import time, perf_counter
+import tempfile
+import argparse
+import os
+
+log = getLogger('bench')
+COINBASE = os.urandom(200)
+
+
+def submit_eager(header: bytes):
+    blockhash = sha256(sha256(header).digest()).digest()
+    log.debug(f"block -> 1 {blockhash.hex()}")
+    log.debug(f"coinbase -> {COINBASE.hex()}")
+    log.debug(f"header -> {header.hex()}")
+    log.debug(f"merkleroot -> 1 {header[36:68].hex()}")
+    log.debug(f"workhash -> {blockhash.hex()} mined:False shared:True")
+    log.debug("shared work!! %s %d diff=%s", "X16S", 1, 0.1)
+
+
+def submit_guarded(header: bytes):
+    blockhash = sha256(sha256(header).digest()).digest()
+    if log.isEnabledFor(DEBUG):
+        log.debug(f"block -> 1 {blockhash.hex()}")
+        log.debug(f"coinbase -> {COINBASE.hex()}")
+        log.debug(f"header -> {header.hex()}")
+        log.debug(f"merkleroot -> 1 {header[36:68].hex()}")
+        log.debug(f"workhash -> {blockhash.hex()} mined:False shared:True")
+    log.debug("shared work!! %s %d diff=%s", "X16S", 1, 0.1)
+
+
+def measure(function, headers):
+    """average & worst cost of a call"""
+    worst = 0.0
+    s = time()
+    for header in headers:
+        call = perf_counter()
+        function(header)
+        worst = max(worst, perf_counter() - call)
+    return (time() - s) / len(headers), worst
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--submits', type=int, default=50000)
+    args = parser.parse_args()
+    headers = [os.urandom(80) for _ in range(args.submits)]
+    directory = tempfile.mkdtemp()
+    log.propagate = False
+    for mode in ('direct', 'queue'):
+        handler = FileHandler(os.path.join(directory, f"{mode}.log"))
+        handler.setFormatter(Formatter('[%(asctime)s %(levelname)-8s] %(message)s'))
+        log.addHandler(handler)
+        if mode == 'queue':
+            start_log_listener(log)
+        for level in (INFO, DEBUG):
+            log.setLevel(level)
+            for function in (submit_eager, submit_guarded):
+                spend, worst = measure(function, headers)
+                print(f"{mode:6} {'DEBUG' if level == DEBUG else 'INFO':5} {function.__name__[7:]:7} "
+                      f"{round(spend * 1e6, 2)} us/submit, worst {round(worst * 1e3, 2)} ms on loop thread")
+        if mode == 'queue':
+            stop_log_listener()
+        for handler in list(log.handlers):
+            log.removeHandler(handler)
+            handler.close()
+
+
+if __name__ == '__main__':
+    main()
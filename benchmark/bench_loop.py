@@ -0,0 +1,96 @@
+#!/user/env python3
+# -*- coding: utf-8 -*-
+"""
+default asyncio loop vs uvloop on stratum-like traffic
+
+connect: clients connect, subscribe by one json line and close
+submit: persistent clients send json submits one by one, server hashes header & responds
+
+python3 -m benchmark.bench_loop --connections 2000 --clients 50 --submits 200
+"""
+from bc4py_stratum_pool.eventloop import setup_event_loop, uvloop
+from hashlib import sha256
+from time import time
+import argparse
+import asyncio
+import json
+import os
+
+
+async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            msg = json.loads(line)
+            if msg['method'] == 'mining.submit':
+                header = bytes.fromhex(msg['params'][4])
+                result = sha256(sha256(header).digest()).digest()[-1] < 255
+            else:
+                result = [[["mining.notify", "00" * 32]], "00000000", 4]
+            response = json.dumps({'result': result, 'error': None, 'id': msg['id']})
+            writer.write(response.encode() + b'\n')
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+async def bench_connect(port, connections, concurrency=100):
+    subscribe = json.dumps({'id': 1, 'method': 'mining.subscribe', 'params': ['bench']}).encode() + b'\n'
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def connect():
+        async with semaphore:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(subscribe)
+            await reader.readline()
+            writer.close()
+
+    s = time()
+    await asyncio.gather(*[connect() for _ in range(connections)])
+    return connections / (time() - s)
+
+
+async def bench_submit(port, clients, submits):
+    async def client():
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        for i in range(submits):
+            params = ['address', '00000001', '00000000', '00000000', os.urandom(80).hex()]
+            writer.write(json.dumps({'id': i, 'method': 'mining.submit', 'params': params}).encode() + b'\n')
+            await reader.readline()
+        writer.close()
+
+    s = time()
+    await asyncio.gather(*[client() for _ in range(clients)])
+    return clients * submits / (time() - s)
+
+
+async def run(connections, clients, submits):
+    server = await asyncio.start_server(handle, '127.0.0.1', 0, backlog=1024)
+    port = server.sockets[0].getsockname()[1]
+    connect = await bench_connect(port, connections)
+    submit = await bench_submit(port, clients, submits)
+    server.close()
+    await server.wait_closed()
+    return connect, submit
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--connections', type=int, default=2000)
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--submits', type=int, default=200, help='submits by each client')
+    args = parser.parse_args()
+    policies = ['default'] + (['uvloop'] if uvloop else [])
+    for policy in policies:
+        loop = setup_event_loop(policy)
+        connect, submit = loop.run_until_complete(run(args.connections, args.clients, args.submits))
+        loop.close()
+        print(f"{policy:8} connect {round(connect, 1)}/s submit {round(submit, 1)}/s")
+    if uvloop is None:
+        print("uvloop is not installed, pip3 install uvloop")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/user/env python3
+# -*- coding: utf-8 -*-
+"""
+overhead of metrics instrumentation on a submit-like hot path
+
+bare: sha256d of an 80 bytes header, like share hashing
+instrumented: same work with the counters, histograms & gauge mining_submit updates
+render: /metrics exposition with many label sets
+
+python3 -m benchmark.bench_metrics --submits 200000
+"""
+from bc4py_stratum_pool.metrics import *
+from hashlib import sha256
+from time import time, perf_counter
+import argparse
+import os
+
+ALGORITHMS = ('X16S', 'X11', 'YESPOWER')
+PORTS = (5000, 5001, 5002)
+RESULTS = ('accepted', 'rejected', 'duplicate', 'stale', 'low_diff')
+
+
+def bare(headers):
+    for header in headers:
+        sha256(sha256(header).digest()).digest()
+
+
+def instrumented(headers):
+    for index, header in enumerate(headers):
+        algorithm = ALGORITHMS[index % 3]
+        s = perf_counter()
+        SUBMIT_INFLIGHT.inc()
+        hash_time = perf_counter()
+        sha256(sha256(header).digest()).digest()
+        HASH_LATENCY.labels(algorithm).observe(perf_counter() - hash_time)
+        SUBMIT_INFLIGHT.dec()
+        SHARES.labels(algorithm, PORTS[index % 3], RESULTS[index % 5]).inc()
+        SUBMIT_LATENCY.labels(algorithm).observe(perf_counter() - s)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--submits', type=int, default=200000)
+    parser.add_argument('--renders', type=int, default=100)
+    args = parser.parse_args()
+    headers = [os.urandom(80) for _ in range(args.submits)]
+    bare(headers[:1000])  # warm up
+
+    s = time()
+    bare(headers)
+    bare_spend = time() - s
+    s = time()
+    instrumented(headers)
+    instrumented_spend = time() - s
+    overhead = (instrumented_spend - bare_spend) / args.submits
+
+    s = time()
+    for _ in range(args.renders):
+        text = render_metrics()
+    render_spend = (time() - s) / args.renders
+
+    print(f"bare         {round(args.submits / bare_spend, 1)} submit/s")
+    print(f"instrumented {round(args.submits / instrumented_spend, 1)} submit/s")
+    print(f"overhead     {round(overhead * 1e6, 3)} us/submit")
+    print(f"render       {round(render_spend * 1e3, 3)} ms, {len(text)} bytes, {text.count(chr(10))} lines")
+
+
+if __name__ == '__main__':
+    main()
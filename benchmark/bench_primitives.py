@@ -0,0 +1,195 @@
+#!/user/env python3
+# -*- coding: utf-8 -*-
+"""
+microbenchmarks of job & commands primitives with correctness vectors
+
+fixtures: templates of 0-5000 txs, job dicts of 2000 (real cap) & 10000 jobs,
+clients with full `time_works`. shares are checked against committed vectors first,
+a benchmark of wrong code is meaningless.
+
+vectors: `share_vectors.json` is not recorded by this code. POW_X11 are Dash
+mainnet/testnet/regtest genesis blocks (coinbase split as extranonce, block hash known
+from chain), POW_YES & POW_X16S headers are mined by the PoW modules bc4py pins
+(bell_yespower 1.0.3, shield_x16s_hash 1.0.1), expected values by hashlib & the module.
+`get_submit_data` must reproduce hash, work hash, flags and submit data.
+missing vectors is a failure, skip explicitly by `--no-vectors`.
+regression: `--save base.json` then `--compare base.json --threshold 0.2`,
+exit code 1 when any case is slower than the threshold.
+
+python3 -m benchmark.bench_primitives --save base.json
+python3 -m benchmark.bench_primitives --compare base.json --threshold 0.2
+"""
+from bc4py_stratum_pool.config import co_efficiency
+from bc4py_stratum_pool.client import Client
+from bc4py_stratum_pool.commands import build_notify_params, swap_pre_processed_sha2, pre_merkleroot, \
+    test_pre_merkleroot
+from bc4py_stratum_pool.job import Job, get_submit_data, get_best_job
+from bc4py_stratum_pool import job as job_module
+from bc4py.config import C
+from expiringdict import ExpiringDict
+from hashlib import sha256
+from time import time
+import argparse
+import timeit
+import random
+import json
+import sys
+import os
+
+VECTOR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'share_vectors.json')
+TX_COUNTS = (0, 100, 1000, 5000)
+
+
+def create_job(rand: random.Random, job_id, algorithm, tx_count, tx_size=250) -> Job:
+    unconfirmed = list()
+    for _ in range(tx_count):
+        data = bytes(rand.getrandbits(8) for _ in range(16)) * (tx_size // 16)
+        unconfirmed.append((sha256(sha256(data).digest()).digest(), data))
+    return Job(
+        job_id=job_id,
+        previous_hash=rand.getrandbits(256).to_bytes(32, 'little'),
+        coinbase=rand.getrandbits(8 * 150).to_bytes(150, 'little') + b'\x00' * 8,
+        unconfirmed=unconfirmed,
+        version=1,
+        bits=bytes.fromhex('1d00ffff'),
+        ntime=int(time()),
+        height=rand.randint(1, 2000000),
+        algorithm=algorithm,
+    )
+
+
+def create_client(rand: random.Random, algorithm) -> Client:
+    client = Client(None, None, algorithm, 1.0, 30.0)
+    now = time()
+    for i in range(client.time_works.maxlen):
+        client.time_works.append((now - 600 + i * 15 + rand.random(), 1.0 + rand.random()))
+    return client
+
+
+"""vectors
+"""
+
+
+def verify_vectors(path) -> bool:
+    test_pre_merkleroot()
+    if not os.path.exists(path):
+        print(f"no share vectors {path}, skip by --no-vectors")
+        return False
+    with open(path, mode='r') as fp:
+        vectors = json.load(fp)
+    name2consensus = {name: algorithm for algorithm, name in C.consensus2name.items()}
+    failed = 0
+    for vector in vectors:
+        job = Job.from_dict(dict(vector['job'], algorithm=name2consensus[vector['algorithm']]))
+        submit_data, block, f_mined, f_shared = get_submit_data(
+            job, bytes.fromhex(vector['extranonce1']), bytes.fromhex(vector['extranonce2']),
+            bytes.fromhex(vector['nonce']), vector['difficulty'])
+        result = {
+            'hash': block.hash.hex(),
+            'work_hash': block.work_hash.hex(),
+            'f_mined': f_mined,
+            'f_shared': f_shared,
+            'submit': submit_data and submit_data.hex(),
+        }
+        if result != vector['expect']:
+            failed += 1
+            print(f"vector mismatch {vector['algorithm']} {vector['source']} nonce={vector['nonce']}")
+            for key, value in result.items():
+                if value != vector['expect'][key]:
+                    print(f"  {key} {value} != {vector['expect'][key]}")
+    print(f"share vectors {len(vectors) - failed}/{len(vectors)} ok")
+    return 0 < len(vectors) and failed == 0
+
+
+"""cases
+"""
+
+
+def build_cases(rand: random.Random) -> dict:
+    cases = dict()
+    blockhash = rand.getrandbits(256).to_bytes(32, 'little')
+    cases['swap_pre_processed_sha2'] = lambda: swap_pre_processed_sha2(blockhash)
+    for tx_count in TX_COUNTS:
+        job = create_job(rand, 1, C.BLOCK_X11_POW, tx_count)
+        unconfirmed = [txhash for txhash, _ in job.unconfirmed]
+        cases[f"pre_merkleroot txs={tx_count}"] = lambda u=unconfirmed: pre_merkleroot(u)
+        cases[f"build_notify_params txs={tx_count}"] = lambda j=job: build_notify_params(j, True)
+    for algorithm in co_efficiency:
+        name = C.consensus2name[algorithm]
+        for tx_count in (0, 1000):
+            job = create_job(rand, 1, algorithm, tx_count)
+            extranonce1, extranonce2, nonce = os.urandom(4), os.urandom(4), os.urandom(4)
+            cases[f"get_submit_data {name} txs={tx_count}"] = \
+                lambda j=job, e1=extranonce1, e2=extranonce2, n=nonce: get_submit_data(j, e1, e2, n, 1.0)
+    client = create_client(rand, C.BLOCK_X11_POW)
+    cases['Client.hashrate'] = lambda: client.hashrate
+    cases['Client.average_submit_span'] = lambda: client.average_submit_span()
+    for size in (2000, 10000):
+        jobs = ExpiringDict(max_len=size, max_age_seconds=300)
+        for job_id in range(1, size + 1):
+            jobs[job_id] = create_job(rand, job_id, list(co_efficiency)[job_id % len(co_efficiency)], 0)
+        cases[f"get_best_job jobs={size}"] = lambda j=jobs: best_job_of(j)
+    return cases
+
+
+def best_job_of(jobs):
+    """get_best_job reads module level job_dict"""
+    original = job_module.job_dict
+    job_module.job_dict = jobs
+    try:
+        return get_best_job(C.BLOCK_X11_POW)
+    finally:
+        job_module.job_dict = original
+
+
+def measure(function, repeat) -> float:
+    """best seconds per call"""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--filter', default='', help='run cases including the word')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', help='write results JSON')
+    parser.add_argument('--compare', help='baseline results JSON')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown ratio')
+    parser.add_argument('--vectors', default=VECTOR_PATH)
+    parser.add_argument('--no-vectors', action='store_true', help='skip share vectors check')
+    args = parser.parse_args()
+    if args.no_vectors:
+        print("share vectors check is skipped")
+    elif not verify_vectors(args.vectors):
+        sys.exit(2)
+
+    results = dict()
+    for name, function in build_cases(random.Random(0)).items():
+        if args.filter not in name:
+            continue
+        results[name] = measure(function, args.repeat)
+        print(f"{name:40} {results[name] * 1e6:12.2f} us")
+    if args.save:
+        with open(args.save, mode='w') as fp:
+            json.dump({'time': int(time()), 'results': results}, fp, indent=1)
+        print(f"write {args.save}")
+    if args.compare:
+        with open(args.compare, mode='r') as fp:
+            baseline = json.load(fp)['results']
+        regressions = list()
+        for name, spend in results.items():
+            if name not in baseline:
+                continue
+            ratio = spend / baseline[name] - 1.0
+            mark = 'REGRESSION' if args.threshold < ratio else ''
+            print(f"{name:40} {ratio * 100:+7.1f}% {mark}")
+            if mark:
+                regressions.append(name)
+        if regressions:
+            print(f"{len(regressions)} cases slower over {args.threshold * 100:.0f}%")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/user/env python3
+# -*- coding: utf-8 -*-
+"""
+concurrent share insert throughput under the real payout planning
+
+single database vs per-algorithm share shards.
+`recode_payout_plan` runs in a loop against a settled block per round, while
+inserters write shares of random accounts. reports shares/s, worst insert
+latency and payout plan time.
+
+python3 -m benchmark.bench_shard --seconds 10 --history 20000
+"""
+from bc4py_stratum_pool.config import Const
+from bc4py_stratum_pool.account import *
+from bc4py_stratum_pool.autowork import recode_payout_plan
+from bc4py_stratum_pool import account
+from tempfile import TemporaryDirectory
+from time import time
+import argparse
+import asyncio
+import random
+import os
+
+ALGORITHMS = [1, 2, 3]  # dummy algorithm numbers
+ACCOUNTS = 500
+
+
+async def inserter(path, algorithm, deadline, counter, latency):
+    rand = random.Random(algorithm)
+    while time() < deadline:
+        s = time()
+        async with create_share_db(path, algorithm) as db:
+            cur = await db.cursor()
+            await insert_new_share(cur=cur, account_id=rand.randint(1, ACCOUNTS), algorithm=algorithm,
+                                   blockhash=None, share=0.001, payout_id=0)
+            await db.commit()
+        latency.append(time() - s)
+        counter[algorithm] += 1
+
+
+async def payout(path, deadline):
+    spends = list()
+    while time() < deadline:
+        # a settled block to pay by this round
+        async with create_db(path) as db:
+            cur = await db.cursor()
+            blockhash = os.urandom(32)
+            await insert_new_mined_block(cur=cur, blockhash=blockhash, algorithm=ALGORITHMS[0],
+                                         height=len(spends) + 1, payout_id=0)
+            await update_mined_block(cur=cur, blockhash=blockhash, height=len(spends) + 1,
+                                     confirmations=100, status=MINED_BLOCK_SETTLED, reward=10 ** 10)
+            await db.commit()
+        s = time()
+        await recode_payout_plan(min_amount=0, owner_fee=0.05, ignore_amount=0, max_outputs=200)
+        spends.append(time() - s)
+        await asyncio.sleep(0.1)
+    return spends
+
+
+async def fill_history(path, history):
+    """old unpaid shares, payout plan reads and marks all of them at first round"""
+    rand = random.Random(0)
+    ntime = time() - 3600
+    for algorithm in ALGORITHMS:
+        async with create_share_db(path, algorithm) as db:
+            cur = await db.cursor()
+            for _ in range(history // len(ALGORITHMS)):
+                ntime += 0.0001
+                await insert_new_share(cur=cur, account_id=rand.randint(1, ACCOUNTS), algorithm=algorithm,
+                                       blockhash=None, share=0.001, payout_id=0, ntime=ntime)
+            await db.commit()
+
+
+async def run(sharded, seconds, workers, history):
+    account.share_shards.clear()
+    with TemporaryDirectory() as tmp:
+        path = Const.DATABASE_PATH = os.path.join(tmp, 'pool.db')
+        Const.PAYOUT_METHOD = 'transaction'
+        await first_init_database(path, shard_algorithms=ALGORITHMS if sharded else None)
+        await fill_history(path, history)
+        counter = {algorithm: 0 for algorithm in ALGORITHMS}
+        latency = list()
+        deadline = time() + seconds
+        tasks = [inserter(path, algorithm, deadline, counter, latency)
+                 for algorithm in ALGORITHMS for _ in range(workers)]
+        results = await asyncio.gather(payout(path, deadline), *tasks)
+    account.share_shards.clear()
+    spends = results[0]
+    total = sum(counter.values())
+    print(f"{'sharded' if sharded else 'single '} payouts={len(spends)} "
+          f"plan avg={round(1000 * sum(spends) / max(1, len(spends)), 1)}mS "
+          f"shares={total} {round(total / seconds, 1)} shares/s "
+          f"worst insert={round(1000 * max(latency or [0.0]), 1)}mS")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--workers', type=int, default=4, help='inserters per algorithm')
+    parser.add_argument('--history', type=int, default=20000, help='unpaid shares before start')
+    args = parser.parse_args()
+    loop = asyncio.get_event_loop()
+    for sharded in (False, True):
+        loop.run_until_complete(run(sharded, args.seconds, args.workers, args.history))
+
+
+if __name__ == '__main__':
+    main()
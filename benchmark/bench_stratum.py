@@ -0,0 +1,288 @@
+#!/user/env python3
+# -*- coding: utf-8 -*-
+"""
+synthetic stratum load, end-to-end pool capacity
+
+simulated miners connect, subscribe, authorize and submit at a rate.
+share mix: fresh shares (accepted or low-diff by port difficulty), duplicate (resend
+the last accepted share) and stale (unknown job id).
+reports connections/s, submits/s, submit latency p50/p99 and notify fan-out time as JSON.
+
+local: pool (X11 stratum & database on temp dir) against the node simulator in this process,
+    port difficulty is chosen so `--low-diff` of fresh shares fail
+remote: `--host pool.example.com --port 5006 --address <bech32>`, no fan-out measure
+
+python3 -m benchmark.bench_stratum --connections 1000 --duration 30 --output result.json
+"""
+from time import time, perf_counter
+from collections import Counter
+import argparse
+import asyncio
+import random
+import json
+import os
+
+RESPONSE_NAMES = {None: 'accepted', 20: 'unknown', 21: 'job_not_found', 22: 'duplicate', 23: 'low_diff',
+                  24: 'unauthorized', 25: 'not_subscribed'}
+
+
+class Miner(object):
+    """simulated miner on one connection"""
+
+    def __init__(self, index, address, on_notify):
+        self.index = index
+        self.address = address
+        self.on_notify = on_notify
+        self.reader = self.writer = None
+        self.uuid = 0
+        self.waiting = dict()
+        self.extranonce1 = None
+        self.job = None  # (job_id, ntime)
+        self.last_accepted = None
+        self.receiver = None
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.receiver = asyncio.ensure_future(self.receive())
+        subscribe = await self.request('mining.subscribe', ['bench/0.1'])
+        self.extranonce1 = subscribe[1]
+        authorize = await self.request('mining.authorize', [self.address, 'x'])
+        if authorize is not True:
+            raise ConnectionError(f"authorize failed {authorize}")
+
+    async def receive(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            msg = json.loads(line)
+            if msg.get('method') == 'mining.notify':
+                params = msg['params']
+                self.job = (params[0], params[7])
+                self.on_notify(self, params[8])
+            elif msg.get('id') in self.waiting:
+                self.waiting.pop(msg['id']).set_result(msg)
+        for future in self.waiting.values():
+            future.set_exception(ConnectionError('closed'))
+        self.waiting.clear()
+
+    async def request(self, method, params, raw=False):
+        self.uuid += 1
+        future = self.waiting[self.uuid] = asyncio.get_event_loop().create_future()
+        msg = {'id': self.uuid, 'method': method, 'params': params}
+        self.writer.write(json.dumps(msg).encode() + b'\n')
+        response = await future
+        return response if raw else response['result']
+
+    async def submit(self, kind):
+        """return (kind, response name, latency)"""
+        job_id, ntime = self.job
+        if kind == 'duplicate' and self.last_accepted:
+            params = self.last_accepted
+        elif kind == 'stale':
+            params = [self.address, 'ffffffff', os.urandom(4).hex(), ntime, os.urandom(4).hex()]
+        else:
+            kind = 'fresh'
+            params = [self.address, job_id, os.urandom(4).hex(), ntime, os.urandom(4).hex()]
+        s = perf_counter()
+        response = await self.request('mining.submit', params, raw=True)
+        latency = perf_counter() - s
+        error = response.get('error')
+        name = RESPONSE_NAMES.get(error[0] if error else None, 'unknown')
+        if name == 'accepted' and response.get('result') is True:
+            self.last_accepted = params
+        elif name == 'accepted':
+            name = 'rejected'
+        return kind, name, latency
+
+    def close(self):
+        if self.receiver:
+            self.receiver.cancel()
+        if self.writer:
+            self.writer.close()
+
+
+def percentile(values, q):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[round((len(values) - 1) * q)]
+
+
+def raise_fd_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+async def run_load(args, host, port, address, new_block=None):
+    loop = asyncio.get_event_loop()
+    miners = list()
+    connect_errors = Counter()
+    results = Counter()
+    latencies = list()
+    fan_out = list()
+    block_time = None
+    clean_notified = set()
+
+    def on_notify(miner, f_clean):
+        if f_clean and block_time is not None and miner.index not in clean_notified:
+            clean_notified.add(miner.index)
+            if len(clean_notified) == len(miners):
+                fan_out.append(perf_counter() - block_time)
+
+    # connect by rate
+    s = time()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def connect(index):
+        await asyncio.sleep(index / args.connect_rate)
+        miner = Miner(index, address, on_notify)
+        async with semaphore:
+            try:
+                await asyncio.wait_for(miner.connect(host, port), args.timeout)
+                miners.append(miner)
+            except Exception as e:
+                connect_errors[type(e).__name__] += 1
+                miner.close()
+
+    await asyncio.gather(*[connect(index) for index in range(args.connections)])
+    connect_spend = time() - s
+    # wait first jobs
+    while any(miner.job is None for miner in miners):
+        await asyncio.sleep(0.1)
+
+    # submit by rate with share mix
+    f_running = True
+    fractions = (('duplicate', args.duplicate), ('stale', args.stale))
+
+    async def mining(miner: Miner):
+        rand = random.Random(miner.index)
+        while f_running:
+            await asyncio.sleep(rand.expovariate(args.submit_rate))
+            if not f_running:
+                break
+            point, kind = rand.random(), 'fresh'
+            for name, fraction in fractions:
+                if point < fraction:
+                    kind = name
+                    break
+                point -= fraction
+            try:
+                kind, name, latency = await asyncio.wait_for(miner.submit(kind), args.timeout)
+                results[(kind, name)] += 1
+                latencies.append(latency)
+            except Exception as e:
+                results[(kind, type(e).__name__)] += 1
+
+    s = time()
+    tasks = [asyncio.ensure_future(mining(miner)) for miner in miners]
+    # new blocks while submitting, measure clean notify fan-out to all miners
+    if new_block is not None:
+        for _ in range(args.blocks):
+            await asyncio.sleep(args.duration / (args.blocks + 1))
+            clean_notified.clear()
+            block_time = perf_counter()
+            await new_block()
+    await asyncio.sleep(max(0.0, args.duration - (time() - s)))
+    f_running = False
+    await asyncio.gather(*tasks)
+    submit_spend = time() - s
+    for miner in miners:
+        miner.close()
+    await asyncio.sleep(0.1)
+
+    submits = len(latencies)
+    return {
+        'connections': len(miners),
+        'connect_errors': dict(connect_errors),
+        'connections/s': round(len(miners) / connect_spend, 1),
+        'submits': submits,
+        'submits/s': round(submits / submit_spend, 1),
+        'submit_latency_p50': percentile(latencies, 0.5),
+        'submit_latency_p99': percentile(latencies, 0.99),
+        'results': {f"{kind}/{name}": count for (kind, name), count in sorted(results.items())},
+        'notify_fan_out': fan_out,
+        'notify_fan_out_max': max(fan_out) if fan_out else None,
+        'loop': type(loop).__module__,
+    }
+
+
+async def run_local(args):
+    """pool & node simulator in this process"""
+    from bc4py_stratum_pool.config import Const
+    from bc4py_stratum_pool.account import first_init_database
+    from bc4py_stratum_pool.autowork import auto_block_notify, auto_notify_by_ws, auto_write_behind
+    from bc4py_stratum_pool.stratum import stratum_server
+    from benchmark.node_simulator import NodeSimulator, bech32_address
+    from bc4py.config import C, V
+    from tempfile import mkdtemp
+    V.BECH32_HRP = 'test'
+    node = NodeSimulator(hrp=V.BECH32_HRP, tx_count=args.txs)
+    Const.REST_API = await node.start()
+    Const.DATABASE_PATH = os.path.join(mkdtemp(), 'bench.db')
+    await first_init_database(Const.DATABASE_PATH)
+    # share passes when hash <= target of difficulty, probability 1 / (difficulty * 2^32) on X11
+    fresh = 1.0 - args.duplicate - args.stale
+    pass_ratio = (fresh - args.low_diff) / fresh
+    difficulty = 1e-12 if 0.999 < pass_ratio else 1 / (pass_ratio * 2 ** 32)
+    server = await stratum_server(0, C.BLOCK_X11_POW, difficulty, variable_diff=False, host='127.0.0.1')
+    port = server.sockets[0].getsockname()[1]
+    tasks = [asyncio.ensure_future(auto_block_notify([C.BLOCK_X11_POW])),
+             asyncio.ensure_future(auto_notify_by_ws()),
+             asyncio.ensure_future(auto_write_behind())]
+    while len(node.websockets) == 0:
+        await asyncio.sleep(0.1)
+    address = bech32_address(V.BECH32_HRP, os.urandom(20))
+    result = await run_load(args, '127.0.0.1', port, address, node.new_block)
+    result['node'] = dict(node.stats)
+    result['difficulty'] = difficulty
+    for task in tasks:
+        task.cancel()
+    server.close()
+    await node.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', help='remote pool, local pool & node simulator when omitted')
+    parser.add_argument('--port', type=int, default=5006)
+    parser.add_argument('--address', help='miner address of remote pool')
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--connect-rate', type=float, default=500.0, help='new connections/s')
+    parser.add_argument('--concurrency', type=int, default=200, help='max connecting at once')
+    parser.add_argument('--submit-rate', type=float, default=0.5, help='submits/s by each miner')
+    parser.add_argument('--duration', type=float, default=30.0, help='submitting seconds')
+    parser.add_argument('--low-diff', type=float, default=0.05, help='fraction of all submits (local)')
+    parser.add_argument('--duplicate', type=float, default=0.02)
+    parser.add_argument('--stale', type=float, default=0.03)
+    parser.add_argument('--blocks', type=int, default=3, help='new blocks while submitting (local)')
+    parser.add_argument('--txs', type=int, default=100, help='template tx count (local)')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--loop', default='auto', help='auto, uvloop or default')
+    parser.add_argument('--output', help='write result JSON')
+    args = parser.parse_args()
+    assert args.low_diff + args.duplicate + args.stale < 1.0
+    raise_fd_limit()
+    from bc4py_stratum_pool.eventloop import setup_event_loop
+    loop = setup_event_loop(args.loop)
+    if args.host is None:
+        result = loop.run_until_complete(run_local(args))
+    else:
+        assert args.address, 'remote pool requires --address'
+        result = loop.run_until_complete(run_load(args, args.host, args.port, args.address))
+    output = {'time': int(time()), 'args': vars(args), 'result': result}
+    for key, value in result.items():
+        print(f"{key:20} {value}")
+    if args.output:
+        with open(args.output, mode='w') as fp:
+            json.dump(output, fp, indent=2)
+        print(f"write {args.output}")
+
+
+if __name__ == '__main__':
+    main()
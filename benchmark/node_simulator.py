@@ -0,0 +1,454 @@
+#!/user/env python3
+# -*- coding: utf-8 -*-
+"""
+deterministic in-process bc4py node simulator for offline pool testing
+
+JSON-RPC: getblocktemplate, submitblock
+REST: /public/getsysteminfo, /public/getchaininfo, /public/getblockbyhash, /public/getblockbyheight,
+    /public/gettxbyhash, /private/sendmany
+websocket: /public/ws Block & TX stream
+
+same seed gives same chain (hashes, txs), times follow the wall clock for job ntime.
+blocks are made by `new_block()`, every `block_span` seconds or by an accepted `submitblock`.
+latency & faults: `latency`/`jitter` delay every request, `error_rate` returns 500 randomly,
+`fail_next(name, count)` fails next calls of a method or path, `stall(seconds)` holds all requests,
+`drop_websockets()` cuts the stream.
+
+python3 -m benchmark.node_simulator --port 3000 --block-span 30 --txs 500
+"""
+from bc4py.config import C
+from bc4py.chain.tx import TX
+from bc4py_extension import PyAddress
+from aiohttp import web
+from hashlib import sha256
+from logging import getLogger
+from typing import Dict, List, Optional
+from time import time
+import argparse
+import asyncio
+import base64
+import random
+
+log = getLogger(__name__)
+BECH32_CHARSET = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+BLOCK_REWARD = 10 * 100000000
+
+
+def bech32_polymod(values):
+    generator = (0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3)
+    chk = 1
+    for value in values:
+        top = chk >> 25
+        chk = (chk & 0x1ffffff) << 5 ^ value
+        for i in range(5):
+            chk ^= generator[i] if ((top >> i) & 1) else 0
+    return chk
+
+
+def bech32_address(hrp: str, identifier: bytes, version=0) -> str:
+    """encode version 0 address like bc4py, for miners' usernames"""
+    acc, bits, data = 0, 0, [version]
+    for value in identifier:
+        acc = (acc << 8) | value
+        bits += 8
+        while 5 <= bits:
+            bits -= 5
+            data.append((acc >> bits) & 31)
+    if bits:
+        data.append((acc << (5 - bits)) & 31)
+    expand = [ord(x) >> 5 for x in hrp] + [0] + [ord(x) & 31 for x in hrp]
+    polymod = bech32_polymod(expand + data + [0] * 6) ^ 1
+    checksum = [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+    return hrp + '1' + ''.join(BECH32_CHARSET[d] for d in data + checksum)
+
+
+def create_coinbase(height, address: str) -> bytes:
+    """coinbase tx, its last 8 bytes message is replaced by extranonce1 & extranonce2"""
+    tx = TX.from_dict(tx={
+        'type': C.TX_POW_REWARD,
+        'time': height,
+        'deadline': height + 10800,
+        'inputs': list(),
+        'outputs': [(PyAddress.from_string(address), 0, BLOCK_REWARD)],
+        'gas_price': 0,
+        'gas_amount': 0,
+        'message_type': C.MSG_BYTE,
+        'message': b'\x00' * 8,
+    })
+    return tx.b
+
+
+def sha256d(b: bytes) -> bytes:
+    return sha256(sha256(b).digest()).digest()
+
+
+class SimulatorFault(Exception):
+    pass
+
+
+class NodeSimulator(object):
+    """
+    seed: chain random seed
+    algorithms: mining algorithm numbers, new blocks rotate them
+    tx_count, tx_size: unconfirmed txs included in each template
+    bits: network target, default is too hard to be mined by benchmark
+    block_span: make a block every seconds, None is manual
+    latency, jitter: seconds added to every request
+    error_rate: fraction of requests answered by 500
+    """
+
+    def __init__(self, hrp='test', seed=0, algorithms=None, tx_count=0, tx_size=250, bits='1d00ffff',
+                 block_span: Optional[float] = None, latency=0.0, jitter=0.0, error_rate=0.0):
+        self.hrp = hrp
+        self.chain_random = random.Random(seed)
+        self.fault_random = random.Random(seed + 1)
+        self.algorithms = list(algorithms or [C.BLOCK_X11_POW])
+        self.tx_count = tx_count
+        self.tx_size = tx_size
+        self.bits = bits
+        self.block_span = block_span
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.address = bech32_address(hrp, b'\x00' * 20)
+        # chain
+        self.blocks: List[dict] = list()
+        self.block_by_hash: Dict[str, dict] = dict()
+        self.tx_by_hash: Dict[str, dict] = dict()
+        self.mempool: List[dict] = list()
+        # faults
+        self.fail_counts: Dict[str, int] = dict()
+        self.stall_until = 0.0
+        self.websockets = set()
+        self.stats = {'request': 0, 'fault': 0, 'template': 0, 'submit': 0, 'accept': 0, 'block': 0, 'sendmany': 0}
+        self.runner = None
+        self.mining_task = None
+        self.append_block(flag=self.algorithms[0])  # genesis
+        self.fill_mempool()
+
+    def __repr__(self):
+        return f"<NodeSimulator height={self.best['height']} mempool={len(self.mempool)} ws={len(self.websockets)}>"
+
+    @property
+    def best(self) -> dict:
+        return self.blocks[-1]
+
+    def random_hash(self) -> str:
+        return self.chain_random.getrandbits(256).to_bytes(32, 'little').hex()
+
+    def create_tx(self, outputs=None, size=None) -> dict:
+        size = size or self.tx_size
+        data = self.chain_random.getrandbits(size * 8).to_bytes(size, 'little')
+        return {
+            'hash': sha256d(data).hex(),
+            'type': 'TRANSFER',
+            'time': int(time()),
+            'deadline': int(time()) + 10800,
+            'inputs': [[self.random_hash(), 0]],
+            'outputs': outputs or [[self.address, 0, 100000]],
+            'gas_price': 100,
+            'gas_amount': size,
+            'message_type': 'NONE',
+            'message': '',
+            'size': size,
+            'height': None,
+            'data': data.hex(),
+        }
+
+    def fill_mempool(self):
+        while len(self.mempool) < self.tx_count:
+            tx = self.create_tx()
+            self.mempool.append(tx)
+            self.tx_by_hash[tx['hash']] = tx
+
+    async def new_block(self, flag=None, blockhash: Optional[bytes] = None, header: Optional[bytes] = None) -> dict:
+        """
+        advance the tip & stream Block and new mempool TXs
+        blockhash & header: accepted submitblock, random block when None
+        """
+        block = self.append_block(flag, blockhash, header)
+        await self.broadcast('Block', self.block_view(block, txinfo=False))
+        for tx in self.mempool:
+            await self.broadcast('TX', self.tx_view(tx))
+        return block
+
+    def append_block(self, flag=None, blockhash: Optional[bytes] = None, header: Optional[bytes] = None) -> dict:
+        height = len(self.blocks)
+        flag = flag or self.algorithms[height % len(self.algorithms)]
+        coinbase = {
+            'hash': self.random_hash(),
+            'type': 'POW_REWARD',
+            'time': int(time()),
+            'deadline': int(time()) + 10800,
+            'inputs': list(),
+            'outputs': [[self.address, 0, BLOCK_REWARD]],
+            'gas_price': 0,
+            'gas_amount': 0,
+            'message_type': 'NONE',
+            'message': '',
+            'size': 120,
+            'height': height,
+        }
+        txs = [coinbase] + self.mempool
+        for tx in txs:
+            tx['height'] = height
+            self.tx_by_hash[tx['hash']] = tx
+        block = {
+            'hash': blockhash.hex() if blockhash else self.random_hash(),
+            'work_hash': self.random_hash(),
+            'previous_hash': self.best['hash'] if self.blocks else '00' * 32,
+            'next_hash': None,
+            'merkleroot': header[36:68].hex() if header else self.random_hash(),
+            'height': height,
+            'flag': C.consensus2name[flag],
+            'time': int(time()),
+            'difficulty': 1.0,
+            'fixed_difficulty': 1.0,
+            'bits': int(self.bits, 16),
+            'bias': 1.0,
+            'nonce': header[76:80].hex() if header else '00000000',
+            'size': 80 + sum(tx['size'] for tx in txs),
+            'recode_flag': 'memory',
+            'f_orphan': False,
+            'txs': txs,
+        }
+        if self.blocks:
+            self.best['next_hash'] = block['hash']
+            self.best['recode_flag'] = 'database'
+        self.blocks.append(block)
+        self.block_by_hash[block['hash']] = block
+        self.mempool = list()
+        self.fill_mempool()
+        self.stats['block'] += 1
+        return block
+
+    def block_view(self, block, txinfo) -> dict:
+        view = dict(block)
+        view['txs'] = [self.tx_view(tx) for tx in block['txs']] if txinfo else [tx['hash'] for tx in block['txs']]
+        return view
+
+    @staticmethod
+    def tx_view(tx) -> dict:
+        return {key: value for key, value in tx.items() if key != 'data'}
+
+    async def broadcast(self, cmd, data):
+        for ws in list(self.websockets):
+            try:
+                await ws.send_json({'cmd': cmd, 'data': data})
+            except ConnectionError:
+                self.websockets.discard(ws)
+
+    """faults
+    """
+
+    def fail_next(self, name, count=1):
+        """fail next `count` calls of RPC method or REST path"""
+        self.fail_counts[name] = self.fail_counts.get(name, 0) + count
+
+    def stall(self, seconds):
+        """hold all requests like a busy node"""
+        self.stall_until = time() + seconds
+
+    async def drop_websockets(self):
+        for ws in list(self.websockets):
+            await ws.close()
+        self.websockets.clear()
+
+    async def inject(self, name):
+        """latency & faults before a request is served"""
+        self.stats['request'] += 1
+        if time() < self.stall_until:
+            await asyncio.sleep(self.stall_until - time())
+        delay = self.latency + (self.fault_random.random() * self.jitter if self.jitter else 0.0)
+        if 0.0 < delay:
+            await asyncio.sleep(delay)
+        if 0 < self.fail_counts.get(name, 0):
+            self.fail_counts[name] -= 1
+            self.stats['fault'] += 1
+            raise SimulatorFault(f"injected fault {name}")
+        if self.error_rate and self.fault_random.random() < self.error_rate:
+            self.stats['fault'] += 1
+            raise SimulatorFault(f"random fault {name}")
+
+    """handlers
+    """
+
+    def template(self) -> dict:
+        self.stats['template'] += 1
+        return {
+            'version': 1,
+            'previousblockhash': bytes.fromhex(self.best['hash'])[::-1].hex(),
+            'coinbasetxn': {'data': create_coinbase(len(self.blocks), self.address).hex()},
+            'transactions': [{'hash': bytes.fromhex(tx['hash'])[::-1].hex(), 'data': tx['data']}
+                             for tx in self.mempool],
+            'bits': self.bits,
+            'time': int(time()),
+            'height': len(self.blocks),
+        }
+
+    async def submit_block(self, algorithm, submit_data: str) -> Optional[str]:
+        """None is accepted like bitcoind, else reject reason"""
+        self.stats['submit'] += 1
+        data = bytes.fromhex(submit_data)
+        if len(data) < 80:
+            return 'too short block'
+        header = data[:80]
+        if header[4:36].hex() != self.best['hash']:
+            return 'stale block, previous hash is not best'
+        self.stats['accept'] += 1
+        await self.new_block(flag=algorithm, blockhash=sha256d(header), header=header)
+        return None
+
+    async def json_rpc(self, request: web.Request):
+        data = await request.json()
+        method = data['method']
+        try:
+            await self.inject(method)
+        except SimulatorFault as e:
+            return web.Response(status=500, text=str(e))
+        # algorithm is the password of basic auth
+        auth = request.headers.get('Authorization', '')
+        try:
+            algorithm = int(base64.b64decode(auth[6:]).decode().split(':', 1)[1])
+        except (ValueError, IndexError):
+            algorithm = self.algorithms[0]
+        if method == 'getblocktemplate':
+            result = self.template()
+        elif method == 'submitblock':
+            result = await self.submit_block(algorithm, data['params'][0])
+        else:
+            return web.json_response({'result': None, 'error': f"unknown method {method}", 'id': data['id']})
+        return web.json_response({'result': result, 'error': None, 'id': data['id']})
+
+    @web.middleware
+    async def rest_middleware(self, request: web.Request, handler):
+        if request.path == '/' or request.path == '/public/ws':
+            return await handler(request)
+        try:
+            await self.inject(request.path)
+        except SimulatorFault as e:
+            return web.Response(status=500, text=str(e))
+        return await handler(request)
+
+    async def system_info(self, request: web.Request):
+        return web.json_response({
+            'system_ver': 'simulator',
+            'api_ver': 'simulator',
+            'chain_ver': 1,
+            'booting': False,
+            'connections': len(self.websockets),
+            'unconfirmed': len(self.mempool),
+        })
+
+    async def chain_info(self, request: web.Request):
+        return web.json_response({
+            'best': self.block_view(self.best, txinfo=False),
+            'mining': {C.consensus2name[algorithm]: {'number': algorithm, 'difficulty': 1.0, 'hashrate': 0}
+                       for algorithm in self.algorithms},
+            'money_supply': BLOCK_REWARD * len(self.blocks),
+            'total_supply': BLOCK_REWARD * 21000000,
+            'checkpoint': {'height': self.best['height'], 'blockhash': self.best['hash']},
+        })
+
+    async def get_block_by_hash(self, request: web.Request):
+        block = self.block_by_hash.get(request.query.get('hash', '').lower())
+        if block is None:
+            return web.Response(status=400, text='not found block')
+        return web.json_response(self.block_view(block, request.query.get('txinfo') == 'true'))
+
+    async def get_block_by_height(self, request: web.Request):
+        try:
+            block = self.blocks[int(request.query['height'])]
+        except (KeyError, ValueError, IndexError):
+            return web.Response(status=400, text='not found block')
+        return web.json_response(self.block_view(block, request.query.get('txinfo') == 'true'))
+
+    async def get_tx_by_hash(self, request: web.Request):
+        tx = self.tx_by_hash.get(request.query.get('hash', '').lower())
+        if tx is None:
+            return web.Response(status=400, text='not found tx')
+        return web.json_response(self.tx_view(tx))
+
+    async def sendmany(self, request: web.Request):
+        data = await request.json()
+        pairs = data.get('pairs')
+        if not pairs:
+            return web.Response(status=400, text='no pairs')
+        self.stats['sendmany'] += 1
+        tx = self.create_tx(outputs=[list(pair) for pair in pairs], size=100 + 40 * len(pairs))
+        self.mempool.append(tx)
+        self.tx_by_hash[tx['hash']] = tx
+        await self.broadcast('TX', self.tx_view(tx))
+        return web.json_response({'hash': tx['hash'], 'gas_amount': tx['gas_amount'], 'time': tx['time']})
+
+    async def websocket(self, request: web.Request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.websockets.add(ws)
+        try:
+            async for _ in ws:
+                pass
+        finally:
+            self.websockets.discard(ws)
+        return ws
+
+    async def auto_mining(self):
+        while True:
+            await asyncio.sleep(self.block_span)
+            await self.new_block()
+
+    async def start(self, host='127.0.0.1', port=0) -> str:
+        """return REST_API url"""
+        app = web.Application(middlewares=[self.rest_middleware])
+        app.router.add_post('/', self.json_rpc)
+        app.router.add_get('/public/getsysteminfo', self.system_info)
+        app.router.add_get('/public/getchaininfo', self.chain_info)
+        app.router.add_get('/public/getblockbyhash', self.get_block_by_hash)
+        app.router.add_get('/public/getblockbyheight', self.get_block_by_height)
+        app.router.add_get('/public/gettxbyhash', self.get_tx_by_hash)
+        app.router.add_post('/private/sendmany', self.sendmany)
+        app.router.add_get('/public/ws', self.websocket)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        if self.block_span:
+            self.mining_task = asyncio.ensure_future(self.auto_mining())
+        log.info(f"node simulator http://{host}:{port}")
+        return f"http://{host}:{port}"
+
+    async def close(self):
+        if self.mining_task:
+            self.mining_task.cancel()
+        await self.drop_websockets()
+        await self.runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3000)
+    parser.add_argument('--hrp', default='test')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--block-span', type=float, default=30.0)
+    parser.add_argument('--txs', type=int, default=0, help='unconfirmed txs in template')
+    parser.add_argument('--tx-size', type=int, default=250)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    algorithms = [C.BLOCK_YES_POW, C.BLOCK_X16S_POW, C.BLOCK_X11_POW]
+    node = NodeSimulator(args.hrp, args.seed, algorithms, args.txs, args.tx_size, block_span=args.block_span,
+                         latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    loop = asyncio.get_event_loop()
+    url = loop.run_until_complete(node.start(args.host, args.port))
+    print(f"Const.REST_API = '{url}'")
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        loop.run_until_complete(node.close())
+
+
+if __name__ == '__main__':
+    main()